@@ -0,0 +1,114 @@
+#!env/bin/python
+
+"""
+Benchmark of creating and destroying many txzmq connections.
+
+    examples/connection_churn.py --count=5000 --rounds=3
+
+Reports connection create/destroy rate, resident memory per live
+connection and time reactor is blocked by factory shutdown
+(synchronous vs. asynchronous) while messages are queued to absent
+peer, so that sockets linger on close.
+"""
+import gc
+import os
+import resource
+import sys
+import time
+from optparse import OptionParser
+
+from twisted.internet import reactor, defer, task
+
+rootdir = os.path.realpath(os.path.join(os.path.dirname(sys.argv[0]), '..'))
+sys.path.insert(0,rootdir)
+os.chdir(rootdir)
+
+from txzmq import ZmqEndpoint, ZmqFactory, ZmqPullConnection
+from txzmq import ZmqPushConnection
+
+
+parser = OptionParser("")
+parser.add_option("-c", "--count", dest="count", type="int", help="Number of connections per round")
+parser.add_option("-r", "--rounds", dest="rounds", type="int", help="Number of rounds")
+parser.add_option("-e", "--endpoint", dest="endpoint", help="0MQ Endpoint to bind sink to and connect to")
+parser.add_option("-a", "--absent", dest="absent", help="0MQ Endpoint nobody listens on, for shutdown comparison")
+parser.set_defaults(count=2000, rounds=3, endpoint="tcp://127.0.0.1:5557",
+                    absent="tcp://127.0.0.1:5558")
+
+(options, args) = parser.parse_args()
+
+
+def rss():
+    """
+    Resident set size of the process, bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # peak RSS, kilobytes on Linux, bytes on OS X
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Sink(ZmqPullConnection):
+    def onPull(self, message):
+        pass
+
+
+def churn(factory):
+    e = ZmqEndpoint('connect', options.endpoint)
+    gc.collect()
+    before = rss()
+
+    start = time.time()
+    connections = [ZmqPushConnection(factory, e)
+                   for _ in xrange(options.count)]
+    created = time.time() - start
+    perConnection = float(rss() - before) / options.count
+
+    start = time.time()
+    for connection in connections:
+        connection.shutdown()
+    destroyed = time.time() - start
+    del connections
+
+    print "created %d connections: %.0f/s, %.0f bytes RSS each; " \
+        "destroyed: %.0f/s" % (options.count, options.count / created,
+                               perConnection, options.count / destroyed)
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        factory = ZmqFactory()
+        # connections of every round connect to this sink
+        Sink(factory, ZmqEndpoint('bind', options.endpoint))
+        for _ in xrange(options.rounds):
+            churn(factory)
+        factory.shutdown()
+
+        for shutdown in ('shutdown', 'shutdownAsync'):
+            factory = ZmqFactory()
+            # peer is absent, pushed messages stay queued in the pipe,
+            # so socket lingers on close
+            connections = [ZmqPushConnection(factory, ZmqEndpoint(
+                'connect', options.absent)) for _ in xrange(options.count)]
+            for connection in connections:
+                connection.push('payload')
+            del connections
+            # let connections hand messages over to ZeroMQ
+            yield task.deferLater(reactor, 0.1, lambda: None)
+
+            start = time.time()
+            d = defer.maybeDeferred(getattr(factory, shutdown))
+            blocked = time.time() - start
+            yield d
+            print "%s of %d connections: reactor blocked %.3fs, " \
+                "done in %.3fs" % (shutdown, options.count, blocked,
+                                   time.time() - start)
+    finally:
+        reactor.stop()
+
+
+reactor.callWhenRunning(main)
+reactor.run()
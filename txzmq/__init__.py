@@ -1,15 +1,49 @@
 """
 ZeroMQ integration into Twisted reactor.
 """
+from txzmq.cache import ZmqRequestCache
+from txzmq.capture import ZmqCaptureLog, ZmqCaptureTap, ZmqReplay
+from txzmq.clone import ZmqClonePublisher, ZmqCloneSubscriber
 from txzmq.connection import ZmqConnection, ZmqEndpoint, ZmqEndpointType
+from txzmq.discovery import ZmqEndpointDiscovery
 from txzmq.factory import ZmqFactory
-from txzmq.pubsub import ZmqPubConnection, ZmqSubConnection
+from txzmq.heartbeat import ZmqPeerLostError
+from txzmq.monitor import ZmqSocketEvent, ZmqSocketMonitor
+from txzmq.pacing import ZmqPacer, ZmqPacingUnit
+from txzmq.pipeline import ZmqAckedPullConnection, ZmqAckedPushConnection
+from txzmq.pipeline import ZmqTaskFailedError
+from txzmq.pool import ZmqREQPool
+from txzmq.profiling import ZmqDispatchProfiler
+from txzmq.pubsub import ZmqPubConnection, ZmqSubConnection, ZmqSequencing
 from txzmq.pushpull import ZmqPushConnection, ZmqPullConnection
+from txzmq.pushpull import ZmqDurablePushConnection
+from txzmq.reliable import ZmqReliableREQClient
 from txzmq.req_rep import ZmqREQConnection, ZmqREPConnection
+from txzmq.req_rep import ZmqRequestTimeoutError
 from txzmq.router_dealer import ZmqRouterConnection, ZmqDealerConnection
+from txzmq.scatter import ZmqGatherPolicy, ZmqScatterGatherError
+from txzmq.scatter import ZmqREQScatter, ZmqScatterRouterConnection
+from txzmq.sharding import ZmqShardedPublisher, ZmqShardedSubscriber
+from txzmq.simulation import ZmqSimulatedFactory
+from txzmq.streaming import ZmqStreamSenderConnection
+from txzmq.streaming import ZmqStreamReceiverConnection
+from txzmq.tracing import ZmqTracingREQConnection, ZmqTracingREPConnection
 
 
 __all__ = ['ZmqConnection', 'ZmqEndpoint', 'ZmqEndpointType', 'ZmqFactory',
            'ZmqPushConnection', 'ZmqPullConnection', 'ZmqPubConnection',
            'ZmqSubConnection', 'ZmqREQConnection', 'ZmqREPConnection',
-           'ZmqRouterConnection', 'ZmqDealerConnection']
+           'ZmqRouterConnection', 'ZmqDealerConnection', 'ZmqPeerLostError',
+           'ZmqRequestTimeoutError', 'ZmqReliableREQClient', 'ZmqREQPool',
+           'ZmqDurablePushConnection', 'ZmqClonePublisher',
+           'ZmqCloneSubscriber', 'ZmqSequencing', 'ZmqSimulatedFactory',
+           'ZmqDispatchProfiler', 'ZmqSocketEvent', 'ZmqSocketMonitor',
+           'ZmqEndpointDiscovery', 'ZmqStreamSenderConnection',
+           'ZmqStreamReceiverConnection', 'ZmqGatherPolicy',
+           'ZmqScatterGatherError', 'ZmqREQScatter',
+           'ZmqScatterRouterConnection', 'ZmqRequestCache',
+           'ZmqShardedPublisher', 'ZmqShardedSubscriber', 'ZmqCaptureLog',
+           'ZmqCaptureTap', 'ZmqReplay', 'ZmqTracingREQConnection',
+           'ZmqTracingREPConnection', 'ZmqPacer', 'ZmqPacingUnit',
+           'ZmqAckedPushConnection', 'ZmqAckedPullConnection',
+           'ZmqTaskFailedError']
@@ -0,0 +1,191 @@
+"""
+Client-side cache of replies to idempotent requests.
+"""
+from collections import OrderedDict
+
+from twisted.internet import defer
+
+
+class ZmqRequestCache(object):
+    """
+    Memoizing wrapper of request client (L{ZmqREQConnection},
+    L{ZmqREQPool}, L{ZmqReliableREQClient} or anything with C{sendMsg}
+    returning Deferred).
+
+    Replies are cached by request message parts for C{ttl} seconds, cache
+    is bounded by number of entries and/or total size of replies, least
+    recently used entries are evicted first. Concurrent identical requests
+    are coalesced: only the first one is sent, the rest wait for its reply.
+    Failures are not cached, they are delivered to all waiting callers.
+
+    Every caller gets its own Deferred and its own copy of the reply;
+    cancelling the Deferred affects only this caller, request on the wire
+    is cancelled when all its callers have cancelled.
+
+    @ivar client: wrapped request client
+    @ivar ttl: time to keep replies, seconds, C{None} for no expiry
+    @type ttl: C{float}
+    @ivar maxEntries: maximum number of cached replies, C{None} for no limit
+    @type maxEntries: C{int}
+    @ivar maxBytes: maximum total size of cached replies, C{None} for
+        no limit
+    @type maxBytes: C{int}
+    @ivar size: total size of cached replies
+    @type size: C{int}
+    @ivar hits: number of requests answered from cache
+    @type hits: C{int}
+    @ivar misses: number of requests sent to the client
+    @type misses: C{int}
+    @ivar coalesced: number of requests which waited for identical
+        request in flight
+    @type coalesced: C{int}
+    @ivar evictions: number of replies evicted or expired
+    @type evictions: C{int}
+    """
+
+    def __init__(self, client, ttl=None, maxEntries=None, maxBytes=None,
+                 clock=None):
+        """
+        Constructor.
+
+        @param client: request client to wrap
+        @param ttl: time to keep replies, seconds, C{None} for no expiry
+        @type ttl: C{float}
+        @param maxEntries: maximum number of cached replies
+        @type maxEntries: C{int}
+        @param maxBytes: maximum total size of cached replies
+        @type maxBytes: C{int}
+        @param clock: time source, reactor of the client's factory
+            by default
+        """
+        self.client = client
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.clock = clock if clock is not None else client.factory.reactor
+
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        # request -> (expiry time, reply, size)
+        self._entries = OrderedDict()
+        # request -> (Deferred on the wire, list of waiting Deferreds)
+        self._inFlight = {}
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.client)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sendMsg(self, *messageParts, **kwargs):
+        """
+        Send request unless reply is cached or identical request is
+        in flight.
+
+        Keyword arguments are passed to C{sendMsg} of the client when
+        request is actually sent.
+
+        @param messageParts: message data
+        @type messageParts: C{tuple}
+        @return: Deferred that will fire with the reply
+        """
+        entry = self._entries.get(messageParts)
+        if entry is not None:
+            if entry[0] is None or entry[0] > self.clock.seconds():
+                self._entries[messageParts] = self._entries.pop(messageParts)
+                self.hits += 1
+                return defer.succeed(list(entry[1]))
+            self._evict(messageParts)
+
+        d = defer.Deferred(
+            canceller=lambda d: self._cancel(messageParts, d))
+        if messageParts in self._inFlight:
+            self._inFlight[messageParts][1].append(d)
+            self.coalesced += 1
+            return d
+
+        self.misses += 1
+        request = self.client.sendMsg(*messageParts, **kwargs)
+        self._inFlight[messageParts] = (request, [d])
+        request.addCallbacks(self._gotReply, self._requestFailed,
+                             callbackArgs=(messageParts,),
+                             errbackArgs=(messageParts,))
+        return d
+
+    def invalidate(self, *messageParts):
+        """
+        Forget cached reply to the request.
+
+        @param messageParts: message data
+        @type messageParts: C{tuple}
+        """
+        if messageParts in self._entries:
+            entry = self._entries.pop(messageParts)
+            self.size -= entry[2]
+
+    def clear(self):
+        """
+        Forget all cached replies.
+        """
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """
+        Cache statistics.
+
+        @rtype: C{dict}
+        """
+        return {
+            'entries': len(self._entries),
+            'size': self.size,
+            'inFlight': len(self._inFlight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+        }
+
+    def _gotReply(self, reply, messageParts):
+        _, waiting = self._inFlight.pop(messageParts)
+
+        size = sum(map(len, reply))
+        expires = self.clock.seconds() + self.ttl \
+            if self.ttl is not None else None
+        self.invalidate(*messageParts)
+        self._entries[messageParts] = (expires, reply, size)
+        self.size += size
+        while self._entries and (
+                self.maxEntries is not None and
+                len(self._entries) > self.maxEntries or
+                self.maxBytes is not None and self.size > self.maxBytes):
+            self._evict(next(iter(self._entries)))
+
+        for d in waiting:
+            d.callback(list(reply))
+
+    def _requestFailed(self, failure, messageParts):
+        _, waiting = self._inFlight.pop(messageParts, (None, []))
+        for d in waiting:
+            d.errback(failure)
+
+    def _evict(self, messageParts):
+        self.invalidate(*messageParts)
+        self.evictions += 1
+
+    def _cancel(self, messageParts, d):
+        """
+        Caller has cancelled its Deferred: stop waiting for the reply,
+        cancel request on the wire if nobody else is waiting for it.
+        """
+        request, waiting = self._inFlight.get(messageParts, (None, []))
+        if d not in waiting:
+            return
+        waiting.remove(d)
+        if not waiting:
+            del self._inFlight[messageParts]
+            request.cancel()
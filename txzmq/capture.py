@@ -0,0 +1,442 @@
+"""
+Capturing traffic of connections into memory-mapped log and replaying it.
+"""
+import mmap
+import os
+import struct
+
+from twisted.internet import defer
+from twisted.python import log
+
+
+class ZmqCaptureDirection(object):
+    """
+    Direction of captured message.
+    """
+    received = 'R'
+    sent = 'S'
+
+
+class ZmqCaptureLog(object):
+    """
+    Append-only log of timestamped messages in memory-mapped file.
+
+    Log starts with header (magic and end offset) followed by records:
+    timestamp, direction and number of frames followed by length-prefixed
+    frames. File grows by doubling when record doesn't fit.
+
+    @ivar path: path to log file
+    @type path: C{str}
+    @ivar size: size of the file
+    @type size: C{int}
+    @ivar writeOffset: offset where next record would be written
+    @type writeOffset: C{int}
+    @ivar count: number of records appended since the log was opened
+    @type count: C{int}
+    """
+
+    MAGIC = 'TXZC'
+    HEADER = struct.Struct('!4sQ')
+    RECORD = struct.Struct('!dcI')
+    LENGTH = struct.Struct('!I')
+
+    def __init__(self, path, size=None):
+        """
+        Open existing log or create new one.
+
+        @param path: path to log file
+        @type path: C{str}
+        @param size: initial size of the new log, C{None} to open existing
+        @type size: C{int}
+        """
+        self.path = path
+        self.count = 0
+
+        if size is None:
+            fd = os.open(path, os.O_RDWR)
+            size = os.fstat(fd).st_size
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+            size = max(size, self.HEADER.size)
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+        self.size = size
+
+        magic, self.writeOffset = self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC:
+            if magic != '\0' * 4:
+                raise ValueError("%s is not a capture log" % path)
+            self.writeOffset = self.HEADER.size
+            self._writeHeader()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.path)
+
+    def append(self, timestamp, direction, frames):
+        """
+        Append message to the log.
+
+        @param timestamp: time of the message
+        @type timestamp: C{float}
+        @param direction: direction of the message
+        @type direction: L{ZmqCaptureDirection}
+        @param frames: message frames
+        @type frames: C{list} of C{str}
+        """
+        offset = self.writeOffset
+        end = offset + self.RECORD.size + \
+            self.LENGTH.size * len(frames) + sum(map(len, frames))
+        if end > self.size:
+            self._grow(end)
+
+        self.RECORD.pack_into(self._map, offset, timestamp, direction,
+                              len(frames))
+        offset += self.RECORD.size
+        for frame in frames:
+            self.LENGTH.pack_into(self._map, offset, len(frame))
+            offset += self.LENGTH.size
+            self._map[offset:offset + len(frame)] = frame
+            offset += len(frame)
+
+        # header goes last, so that crash never exposes partial record
+        self.writeOffset = offset
+        self._writeHeader()
+        self.count += 1
+
+    def records(self, direction=None):
+        """
+        Iterate over records of the log.
+
+        @param direction: only records of this direction, C{None} for all
+        @type direction: L{ZmqCaptureDirection}
+        @return: iterator of (timestamp, direction, frames)
+        """
+        offset = self.HEADER.size
+        while offset < self.writeOffset:
+            timestamp, recorded, count = self.RECORD.unpack_from(
+                self._map, offset)
+            offset += self.RECORD.size
+            frames = []
+            for _ in xrange(count):
+                length, = self.LENGTH.unpack_from(self._map, offset)
+                offset += self.LENGTH.size
+                frames.append(self._map[offset:offset + length])
+                offset += length
+            if direction is None or direction == recorded:
+                yield timestamp, recorded, frames
+
+    def flush(self):
+        """
+        Flush log contents to disk.
+        """
+        self._map.flush()
+
+    def close(self):
+        """
+        Close log file.
+        """
+        self._map.close()
+        self._map = None
+        os.close(self._fd)
+
+    def _grow(self, end):
+        size = self.size
+        while size < end:
+            size *= 2
+        self._map.close()
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self.size = size
+
+    def _writeHeader(self):
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, self.writeOffset)
+
+
+class ZmqCaptureTap(object):
+    """
+    Tap recording messages sent and received by the connection into
+    capture log.
+
+    Tap is installed on the connection with C{start} and removed with
+    C{stop}. Messages are timestamped by the reactor of the connection's
+    factory.
+
+    @ivar connection: tapped connection
+    @type connection: L{ZmqConnection}
+    @ivar log: capture log
+    @type log: L{ZmqCaptureLog}
+    """
+
+    def __init__(self, connection, log):
+        """
+        Constructor.
+
+        @param connection: connection to tap
+        @type connection: L{ZmqConnection}
+        @param log: capture log
+        @type log: L{ZmqCaptureLog}
+        """
+        self.connection = connection
+        self.log = log
+        self._clock = connection.factory.reactor
+
+    def __repr__(self):
+        return "%s(%r, %r)" % (
+            self.__class__.__name__, self.connection, self.log)
+
+    def start(self):
+        """
+        Start capturing.
+        """
+        self.connection.capture = self
+
+    def stop(self):
+        """
+        Stop capturing.
+        """
+        if self.connection.capture is self:
+            self.connection.capture = None
+
+    def sent(self, message):
+        """
+        Record message sent by the connection.
+
+        @param message: message data
+        """
+        if not hasattr(message, '__iter__'):
+            message = [message]
+        self.log.append(self._clock.seconds(), ZmqCaptureDirection.sent,
+                        message)
+
+    def received(self, message):
+        """
+        Record message received by the connection.
+
+        @param message: message data
+        @type message: C{list} of C{str}
+        """
+        self.log.append(self._clock.seconds(), ZmqCaptureDirection.received,
+                        message)
+
+
+class ZmqReplayReport(object):
+    """
+    Results of the replay.
+
+    Latency of the message is the delay between the time it should have
+    been injected according to the capture and the time injection has
+    completed (Deferred returned by injecting function has fired).
+
+    @ivar messages: number of messages replayed
+    @type messages: C{int}
+    @ivar bytes: total size of messages replayed
+    @type bytes: C{int}
+    @ivar duration: duration of the replay, seconds
+    @type duration: C{float}
+    @ivar latencies: latency of every message, seconds
+    @type latencies: C{list} of C{float}
+    @ivar errors: number of messages which failed to be injected
+    @type errors: C{int}
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.duration = 0.0
+        self.latencies = []
+        self.errors = 0
+
+    def __repr__(self):
+        return "%s(messages=%d, %.1f msg/s, %.1f B/s, latency %.6f..%.6f)" % (
+            self.__class__.__name__, self.messages, self.throughput(),
+            self.byteRate(), self.latency(0), self.latency(100))
+
+    def throughput(self):
+        """
+        Achieved throughput, messages per second.
+
+        @rtype: C{float}
+        """
+        return self.messages / self.duration if self.duration else 0.0
+
+    def byteRate(self):
+        """
+        Achieved throughput, bytes per second.
+
+        @rtype: C{float}
+        """
+        return self.bytes / self.duration if self.duration else 0.0
+
+    def latency(self, percentile):
+        """
+        Latency percentile.
+
+        @param percentile: percentile, from 0 to 100
+        @type percentile: C{float}
+        @return: latency, seconds
+        @rtype: C{float}
+        """
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = int(round((len(latencies) - 1) * percentile / 100.0))
+        return latencies[index]
+
+
+class ZmqReplay(object):
+    """
+    Replay of captured messages through the connection.
+
+    Messages are injected at original pace (C{speed} of 1), scaled pace
+    (C{speed} of 2 replays twice as fast) or as fast as possible
+    (C{speed} of C{None}, messages are injected in batches of
+    C{batchSize}, letting reactor run in between).
+
+    By default sent messages are sent again via C{send} of the connection,
+    received messages are passed to its handler as if they were received
+    again. Any other injecting function could be given; if it returns
+    Deferred, message is complete when Deferred fires. Captured messages
+    are complete frames, so messages sent by REQ connection start with
+    C{[messageId, '']} envelope, which should be stripped to wait for
+    replies: C{lambda frames: connection.sendMsg(*frames[2:])}.
+
+    @cvar batchSize: number of messages injected at once at full speed
+    @type batchSize: C{int}
+
+    @ivar report: replay results
+    @type report: L{ZmqReplayReport}
+    """
+
+    batchSize = 100
+
+    def __init__(self, connection, log, direction=ZmqCaptureDirection.sent,
+                 speed=1.0, inject=None):
+        """
+        Constructor.
+
+        @param connection: connection to replay messages through
+        @type connection: L{ZmqConnection}
+        @param log: capture log
+        @type log: L{ZmqCaptureLog}
+        @param direction: direction of messages to replay
+        @type direction: L{ZmqCaptureDirection}
+        @param speed: replay speed relative to original, C{None} for
+            maximum speed
+        @type speed: C{float}
+        @param inject: function injecting message frames
+        """
+        self.connection = connection
+        self.log = log
+        self.direction = direction
+        self.speed = speed
+        if inject is None:
+            if direction == ZmqCaptureDirection.sent:
+                inject = connection.send
+            else:
+                inject = connection._dispatch
+        self.inject = inject
+        self.report = ZmqReplayReport()
+
+        self._clock = connection.factory.reactor
+        self._records = None
+        self._next = None
+        self._call = None
+        self._pending = 0
+        self._deferred = None
+
+    def __repr__(self):
+        return "%s(%r, %r)" % (
+            self.__class__.__name__, self.connection, self.log)
+
+    def start(self):
+        """
+        Start replay.
+
+        @return: Deferred firing with L{ZmqReplayReport} when all messages
+            have been replayed and completed
+        """
+        self._deferred = defer.Deferred(canceller=lambda _: self.stop())
+        self._records = self.log.records(self.direction)
+        self._next = next(self._records, None)
+        self._start = self._clock.seconds()
+        self._origin = self._next[0] if self._next is not None else 0
+        self._schedule()
+        return self._deferred
+
+    def stop(self):
+        """
+        Stop replay, messages which haven't been injected yet are skipped.
+        """
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        self._next = None
+        self._finish()
+
+    def _due(self, timestamp):
+        """
+        Time the message should be injected at.
+        """
+        if self.speed is None:
+            return self._clock.seconds()
+        return self._start + (timestamp - self._origin) / self.speed
+
+    def _schedule(self):
+        if self._next is None:
+            self._finish()
+            return
+        if self.speed is None:
+            delay = 0
+        else:
+            delay = max(0, self._due(self._next[0]) - self._clock.seconds())
+        self._call = self._clock.callLater(delay, self._replay)
+
+    def _replay(self):
+        """
+        Inject all messages which are due.
+        """
+        self._call = None
+        now = self._clock.seconds()
+        injected = 0
+        while self._next is not None:
+            timestamp, _, frames = self._next
+            due = self._due(timestamp)
+            if due > now or self.speed is None and \
+                    injected == self.batchSize:
+                break
+            self._inject(frames, due)
+            injected += 1
+            self._next = next(self._records, None)
+        self._schedule()
+
+    def _inject(self, frames, due):
+        self.report.messages += 1
+        self.report.bytes += sum(map(len, frames))
+        self._pending += 1
+        d = defer.maybeDeferred(self.inject, frames)
+        d.addCallbacks(self._injected, self._injectFailed,
+                       callbackArgs=(due,))
+
+    def _injected(self, result, due):
+        self._pending -= 1
+        self.report.latencies.append(self._clock.seconds() - due)
+        self._finish()
+
+    def _injectFailed(self, failure):
+        log.err(failure, "Failed to replay message through %r" % (
+            self.connection,))
+        self._pending -= 1
+        self.report.errors += 1
+        self._finish()
+
+    def _finish(self):
+        """
+        Fire the deferred when replay is over and all messages completed.
+        """
+        if self._deferred is None or self._deferred.called or \
+                self._next is not None or self._pending or \
+                self._call is not None:
+            return
+        self.report.duration = self._clock.seconds() - self._start
+        self._deferred.callback(self.report)
@@ -0,0 +1,390 @@
+"""
+Last-value cache and snapshots for late-joining subscribers
+("Clone" pattern).
+"""
+import struct
+from collections import OrderedDict, deque
+
+from txzmq.pubsub import ZmqPubConnection, ZmqSequencing, ZmqSubConnection
+from txzmq.router_dealer import ZmqDealerConnection, ZmqRouterConnection
+
+
+# sequence numbers in snapshot protocol
+SEQUENCE = struct.Struct('!Q')
+
+# snapshot protocol commands
+SNAPSHOT_REQUEST = 'SNAPSHOT?'
+SNAPSHOT_ENTRY = 'ENTRY'
+SNAPSHOT_END = 'END'
+
+
+class ZmqLastValueCache(object):
+    """
+    Last published value (and its sequence number) for every tag.
+
+    Cache is bounded by number of entries and/or total size of values,
+    least recently updated tags are evicted first.
+
+    @ivar maxEntries: maximum number of tags, C{None} for no limit
+    @type maxEntries: C{int}
+    @ivar maxBytes: maximum total size of values, C{None} for no limit
+    @type maxBytes: C{int}
+    @ivar size: total size of values
+    @type size: C{int}
+    @ivar evictions: number of entries evicted so far
+    @type evictions: C{int}
+    """
+
+    def __init__(self, maxEntries=None, maxBytes=None):
+        """
+        Constructor.
+
+        @param maxEntries: maximum number of tags, C{None} for no limit
+        @type maxEntries: C{int}
+        @param maxBytes: maximum total size of values, C{None} for no limit
+        @type maxBytes: C{int}
+        """
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, tag):
+        return tag in self._entries
+
+    def get(self, tag):
+        """
+        Get last value for the tag.
+
+        @param tag: message tag
+        @type tag: C{str}
+        @return: sequence number and value or C{None}
+        @rtype: C{tuple}
+        """
+        return self._entries.get(tag)
+
+    def set(self, tag, sequence, message):
+        """
+        Update last value for the tag.
+
+        @param tag: message tag
+        @type tag: C{str}
+        @param sequence: sequence number of the message
+        @type sequence: C{int}
+        @param message: message data
+        @type message: C{str}
+        """
+        old = self._entries.pop(tag, None)
+        if old is not None:
+            self.size -= len(old[1])
+        self._entries[tag] = (sequence, message)
+        self.size += len(message)
+
+        while len(self._entries) > 1 and (
+                self.maxEntries is not None and
+                len(self._entries) > self.maxEntries or
+                self.maxBytes is not None and self.size > self.maxBytes):
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def items(self, prefix=''):
+        """
+        Entries with tags matching the prefix, least recently
+        updated first.
+
+        @param prefix: tag prefix
+        @type prefix: C{str}
+        @return: list of (tag, sequence, message)
+        @rtype: C{list}
+        """
+        return [(tag, sequence, message)
+                for tag, (sequence, message) in self._entries.iteritems()
+                if tag.startswith(prefix)]
+
+
+class ZmqSnapshotConnection(ZmqRouterConnection):
+    """
+    Serving snapshots of the last-value cache.
+
+    Snapshot request is C{[SNAPSHOT_REQUEST, prefix]}, reply is
+    a sequence of C{[SNAPSHOT_ENTRY, tag, sequence, message]} messages
+    for every entry matching prefix followed by
+    C{[SNAPSHOT_END, sequence]} with the sequence number of the last
+    published message.
+
+    @ivar publisher: publisher which maintains cache
+    @type publisher: L{ZmqClonePublisher}
+    """
+
+    publisher = None
+
+    def gotMessage(self, sender, message):
+        if message[0] != SNAPSHOT_REQUEST:
+            return
+
+        prefix = message[1] if len(message) > 1 else ''
+        for tag, sequence, value in self.publisher.cache.items(prefix):
+            self.send([sender, SNAPSHOT_ENTRY, tag, SEQUENCE.pack(sequence),
+                       value])
+        self.send([sender, SNAPSHOT_END,
+                   SEQUENCE.pack(self.publisher.updates.sequence)])
+
+
+class ZmqClonePubConnection(ZmqPubConnection):
+    """
+    Publishing updates of L{ZmqClonePublisher}.
+    """
+    sequencing = ZmqSequencing.publisher
+
+
+class ZmqClonePublisher(object):
+    """
+    Publisher keeping last value for every tag, so that new subscribers
+    could fetch snapshot via companion ROUTER socket.
+
+    Every message is published with sequence number of the publisher
+    (see L{ZmqSequencing.publisher}).
+
+    @cvar pubConnectionClass: class of updates connection
+    @cvar snapshotConnectionClass: class of snapshot connection
+
+    @ivar updates: updates publishing connection
+    @type updates: L{ZmqPubConnection}
+    @ivar snapshots: snapshot serving connection
+    @type snapshots: L{ZmqSnapshotConnection}
+    @ivar cache: last-value cache
+    @type cache: L{ZmqLastValueCache}
+    """
+
+    pubConnectionClass = ZmqClonePubConnection
+    snapshotConnectionClass = ZmqSnapshotConnection
+
+    def __init__(self, factory, updatesEndpoint, snapshotEndpoint,
+                 maxEntries=None, maxBytes=None):
+        """
+        Constructor.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        @param updatesEndpoint: endpoint of PUB socket
+        @type updatesEndpoint: L{ZmqEndpoint}
+        @param snapshotEndpoint: endpoint of snapshot ROUTER socket
+        @type snapshotEndpoint: L{ZmqEndpoint}
+        @param maxEntries: maximum number of cached tags
+        @type maxEntries: C{int}
+        @param maxBytes: maximum total size of cached values
+        @type maxBytes: C{int}
+        """
+        self.cache = ZmqLastValueCache(maxEntries, maxBytes)
+        self.updates = self.pubConnectionClass(factory, updatesEndpoint)
+        self.snapshots = self.snapshotConnectionClass(
+            factory, snapshotEndpoint)
+        self.snapshots.publisher = self
+
+    def publish(self, message, tag=''):
+        """
+        Broadcast L{message} with specified L{tag}, remembering it
+        as the last value.
+
+        @param message: message data
+        @type message: C{str}
+        @param tag: message tag
+        @type tag: C{str}
+        """
+        self.updates.publish(message, tag)
+        self.cache.set(tag, self.updates.sequence, message)
+
+    def shutdown(self):
+        """
+        Shutdown both connections.
+        """
+        self.updates.shutdown()
+        self.snapshots.shutdown()
+
+
+class ZmqCloneSubConnection(ZmqSubConnection):
+    """
+    Subscribing to sequenced updates of L{ZmqClonePublisher}.
+    """
+
+    subscriber = None
+
+    def messageReceived(self, message):
+        if not self._isSequenced(message):
+            return
+        tag, header, value = message
+        sequence = self._checkSequence(tag, header)
+        if sequence is not None:
+            self.subscriber._gotUpdate(tag, sequence, value)
+
+
+class ZmqCloneSnapshotConnection(ZmqDealerConnection):
+    """
+    Fetching snapshots from L{ZmqSnapshotConnection}.
+    """
+
+    subscriber = None
+
+    def gotMessage(self, message):
+        if message[0] == SNAPSHOT_ENTRY:
+            _, tag, sequence, value = message
+            self.subscriber._gotEntry(
+                tag, SEQUENCE.unpack(sequence)[0], value)
+        elif message[0] == SNAPSHOT_END:
+            self.subscriber._gotSnapshot(SEQUENCE.unpack(message[1])[0])
+
+
+class ZmqCloneSubscriber(object):
+    """
+    Subscriber which starts with the snapshot of last values and continues
+    with live updates.
+
+    Live updates are subscribed to before snapshot is requested; updates
+    received while snapshot is in progress are held back (at most
+    C{maxPending} of them, oldest are dropped first) and delivered
+    after the snapshot, skipping those already covered by it. Every value
+    is delivered to C{gotMessage} exactly once, in order of sequence
+    numbers after the snapshot.
+
+    Snapshot entries are delivered when the whole snapshot has been
+    received. If it isn't received in C{snapshotTimeout} seconds,
+    snapshot is requested again over new connection.
+
+    @cvar subConnectionClass: class of updates connection
+    @cvar snapshotConnectionClass: class of snapshot connection
+    @cvar snapshotTimeout: time to wait for snapshot before requesting
+        it again, seconds
+    @type snapshotTimeout: C{float}
+    @cvar maxPending: maximum number of updates held back while snapshot
+        is in progress
+    @type maxPending: C{int}
+
+    @ivar updates: updates subscribing connection
+    @type updates: L{ZmqCloneSubConnection}
+    @ivar snapshots: snapshot fetching connection
+    @type snapshots: L{ZmqCloneSnapshotConnection}
+    @ivar sequence: sequence number of the last delivered message,
+        C{None} until snapshot is received
+    @type sequence: C{int}
+    @ivar snapshotAttempts: number of times snapshot has been requested
+    @type snapshotAttempts: C{int}
+    @ivar dropped: number of updates dropped while snapshot was in
+        progress
+    @type dropped: C{int}
+    """
+
+    subConnectionClass = ZmqCloneSubConnection
+    snapshotConnectionClass = ZmqCloneSnapshotConnection
+    snapshotTimeout = 5.0
+    maxPending = 10000
+
+    def __init__(self, factory, updatesEndpoint, snapshotEndpoint,
+                 prefix=''):
+        """
+        Constructor.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        @param updatesEndpoint: endpoint of publisher PUB socket
+        @type updatesEndpoint: L{ZmqEndpoint}
+        @param snapshotEndpoint: endpoint of publisher snapshot socket
+        @type snapshotEndpoint: L{ZmqEndpoint}
+        @param prefix: tag prefix to subscribe to
+        @type prefix: C{str}
+        """
+        self.sequence = None
+        self.snapshotAttempts = 0
+        self.dropped = 0
+        self.factory = factory
+        self.snapshotEndpoint = snapshotEndpoint
+        self.prefix = prefix
+        self.snapshots = None
+        self._pending = deque()
+        self._entries = []
+        self._timeoutCall = None
+
+        self.updates = self.subConnectionClass(factory, updatesEndpoint)
+        self.updates.subscriber = self
+        self.updates.subscribe(prefix)
+
+        self._requestSnapshot()
+
+    def shutdown(self):
+        """
+        Shutdown both connections.
+        """
+        self.updates.shutdown()
+        self._stopSnapshot()
+
+    def _requestSnapshot(self):
+        """
+        Request snapshot over new connection.
+        """
+        self.snapshotAttempts += 1
+        self._entries = []
+        self.snapshots = self.snapshotConnectionClass(
+            self.factory, self.snapshotEndpoint)
+        self.snapshots.subscriber = self
+        self.snapshots.sendMultipart([SNAPSHOT_REQUEST, self.prefix])
+        self._timeoutCall = self.factory.reactor.callLater(
+            self.snapshotTimeout, self._snapshotTimedOut)
+
+    def _stopSnapshot(self):
+        """
+        Shutdown snapshot connection and cancel its timeout.
+        """
+        if self._timeoutCall is not None and self._timeoutCall.active():
+            self._timeoutCall.cancel()
+        self._timeoutCall = None
+        if self.snapshots is not None:
+            self.snapshots.shutdown()
+            self.snapshots = None
+
+    def _snapshotTimedOut(self):
+        self._timeoutCall = None
+        self._stopSnapshot()
+        self._requestSnapshot()
+
+    def gotMessage(self, message, tag):
+        """
+        Called for every value from snapshot and every live update.
+
+        @param message: message data
+        @param tag: message tag
+        """
+        raise NotImplementedError(self)
+
+    def snapshotReceived(self):
+        """
+        Called when snapshot has been completely delivered.
+        """
+
+    def _gotEntry(self, tag, sequence, message):
+        self._entries.append((tag, message))
+
+    def _gotSnapshot(self, sequence):
+        self.sequence = sequence
+        self._stopSnapshot()
+        entries, self._entries = self._entries, None
+        for tag, message in entries:
+            self.gotMessage(message, tag)
+        self.snapshotReceived()
+
+        pending, self._pending = self._pending, None
+        for tag, sequence, message in pending:
+            self._gotUpdate(tag, sequence, message)
+
+    def _gotUpdate(self, tag, sequence, message):
+        if self.sequence is None:
+            if len(self._pending) >= self.maxPending:
+                self._pending.popleft()
+                self.dropped += 1
+            self._pending.append((tag, sequence, message))
+        elif sequence > self.sequence:
+            self.sequence = sequence
+            self.gotMessage(message, tag)
@@ -1,17 +1,19 @@
 """
 ZeroMQ connection.
 """
-from collections import deque, namedtuple
+from collections import OrderedDict, deque, namedtuple
 
 from zmq.core import constants, error
-from zmq.core.socket import Socket
+from zmq.core.version import zmq_version_info
 
 from zope.interface import implements
 
 from twisted.internet.interfaces import IFileDescriptor, IReadDescriptor
-from twisted.internet import reactor
 from twisted.python import log
 
+from txzmq.heartbeat import HEARTBEAT_PING, ZmqHeartbeat
+from txzmq.memory import ZmqMemorySocket
+
 
 class ZmqEndpointType(object):
     """
@@ -24,10 +26,76 @@ class ZmqEndpointType(object):
 ZmqEndpoint = namedtuple('ZmqEndpoint', ['type', 'address'])
 
 
+# prefix of internal inproc:// endpoints libzmq itself talks to (socket
+# monitor), they are never served by in-memory fast path
+MONITOR_INPROC_PREFIX = 'inproc://txzmq.monitor.'
+
+
+# socket options which could be set declaratively: name -> (first libzmq
+# version supporting the option, first version which dropped it or None)
+SOCKET_OPTIONS = {
+    'AFFINITY': ((2, 0), None),
+    'BACKLOG': ((2, 1), None),
+    'HWM': ((2, 0), (3, 0)),
+    'SNDHWM': ((3, 0), None),
+    'RCVHWM': ((3, 0), None),
+    'SWAP': ((2, 0), (3, 0)),
+    'SNDBUF': ((2, 0), None),
+    'RCVBUF': ((2, 0), None),
+    'LINGER': ((2, 1), None),
+    'RATE': ((2, 0), None),
+    'RECOVERY_IVL': ((2, 0), None),
+    'MCAST_LOOP': ((2, 0), (3, 0)),
+    'RECONNECT_IVL': ((2, 1), None),
+    'RECONNECT_IVL_MAX': ((2, 1), None),
+    'MAXMSGSIZE': ((3, 0), None),
+    'TCP_KEEPALIVE': ((3, 2), None),
+    'TCP_KEEPALIVE_CNT': ((3, 2), None),
+    'TCP_KEEPALIVE_IDLE': ((3, 2), None),
+    'TCP_KEEPALIVE_INTVL': ((3, 2), None),
+    'DELAY_ATTACH_ON_CONNECT': ((3, 2), (4, 0)),
+    'IMMEDIATE': ((4, 0), None),
+    'CONFLATE': ((4, 0), None),
+    'ROUTER_MANDATORY': ((3, 2), None),
+}
+
+
+def socketOption(name):
+    """
+    Resolve socket option name to ZeroMQ constant, checking that option
+    is supported by ZeroMQ library in use.
+
+    @param name: option name (e.g. C{'SNDBUF'}) or ZeroMQ constant
+    @type name: C{str} or C{int}
+    @return: ZeroMQ constant
+    @rtype: C{int}
+    @raise ValueError: if option is unknown or not supported
+    """
+    if not isinstance(name, basestring):
+        return name
+
+    if name not in SOCKET_OPTIONS:
+        raise ValueError("Unknown socket option %r" % (name,))
+    since, until = SOCKET_OPTIONS[name]
+    version = zmq_version_info()[:2]
+    if version < since or until is not None and version >= until \
+            or not hasattr(constants, name):
+        raise ValueError("Socket option %s is not supported by libzmq %s" % (
+            name, '.'.join(map(str, zmq_version_info()))))
+    return getattr(constants, name)
+
+
 class ZmqConnection(object):
     """
     Connection through ZeroMQ, wraps up ZeroMQ socket.
 
+    Connection state is kept in slots, send queues and receive buffer
+    are allocated on first use, so that idle and receive-only connections
+    stay small. Connection classes of this package declare slots for
+    their own state as well. Instance dictionary is still there for
+    attributes of other subclasses, it's allocated only when such
+    attribute is set.
+
     @cvar socketType: socket type, from ZeroMQ
     @cvar allowLoopbackMulticast: is loopback multicast allowed?
     @type allowLoopbackMulticast: C{boolean}
@@ -36,6 +104,38 @@ class ZmqConnection(object):
     @cvar highWaterMark: hard limit on the maximum number of outstanding
         messages 0MQ shall queue in memory for any single peer
     @type highWaterMark: C{int}
+    @cvar heartbeatInterval: interval between heartbeats, seconds;
+        heartbeating is started automatically if set
+    @type heartbeatInterval: C{float}
+    @cvar heartbeatLiveness: number of heartbeat intervals without
+        incoming traffic before peer is considered lost
+    @type heartbeatLiveness: C{int}
+    @cvar socketOptions: socket options set on every socket, option names
+        (see L{SOCKET_OPTIONS}) or ZeroMQ constants mapped to values;
+        override options of the factory
+    @type socketOptions: C{dict}
+    @cvar readBatchSize: maximum number of messages received in one
+        C{doRead}, rest are received on next reactor iteration,
+        C{None} for no limit
+    @type readBatchSize: C{int}
+    @cvar adaptiveHighWaterMark: C{(low, high)} limits for adaptive high
+        water mark, C{1 <= low <= high}, or C{None} to disable adaptation;
+        adapted high water mark applies only to peers connected after
+        the change
+    @type adaptiveHighWaterMark: C{tuple}
+    @cvar conflate: deliver only the newest message for every key
+        (see C{conflationKey}) among messages received in one C{doRead}
+    @type conflate: C{bool}
+    @cvar drainTimeout: how long socket replaced on endpoint change is kept
+        open, seconds (see L{setEndpoints})
+    @type drainTimeout: C{float}
+    @cvar priorities: number of priority levels of outgoing messages
+        (see L{send})
+    @type priorities: C{int}
+    @cvar priorityWeights: number of messages sent from every priority
+        level in one round (at least 1), C{None} to always send messages
+        of higher priority first
+    @type priorityWeights: C{tuple} of C{int}
 
     @ivar factory: ZeroMQ Twisted factory reference
     @type factory: L{ZmqFactory}
@@ -45,17 +145,58 @@ class ZmqConnection(object):
     @type endpoints: C{list} of L{ZmqEndpoint}
     @ivar fd: file descriptor of zmq mailbox
     @type fd: C{int}
-    @ivar queue: output message queue
+    @ivar queue: output message queue (of the lowest priority)
     @type queue: C{deque}
+    @ivar lanes: output message queues by priority, highest priority first
+    @type lanes: C{list} of C{deque}
+    @ivar heartbeat: heartbeat state, if heartbeating is enabled
+    @type heartbeat: L{ZmqHeartbeat}
+    @ivar currentHighWaterMark: high water mark set by adaptation
+    @type currentHighWaterMark: C{int}
+    @ivar conflated: number of messages dropped by conflation
+    @type conflated: C{int}
+    @ivar monitor: socket event monitor, if monitoring is enabled
+    @type monitor: L{ZmqSocketMonitor}
+    @ivar capture: traffic capture tap, if capturing is enabled
+    @type capture: L{ZmqCaptureTap}
+    @ivar pacer: pacer of outgoing messages, if pacing is enabled
+    @type pacer: L{ZmqPacer}
+    @ivar inproc: does connection use in-memory socket of the factory
+        instead of ZeroMQ one? It does if factory has C{inprocFastPath}
+        enabled and first endpoints of the connection (passed to
+        constructor or added later) are C{inproc://} ones; such
+        connection could have only C{inproc://} endpoints and talk only
+        to other in-memory connections. Options set directly on the
+        socket before the first endpoints are added don't survive
+        switching to in-memory socket.
+    @type inproc: C{bool}
     """
     implements(IReadDescriptor, IFileDescriptor)
 
+    __slots__ = ('factory', 'socket', 'fd', 'endpoints', 'identity',
+                 'recv_parts', 'scheduled_doRead', 'heartbeat', 'conflated',
+                 'monitor', 'inproc', 'currentHighWaterMark',
+                 '_socketOptions', '_retired', '_lanes', '_lane', '_credits',
+                 '__dict__', '__weakref__')
+
     socketType = None
     allowLoopbackMulticast = False
     multicastRate = 100
     highWaterMark = 0
-
-    def __init__(self, factory, endpoint=None, identity=None):
+    heartbeatInterval = None
+    heartbeatLiveness = 3
+    socketOptions = {}
+    readBatchSize = None
+    adaptiveHighWaterMark = None
+    conflate = False
+    drainTimeout = 5.0
+    priorities = 1
+    priorityWeights = None
+    capture = None
+    pacer = None
+
+    def __init__(self, factory, endpoint=None, identity=None,
+                 socketOptions=None):
         """
         Constructor.
 
@@ -68,23 +209,52 @@ class ZmqConnection(object):
         @type endpoint: C{list} of L{ZmqEndpoint}
         @param identity: socket identity (ZeroMQ)
         @type identity: C{str}
+        @param socketOptions: socket options, override C{socketOptions}
+            of the class and the factory
+        @type socketOptions: C{dict}
         """
+        # validate options before socket is created
+        options = {}
+        for source in (factory.socketOptions, self.socketOptions,
+                       socketOptions or {}):
+            for name, value in source.iteritems():
+                options[socketOption(name)] = value
+        if self.adaptiveHighWaterMark is not None:
+            low, high = self.adaptiveHighWaterMark
+            if not 1 <= low <= high:
+                raise ValueError("Invalid adaptive high water mark %r" % (
+                    self.adaptiveHighWaterMark,))
+        if self.priorityWeights is not None and (
+                len(self.priorityWeights) != self.priorities or
+                not all(isinstance(weight, (int, long)) and weight >= 1
+                        for weight in self.priorityWeights)):
+            raise ValueError(
+                "Expected %d priority weights, integers of at least 1, "
+                "got %r" % (self.priorities, self.priorityWeights))
+
         self.factory = factory
         self.endpoints = []
         self.identity = identity
-        self.socket = Socket(factory.context, self.socketType)
-        self.queue = deque()
-        self.recv_parts = []
+        self._lanes = None
+        self.recv_parts = None
         self.scheduled_doRead = None
-
+        self.heartbeat = None
+        self.conflated = 0
+        self.monitor = None
+        self.inproc = endpoint is not None and \
+            self._fastPath([endpoint])
+        self.currentHighWaterMark = None
+        self._socketOptions = options
+        self._retired = ()
+        self._lane = None
+        self._credits = list(self.priorityWeights) \
+            if self.priorityWeights else ()
+
+        self.socket = self._createSocket()
         self.fd = self.socket.getsockopt(constants.FD)
-        self.socket.setsockopt(constants.LINGER, factory.lingerPeriod)
-        self.socket.setsockopt(
-            constants.MCAST_LOOP, int(self.allowLoopbackMulticast))
-        self.socket.setsockopt(constants.RATE, self.multicastRate)
-        self.socket.setsockopt(constants.HWM, self.highWaterMark)
-        if self.identity is not None:
-            self.socket.setsockopt(constants.IDENTITY, self.identity)
+
+        if self.adaptiveHighWaterMark is not None:
+            self._setHighWaterMark(self.adaptiveHighWaterMark[0])
 
         if endpoint:
             self.addEndpoints([endpoint])
@@ -93,6 +263,9 @@ class ZmqConnection(object):
 
         self.factory.reactor.addReader(self)
 
+        if self.heartbeatInterval is not None:
+            self.startHeartbeat()
+
     def addEndpoints(self, endpoints):
         """
         Add more connection endpoints. Connection may have
@@ -101,13 +274,91 @@ class ZmqConnection(object):
         @param endpoints: list of endpoints to add
         @type endpoints: C{list}
         """
+        if not self.endpoints and not self.inproc and \
+                self._fastPath(endpoints):
+            self._useInprocSocket()
         self.endpoints.extend(endpoints)
         self._connectOrBind(endpoints)
 
+    def removeEndpoints(self, endpoints):
+        """
+        Remove connection endpoints: disconnect from or unbind them.
+
+        See L{setEndpoints} for details.
+
+        @param endpoints: list of endpoints to remove
+        @type endpoints: C{list}
+        """
+        for endpoint in endpoints:
+            if endpoint not in self.endpoints:
+                raise ValueError("Unknown endpoint %r" % (endpoint,))
+        self.setEndpoints(
+            [endpoint for endpoint in self.endpoints
+             if endpoint not in endpoints])
+
+    def setEndpoints(self, endpoints):
+        """
+        Replace connection endpoints with the new set.
+
+        New endpoints are connected (bound) before old ones are
+        disconnected, so there's always endpoint to send messages through.
+        Messages queued in the connection are kept.
+
+        If ZeroMQ doesn't support disconnecting (libzmq before 3.2), socket
+        is replaced with the new one; old socket is kept open for
+        C{drainTimeout} seconds, so that messages it has queued are sent
+        and replies to them are received. Bound endpoints can't be kept
+        in this case (old socket still holds them).
+
+        @param endpoints: new list of endpoints
+        @type endpoints: C{list}
+        @raise ValueError: if bound endpoint should be kept while others
+            are removed, but socket can't unbind
+        """
+        added = [endpoint for endpoint in endpoints
+                 if endpoint not in self.endpoints]
+        removed = [endpoint for endpoint in self.endpoints
+                   if endpoint not in endpoints]
+
+        if not removed:
+            self.addEndpoints(added)
+        elif self._canDisconnect():
+            self._connectOrBind(added)
+            self._disconnectOrUnbind(removed)
+            self.endpoints = [endpoint for endpoint in self.endpoints
+                              if endpoint not in removed] + added
+        else:
+            self._replaceSocket(list(endpoints))
+
+    def setSocketOptions(self, options):
+        """
+        Set socket options.
+
+        Most options affect only connections (pipes) established after
+        the option has been set, so options should be usually set
+        before adding endpoints.
+
+        @param options: option names (see L{SOCKET_OPTIONS}) or ZeroMQ
+            constants mapped to values
+        @type options: C{dict}
+        @raise ValueError: if option isn't supported by ZeroMQ library
+        """
+        options = [(socketOption(name), value)
+                   for name, value in options.iteritems()]
+        for option, value in options:
+            self.socket.setsockopt(option, value)
+            self._socketOptions[option] = value
+
     def shutdown(self):
         """
         Shutdown connection and socket.
         """
+        self.stopHeartbeat()
+        if self.monitor is not None:
+            self.monitor.stop()
+        if self.pacer is not None:
+            self.pacer.stop()
+
         self.factory.reactor.removeReader(self)
 
         self.factory.connections.discard(self)
@@ -115,6 +366,9 @@ class ZmqConnection(object):
         self.socket.close()
         self.socket = None
 
+        for retired in self._retired[:]:
+            retired.close()
+
         self.factory = None
 
         if self.scheduled_doRead is not None:
@@ -125,6 +379,30 @@ class ZmqConnection(object):
         return "%s(%r, %r)" % (
             self.__class__.__name__, self.factory, self.endpoints)
 
+    @property
+    def lanes(self):
+        """
+        Output message queues by priority, allocated on first use.
+        """
+        if self._lanes is None:
+            self._lanes = [deque() for _ in xrange(self.priorities)]
+        return self._lanes
+
+    @property
+    def queue(self):
+        """
+        Output message queue of the lowest priority.
+        """
+        return self.lanes[-1]
+
+    def hasQueued(self):
+        """
+        Are there messages waiting in send queues?
+
+        @rtype: C{bool}
+        """
+        return self._lanes is not None and any(self._lanes)
+
     def fileno(self):
         """
         Part of L{IFileDescriptor}.
@@ -159,9 +437,12 @@ class ZmqConnection(object):
         or raising exception (in case of no more messages available).
         """
         while True:
-            self.recv_parts.append(self.socket.recv(constants.NOBLOCK))
+            part = self.socket.recv(constants.NOBLOCK)
+            if self.recv_parts is None:
+                self.recv_parts = []
+            self.recv_parts.append(part)
             if not self.socket.getsockopt(constants.RCVMORE):
-                result, self.recv_parts = self.recv_parts, []
+                result, self.recv_parts = self.recv_parts, None
 
                 return result
 
@@ -182,21 +463,19 @@ class ZmqConnection(object):
 
         events = self.socket.getsockopt(constants.EVENTS)
         if (events & constants.POLLOUT) == constants.POLLOUT:
-            while self.queue:
-                try:
-                    self.socket.send(
-                        self.queue[0][1], constants.NOBLOCK | self.queue[0][0])
-                except error.ZMQError as e:
-                    if e.errno == constants.EAGAIN:
-                        break
-                    self.queue.popleft()
-                    raise e
-
-                self.queue.popleft()
+            self._sendQueued()
+        if self.adaptiveHighWaterMark is not None:
+            self._adaptHighWaterMark()
         if (events & constants.POLLIN) == constants.POLLIN:
+            received = 0
+            latest = OrderedDict() if self.conflate else None
             while True:
                 if self.factory is None:  # disconnected
                     return
+                if received == self.readBatchSize:
+                    # let other connections run, continue later
+                    self._scheduleDoRead()
+                    break
                 try:
                     message = self._readMultipart()
                 except error.ZMQError as e:
@@ -205,7 +484,19 @@ class ZmqConnection(object):
 
                     raise e
 
-                log.callWithLogger(self, self.messageReceived, message)
+                received += 1
+                if self.heartbeat is not None:
+                    self.heartbeat.touch()
+                if latest is not None:
+                    self._conflateMessage(latest, message)
+                else:
+                    self._dispatch(message)
+
+            if latest:
+                for message in latest.itervalues():
+                    if self.factory is None:  # disconnected
+                        return
+                    self._dispatch(message)
 
     def logPrefix(self):
         """
@@ -216,20 +507,39 @@ class ZmqConnection(object):
         """
         return 'ZMQ'
 
-    def send(self, message):
+    def send(self, message, priority=None):
         """
         Send message via ZeroMQ.
 
+        Messages of different priorities are queued separately: messages
+        of higher priority are sent first or, if C{priorityWeights} are
+        set, every priority level sends its weight of messages in turn.
+        Parts of multipart message are never interleaved with other
+        messages.
+
         @param message: message data
+        @param priority: priority level, from 0 (highest) to
+            C{priorities - 1} (lowest, the default)
+        @type priority: C{int}
         """
+        lanes = self.lanes
+        if priority is None:
+            queue = lanes[-1]
+        elif 0 <= priority < len(lanes):
+            queue = lanes[priority]
+        else:
+            raise ValueError("Priority should be from 0 to %d, got %r" % (
+                len(lanes) - 1, priority))
+        if self.capture is not None:
+            self.capture.sent(message)
+
         if not hasattr(message, '__iter__'):
-            self.queue.append((0, message))
+            queue.append((0, message))
         else:
-            self.queue.extend([(constants.SNDMORE, m) for m in message[:-1]])
-            self.queue.append((0, message[-1]))
+            queue.extend([(constants.SNDMORE, m) for m in message[:-1]])
+            queue.append((0, message[-1]))
 
-        if self.scheduled_doRead is None:
-            self.scheduled_doRead = reactor.callLater(0, self.doRead)
+        self._scheduleDoRead()
 
     def messageReceived(self, message):
         """
@@ -239,14 +549,460 @@ class ZmqConnection(object):
         """
         raise NotImplementedError(self)
 
-    def _connectOrBind(self, endpoints):
+    def _sendQueued(self):
+        """
+        Send queued messages until queues are empty or ZeroMQ
+        refuses more.
+        """
+        if self._lanes is None:
+            return
+        while True:
+            if self._lane is None:
+                # between messages, choose the queue to send from
+                if self.pacer is not None:
+                    self.pacer.release()
+                self._lane = self._nextLane()
+                if self._lane is None:
+                    break
+                if self.pacer is not None:
+                    admitted = self.pacer.admit(self._lane)
+                    if not admitted:
+                        self._lane = None
+                        if admitted is None:
+                            continue
+                        return
+            queue = self._lanes[self._lane]
+            while queue:
+                flags, frame = queue[0]
+                try:
+                    self.socket.send(frame, constants.NOBLOCK | flags)
+                except error.ZMQError as e:
+                    if e.errno == constants.EAGAIN:
+                        return
+                    queue.popleft()
+                    raise e
+
+                queue.popleft()
+                if not flags:
+                    break
+            if self._credits:
+                self._credits[self._lane] -= 1
+            self._lane = None
+
+    def _nextLane(self):
+        """
+        Choose priority level of the next message to send.
+
+        @return: index in C{lanes} or C{None} if there is nothing to send
+        @rtype: C{int}
+        """
+        if not self._credits:
+            for lane, queue in enumerate(self._lanes):
+                if queue:
+                    return lane
+            return None
+
+        for refill in (False, True):
+            if refill:
+                # round is over, start next one
+                self._credits[:] = self.priorityWeights
+            for lane, queue in enumerate(self._lanes):
+                if queue and self._credits[lane] > 0:
+                    return lane
+        return None
+
+    def _dispatch(self, message):
+        """
+        Pass incoming message to C{messageReceived}.
+
+        If factory has profiler installed, call goes through it, otherwise
+        handler is called directly with exceptions logged.
+
+        @param message: message data
+        """
+        if self.capture is not None:
+            self.capture.received(message)
+        profiler = self.factory.profiler
+        if profiler is not None:
+            profiler.dispatch(self, self.messageReceived, message)
+            return
+        try:
+            self.messageReceived(message)
+        except:
+            log.err(system=self.logPrefix())
+
+    def conflationKey(self, message):
+        """
+        Key of the message for conflation: when C{conflate} is set, only
+        the newest of messages with the same key received together
+        is delivered.
+
+        Could be overridden (or replaced with any callable) to conflate
+        messages by application-specific key.
+
+        @param message: message data
+        @return: conflation key, first part of the message by default
+        """
+        return message[0]
+
+    def _conflateMessage(self, latest, message):
+        """
+        Add received message to the messages pending delivery, replacing
+        older message with the same key.
+
+        @param latest: messages pending delivery by conflation key
+        @type latest: C{OrderedDict}
+        @param message: message data
+        """
+        key = self.conflationKey(message)
+        if key in latest:
+            del latest[key]
+            self.conflated += 1
+        latest[key] = message
+
+    def _scheduleDoRead(self):
+        """
+        Schedule call to C{doRead} on next reactor iteration.
+
+        ZeroMQ signals file descriptor only on state changes, so any
+        operation on the socket (sending, subscribing, etc.) may consume
+        the notification; socket events should be checked again after that.
+        """
+        if self.scheduled_doRead is None:
+            self.scheduled_doRead = self.factory.reactor.callLater(
+                0, self.doRead)
+
+    def _adaptHighWaterMark(self):
+        """
+        Adjust high water mark to the observed depth of outgoing queue.
+
+        If messages are left in the queue after sending, ZeroMQ queue is
+        full and high water mark is doubled (up to upper limit), when
+        queue is drained, high water mark is halved back towards lower limit.
+        New value applies only to peers connected after the change: ZeroMQ
+        sets high water mark on pipe creation, pipes to already connected
+        peers keep the old one.
+        """
+        low, high = self.adaptiveHighWaterMark
+        if self.hasQueued():
+            hwm = min(self.currentHighWaterMark * 2, high)
+        else:
+            hwm = max(self.currentHighWaterMark // 2, low)
+        if hwm != self.currentHighWaterMark:
+            self._setHighWaterMark(hwm)
+
+    def _setHighWaterMark(self, hwm):
+        """
+        Set both send and receive high water marks.
+
+        @param hwm: new high water mark
+        @type hwm: C{int}
+        """
+        self._applyHighWaterMark(self.socket, hwm)
+        self.currentHighWaterMark = hwm
+
+    @staticmethod
+    def _applyHighWaterMark(socket, hwm):
+        """
+        Set both send and receive high water marks on the socket.
+        """
+        if zmq_version_info() < (3, 0):
+            socket.setsockopt(constants.HWM, hwm)
+        else:
+            socket.setsockopt(constants.SNDHWM, hwm)
+            socket.setsockopt(constants.RCVHWM, hwm)
+
+    def startHeartbeat(self, interval=None, liveness=None):
+        """
+        Start heartbeating: send pings to the peer periodically and
+        watch for incoming traffic.
+
+        Connection type should support heartbeats by implementing
+        C{_sendHeartbeat}.
+
+        @param interval: interval between heartbeats, seconds
+            (defaults to C{heartbeatInterval})
+        @type interval: C{float}
+        @param liveness: number of heartbeat intervals without incoming
+            traffic before peer is considered lost (defaults to
+            C{heartbeatLiveness})
+        @type liveness: C{int}
+        """
+        self.stopHeartbeat()
+
+        if interval is None:
+            interval = self.heartbeatInterval
+        if liveness is None:
+            liveness = self.heartbeatLiveness
+        assert interval is not None, "Heartbeat interval is required"
+
+        self.heartbeat = ZmqHeartbeat(self, interval, liveness)
+        self.heartbeat.start()
+
+    def stopHeartbeat(self):
+        """
+        Stop heartbeating.
+        """
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+            self.heartbeat = None
+
+    def peerLost(self):
+        """
+        Called when peer has stopped responding to heartbeats.
+        """
+
+    def peerRecovered(self):
+        """
+        Called when peer which was considered lost responds again.
+        """
+
+    def socketEvent(self, event, value, address):
+        """
+        Called on socket event reported by L{ZmqSocketMonitor}.
+
+        @param event: event type, one of L{ZmqSocketEvent}
+        @type event: C{int}
+        @param value: event value (file descriptor, error code or
+            reconnect interval, depending on event type)
+        @type value: C{int}
+        @param address: endpoint address
+        @type address: C{str}
+        """
+
+    def _sendHeartbeat(self):
+        """
+        Send single heartbeat (ping) to the peer.
+        """
+        raise NotImplementedError(self)
+
+    def _sendPing(self, message):
+        """
+        Queue heartbeat ping with the highest priority, unless previous
+        one is still queued (peer is unreachable), so that pings don't
+        pile up and flood the peer on reconnect.
+
+        @param message: ping message, starting with C{HEARTBEAT_PING}
+        @type message: C{list} of C{str}
+        """
+        for flags, frame in self.lanes[0]:
+            if frame == HEARTBEAT_PING:
+                return
+        self.send(message, 0)
+
+    def _peerLost(self):
+        """
+        Heartbeat detected that peer has been lost.
+        """
+        self.peerLost()
+
+    def _peerRecovered(self):
+        """
+        Heartbeat detected that peer is alive again.
+        """
+        self.peerRecovered()
+
+    def _createSocket(self):
+        """
+        Create ZeroMQ socket with options of the connection.
+
+        @rtype: L{Socket}
+        """
+        if self.inproc:
+            socket = self.factory.inprocContext.socket(self.socketType)
+        else:
+            socket = self.factory.context.socket(self.socketType)
+        socket.setsockopt(constants.LINGER, self.factory.lingerPeriod)
+        socket.setsockopt(
+            constants.MCAST_LOOP, int(self.allowLoopbackMulticast))
+        socket.setsockopt(constants.RATE, self.multicastRate)
+        socket.setsockopt(constants.HWM, self.highWaterMark)
+        if self.identity is not None:
+            socket.setsockopt(constants.IDENTITY, self.identity)
+        for option, value in self._socketOptions.iteritems():
+            socket.setsockopt(option, value)
+        if self.currentHighWaterMark is not None:
+            self._applyHighWaterMark(socket, self.currentHighWaterMark)
+        return socket
+
+    def _fastPath(self, endpoints):
+        """
+        Should in-memory socket be used for the endpoints?
+
+        @param endpoints: first endpoints of the connection
+        @type endpoints: C{list} of L{ZmqEndpoint}
+        @rtype: C{bool}
+        """
+        if self.factory.inprocContext is None or not endpoints:
+            return False
+        for endpoint in endpoints:
+            if not endpoint.address.startswith('inproc://') or \
+                    endpoint.address.startswith(MONITOR_INPROC_PREFIX):
+                return False
+        return True
+
+    def _useInprocSocket(self):
+        """
+        Replace ZeroMQ socket, which has no endpoints yet, with in-memory
+        one.
+        """
+        registered = self in self.factory.connections
+        if registered:
+            self.factory.reactor.removeReader(self)
+        self.socket.close()
+        self.inproc = True
+        self.socket = self._createSocket()
+        self.fd = self.socket.getsockopt(constants.FD)
+        if registered:
+            self.factory.reactor.addReader(self)
+            self._scheduleDoRead()
+
+    def _replaceSocket(self, endpoints):
+        """
+        Replace socket with the new one connected to endpoints, retiring
+        the old one.
+
+        @param endpoints: endpoints of the new socket
+        @type endpoints: C{list} of L{ZmqEndpoint}
+        """
+        for endpoint in endpoints:
+            if endpoint.type == ZmqEndpointType.bind and \
+                    endpoint in self.endpoints:
+                raise ValueError(
+                    "Can't keep bound endpoint %r while removing others, "
+                    "unbinding requires libzmq 3.2, got %s" % (
+                        endpoint, '.'.join(map(str, zmq_version_info()))))
+
+        socket = self._createSocket()
+        try:
+            self._connectOrBind(endpoints, socket)
+        except:
+            socket.close()
+            raise
+
+        self.factory.reactor.removeReader(self)
+        old, self.socket = self.socket, socket
+        self.fd = socket.getsockopt(constants.FD)
+        self.endpoints = endpoints
+        self.factory.reactor.addReader(self)
+        self._scheduleDoRead()
+
+        if not self._retired:
+            self._retired = []
+        self._retired.append(
+            ZmqRetiredSocket(self, old, self.drainTimeout))
+
+    def _connectOrBind(self, endpoints, socket=None):
         """
         Connect and/or bind socket to endpoints.
         """
+        if socket is None:
+            socket = self.socket
+        if self.inproc:
+            for endpoint in endpoints:
+                if not endpoint.address.startswith('inproc://'):
+                    raise ValueError(
+                        "In-memory connection supports only inproc "
+                        "endpoints, got %r" % (endpoint,))
         for endpoint in endpoints:
             if endpoint.type == ZmqEndpointType.connect:
-                self.socket.connect(endpoint.address)
+                socket.connect(endpoint.address)
             elif endpoint.type == ZmqEndpointType.bind:
-                self.socket.bind(endpoint.address)
+                socket.bind(endpoint.address)
             else:
                 assert False, "Unknown endpoint type %r" % endpoint
+
+    def _canDisconnect(self):
+        """
+        Can socket disconnect from and unbind endpoints? In-memory sockets
+        can, ZeroMQ ones require libzmq 3.2.
+
+        @rtype: C{bool}
+        """
+        return isinstance(self.socket, ZmqMemorySocket) or \
+            zmq_version_info() >= (3, 2)
+
+    def _disconnectOrUnbind(self, endpoints):
+        """
+        Disconnect and/or unbind socket from endpoints.
+        """
+        for endpoint in endpoints:
+            if endpoint.type == ZmqEndpointType.connect:
+                self.socket.disconnect(endpoint.address)
+            elif endpoint.type == ZmqEndpointType.bind:
+                self.socket.unbind(endpoint.address)
+            else:
+                assert False, "Unknown endpoint type %r" % endpoint
+
+
+class ZmqRetiredSocket(object):
+    """
+    Socket replaced in L{ZmqConnection} by the new one.
+
+    Socket is kept open for a while, so that messages queued in it are
+    sent; incoming messages are delivered to the connection.
+
+    @ivar connection: connection which owned the socket
+    @type connection: L{ZmqConnection}
+    @ivar socket: ZeroMQ socket
+    @type socket: L{Socket}
+    @ivar fd: file descriptor of zmq mailbox
+    @type fd: C{int}
+    """
+    implements(IReadDescriptor, IFileDescriptor)
+
+    def __init__(self, connection, socket, timeout):
+        """
+        Constructor.
+
+        @param connection: connection which owned the socket
+        @type connection: L{ZmqConnection}
+        @param socket: ZeroMQ socket
+        @type socket: L{Socket}
+        @param timeout: close socket after that many seconds
+        @type timeout: C{float}
+        """
+        self.connection = connection
+        self.socket = socket
+        self.fd = socket.getsockopt(constants.FD)
+
+        reactor = connection.factory.reactor
+        reactor.addReader(self)
+        self._calls = [reactor.callLater(0, self.doRead),
+                       reactor.callLater(timeout, self.close)]
+
+    def fileno(self):
+        return self.fd
+
+    def logPrefix(self):
+        return self.connection.logPrefix()
+
+    def connectionLost(self, reason):
+        self.close()
+
+    def doRead(self):
+        """
+        Deliver messages received by the socket to the connection.
+        """
+        parts = []
+        while self.socket is not None and \
+                self.socket.getsockopt(constants.EVENTS) & constants.POLLIN:
+            parts.append(self.socket.recv(constants.NOBLOCK))
+            if self.socket.getsockopt(constants.RCVMORE):
+                continue
+            message, parts = parts, []
+            self.connection._dispatch(message)
+
+    def close(self):
+        """
+        Close the socket.
+        """
+        if self.socket is None:
+            return
+        for call in self._calls:
+            if call.active():
+                call.cancel()
+        self.connection.factory.reactor.removeReader(self)
+        self.connection._retired.remove(self)
+        self.socket.close()
+        self.socket = None
@@ -0,0 +1,132 @@
+"""
+Keeping connection endpoints in sync with service discovery.
+"""
+from twisted.internet import defer, task
+from twisted.python import log
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+
+
+def readEndpointsFile(path, defaultType=ZmqEndpointType.connect):
+    """
+    Read endpoints from the file.
+
+    File has one endpoint per line, either address alone or endpoint type
+    and address separated by whitespace; empty lines and lines starting
+    with C{#} are ignored::
+
+        tcp://10.0.0.1:5555
+        bind tcp://*:5556
+
+    @param path: path to the file
+    @type path: C{str}
+    @param defaultType: type of endpoints without explicit type
+    @type defaultType: C{str}
+    @return: endpoints
+    @rtype: C{list} of L{ZmqEndpoint}
+    @raise ValueError: if line has unknown endpoint type or too many
+        fields
+    """
+    endpoints = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) == 1:
+                fields.insert(0, defaultType)
+            if len(fields) != 2 or fields[0] not in (
+                    ZmqEndpointType.bind, ZmqEndpointType.connect):
+                raise ValueError("%s:%d: invalid endpoint %r" % (
+                    path, number, line))
+            endpoints.append(ZmqEndpoint(*fields))
+    return endpoints
+
+
+class ZmqEndpointDiscovery(object):
+    """
+    Periodically fetch endpoints from the source and apply them to the
+    connection with L{ZmqConnection.setEndpoints}.
+
+    Source is a callable returning list of endpoints (or Deferred firing
+    with it), e.g. C{lambda: readEndpointsFile(path)}. Endpoints are
+    changed only if set of endpoints has changed; empty list and source
+    failures are logged and ignored, keeping current endpoints.
+
+    @cvar interval: polling interval, seconds
+    @type interval: C{float}
+
+    @ivar connection: connection to update
+    @type connection: L{ZmqConnection}
+    @ivar source: source of endpoints
+    @ivar updates: number of times endpoints have been changed
+    @type updates: C{int}
+    """
+
+    interval = 5.0
+
+    def __init__(self, connection, source, interval=None):
+        """
+        Constructor.
+
+        @param connection: connection to update
+        @type connection: L{ZmqConnection}
+        @param source: callable returning list of endpoints or Deferred
+        @param interval: polling interval, seconds (defaults to C{interval})
+        @type interval: C{float}
+        """
+        self.connection = connection
+        self.source = source
+        if interval is not None:
+            self.interval = interval
+        self.updates = 0
+
+        self._call = task.LoopingCall(self.refresh)
+        self._call.clock = connection.factory.reactor
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.connection)
+
+    def start(self):
+        """
+        Start polling, first poll is done immediately.
+        """
+        self._call.start(self.interval, now=True)
+
+    def stop(self):
+        """
+        Stop polling.
+        """
+        if self._call.running:
+            self._call.stop()
+
+    def refresh(self):
+        """
+        Fetch endpoints from the source and apply them.
+
+        @return: Deferred firing when done
+        """
+        d = defer.maybeDeferred(self.source)
+        d.addCallback(self._gotEndpoints)
+        d.addErrback(log.err, "Failed to refresh endpoints of %r" % (
+            self.connection,))
+        return d
+
+    def _gotEndpoints(self, endpoints):
+        """
+        Apply endpoints fetched from the source.
+
+        @param endpoints: list of endpoints
+        @type endpoints: C{list} of L{ZmqEndpoint}
+        """
+        if self.connection.factory is None:  # connection is shut down
+            self.stop()
+            return
+        if not endpoints:
+            log.msg("No endpoints discovered for %r, keeping %r" % (
+                self.connection, self.connection.endpoints))
+            return
+        if set(endpoints) != set(self.connection.endpoints):
+            self.connection.setEndpoints(list(endpoints))
+            self.updates += 1
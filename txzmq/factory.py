@@ -1,9 +1,17 @@
 """
 ZeroMQ Twisted factory which is controlling ZeroMQ context.
 """
+from zmq.core import constants
 from zmq.core.context import Context
 
-from twisted.internet import reactor
+from twisted.internet import defer, reactor, threads
+
+from txzmq.connection import socketOption
+from txzmq.memory import ZmqMemoryContext, ZmqMemoryReactor
+
+
+# shared factories by name, see ZmqFactory.shared
+_factories = {}
 
 
 class ZmqFactory(object):
@@ -18,36 +26,110 @@ class ZmqFactory(object):
     @cvar: lingerPeriod: number of milliseconds to block when closing socket
         (terminating context), when there are some messages pending to be sent
     @type lingerPeriod: C{int}
+    @cvar socketOptions: socket options set on sockets of all connections
+        (see L{ZmqConnection.socketOptions})
+    @type socketOptions: C{dict}
+    @cvar profiler: dispatch profiler, see L{ZmqDispatchProfiler.enable}
+    @type profiler: L{ZmqDispatchProfiler}
+    @cvar inprocFastPath: connections created with C{inproc://} endpoint
+        bypass ZeroMQ and pass messages in memory (see L{ZmqConnection})
+    @type inprocFastPath: C{bool}
+    @cvar drainInterval: how often send queues are checked while
+        draining them on asynchronous shutdown, seconds
+    @type drainInterval: C{float}
 
     @ivar connections: set of instanciated L{ZmqConnection}s
     @type connections: C{set}
     @ivar context: ZeroMQ context
     @type context: L{Context}
+    @ivar inprocContext: in-memory context for C{inproc://} endpoints,
+        if C{inprocFastPath} is enabled
+    @type inprocContext: L{ZmqMemoryContext}
+    @ivar name: name of shared factory (see L{shared})
+    @type name: C{str}
+    @ivar references: number of references to shared factory
+    @type references: C{int}
     """
 
     reactor = reactor
     ioThreads = 1
     lingerPeriod = 100
+    socketOptions = {}
+    profiler = None
+    inprocFastPath = False
+    drainInterval = 0.01
+    name = None
+    references = 0
 
-    def __init__(self):
+    def __init__(self, socketOptions=None):
         """
         Constructor.
 
         Create ZeroMQ context.
+
+        @param socketOptions: socket options set on sockets of all
+            connections, override C{socketOptions} of the class
+        @type socketOptions: C{dict}
         """
+        if socketOptions is not None:
+            for name in socketOptions:
+                socketOption(name)
+            self.socketOptions = dict(self.socketOptions)
+            self.socketOptions.update(socketOptions)
         self.connections = set()
-        self.context = Context(self.ioThreads)
+        self.context = self._createContext()
+
+        self.inprocContext = None
+        if self.inprocFastPath:
+            self.reactor = ZmqMemoryReactor(self.reactor)
+            self.inprocContext = ZmqMemoryContext(self.reactor)
+
+    @classmethod
+    def shared(cls, name='default'):
+        """
+        Get factory shared within the process by name, creating it
+        if necessary.
+
+        Every call adds reference to the factory, which should be released
+        by calling C{shutdown}; factory is actually shut down when the last
+        reference is released. Connections could talk to each other via
+        C{inproc://} endpoints only within the same factory.
+
+        @param name: factory name
+        @type name: C{str}
+        @rtype: L{ZmqFactory}
+        """
+        factory = _factories.get(name)
+        if factory is None:
+            factory = _factories[name] = cls()
+            factory.name = name
+        factory.references += 1
+        return factory
 
     def __repr__(self):
         return "ZmqFactory()"
 
+    def _createContext(self):
+        """
+        Create ZeroMQ context.
+
+        @rtype: L{Context}
+        """
+        return Context(self.ioThreads)
+
     def shutdown(self):
         """
         Shutdown factory.
 
         This is shutting down all created connections
         and terminating ZeroMQ context.
+
+        Shared factory is shut down only when all references to it
+        are released.
         """
+        if not self._release():
+            return
+
         for connection in self.connections.copy():
             connection.shutdown()
 
@@ -55,6 +137,83 @@ class ZmqFactory(object):
 
         self.context.term()
         self.context = None
+        if self.inprocContext is not None:
+            self.inprocContext.term()
+            self.inprocContext = None
+
+    def shutdownAsync(self, timeout=5.0):
+        """
+        Shutdown factory without blocking the reactor.
+
+        Connections are given time to send their queued messages, then
+        they're shut down with sockets lingering for the rest of the
+        timeout (at most C{lingerPeriod}), and ZeroMQ context is terminated
+        in reactor thread pool.
+
+        Shared factory is shut down only when all references to it
+        are released.
+
+        @param timeout: time to drain send queues and linger, seconds
+        @type timeout: C{float}
+        @return: Deferred firing when context has been terminated
+        """
+        if not self._release():
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+        self._drain(self.reactor.seconds() + timeout, d)
+        return d
+
+    def _release(self):
+        """
+        Release reference to shared factory.
+
+        @return: should factory be shut down?
+        @rtype: C{bool}
+        """
+        if self.name is not None:
+            self.references -= 1
+            if self.references > 0:
+                return False
+            if _factories.get(self.name) is self:
+                del _factories[self.name]
+        return True
+
+    def _drain(self, deadline, d):
+        """
+        Wait until send queues of all connections are empty or deadline
+        has passed, then shutdown connections and terminate context.
+
+        @param deadline: time to stop waiting at
+        @type deadline: C{float}
+        @param d: Deferred to fire when context has been terminated
+        @type d: L{Deferred}
+        """
+        now = self.reactor.seconds()
+        if now < deadline and any(connection.hasQueued()
+                                  for connection in self.connections):
+            self.reactor.callLater(
+                min(self.drainInterval, deadline - now),
+                self._drain, deadline, d)
+            return
+
+        linger = min(self.lingerPeriod, int((deadline - now) * 1000))
+        for connection in self.connections.copy():
+            connection.socket.setsockopt(constants.LINGER, max(linger, 0))
+            connection.shutdown()
+        self.connections = None
+
+        context, self.context = self.context, None
+        if self.inprocContext is not None:
+            self.inprocContext.term()
+            self.inprocContext = None
+        if hasattr(self.reactor, 'callInThread'):
+            terminated = threads.deferToThreadPool(
+                self.reactor, self.reactor.getThreadPool(), context.term)
+        else:
+            # virtual time reactor, context is not a real one
+            terminated = defer.maybeDeferred(context.term)
+        terminated.chainDeferred(d)
 
     def registerForShutdown(self):
         """
@@ -0,0 +1,92 @@
+"""
+Application-level heartbeating for ZeroMQ connections.
+"""
+from twisted.internet import task
+
+
+# heartbeat frames, sent in place of message ID (REQ-REP)
+# or as the only frame of the message (DEALER-ROUTER)
+HEARTBEAT_PING = '\x00PING'
+HEARTBEAT_PONG = '\x00PONG'
+
+
+class ZmqPeerLostError(Exception):
+    """
+    Peer has stopped responding to heartbeats.
+    """
+
+
+class ZmqHeartbeat(object):
+    """
+    Heartbeat state of a single connection.
+
+    Every C{interval} seconds ping is sent via connection, peer is
+    considered to be lost if nothing has been received for C{liveness}
+    intervals. Any incoming traffic (not only pongs) counts as a sign
+    of life.
+
+    @ivar interval: interval between pings, seconds
+    @type interval: C{float}
+    @ivar liveness: number of intervals without incoming traffic
+        before peer is considered lost
+    @type liveness: C{int}
+    @ivar alive: is peer considered to be alive?
+    @type alive: C{bool}
+    @ivar misses: number of pings sent since last incoming traffic
+    @type misses: C{int}
+    """
+
+    def __init__(self, connection, interval, liveness):
+        """
+        Constructor.
+
+        @param connection: connection to send pings through
+        @type connection: L{ZmqConnection}
+        @param interval: interval between pings, seconds
+        @type interval: C{float}
+        @param liveness: number of intervals without incoming traffic
+            before peer is considered lost
+        @type liveness: C{int}
+        """
+        self.connection = connection
+        self.interval = interval
+        self.liveness = liveness
+        self.alive = True
+        self.misses = 0
+
+        self._call = task.LoopingCall(self._beat)
+        self._call.clock = connection.factory.reactor
+
+    def start(self):
+        """
+        Start sending pings.
+        """
+        self._call.start(self.interval, now=True)
+
+    def stop(self):
+        """
+        Stop sending pings.
+        """
+        if self._call.running:
+            self._call.stop()
+
+    def touch(self):
+        """
+        Register incoming traffic from the peer.
+        """
+        self.misses = 0
+        if not self.alive:
+            self.alive = True
+            self.connection._peerRecovered()
+
+    def _beat(self):
+        """
+        Check peer liveness and send next ping.
+        """
+        if self.alive and self.misses >= self.liveness:
+            self.alive = False
+            self.connection._peerLost()
+            if not self._call.running:  # stopped by peerLost()
+                return
+        self.misses += 1
+        self.connection._sendHeartbeat()
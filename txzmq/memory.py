@@ -0,0 +1,504 @@
+"""
+In-memory transport: sockets implementing subset of ZeroMQ socket
+interface, passing messages between each other within the process.
+
+Sockets wake up their readers via C{wakeUp(fd)} of the reactor given to
+the context; fake file descriptors are negative, so they never clash
+with real ones.
+"""
+import errno
+import random
+import struct
+from collections import deque
+from itertools import count
+
+from zmq.core import constants, error
+
+from twisted.python import log
+
+
+# ZMQ_ROUTER_MANDATORY of libzmq 3.2+, not exported by older pyzmq
+ROUTER_MANDATORY = getattr(constants, 'ROUTER_MANDATORY', 33)
+
+
+class ZmqMemoryReactor(object):
+    """
+    Proxy of the reactor which runs readers of in-memory sockets itself,
+    everything else is passed to the real reactor.
+
+    In-memory sockets wake up their readers when they become readable
+    or writable, C{doRead} of the reader is called on the next reactor
+    iteration.
+    """
+
+    def __init__(self, reactor):
+        """
+        Constructor.
+
+        @param reactor: real reactor
+        """
+        self._reactor = reactor
+        self._readers = {}
+        self._woken = set()
+
+    def __getattr__(self, name):
+        return getattr(self._reactor, name)
+
+    def addReader(self, reader):
+        fd = reader.fileno()
+        if fd < 0:
+            self._readers[fd] = reader
+        else:
+            self._reactor.addReader(reader)
+
+    def removeReader(self, reader):
+        fd = reader.fileno()
+        if fd < 0:
+            self._readers.pop(fd, None)
+        else:
+            self._reactor.removeReader(reader)
+
+    def getReaders(self):
+        return self._readers.values() + self._reactor.getReaders()
+
+    def wakeUp(self, fd):
+        """
+        Schedule C{doRead} of the reader of in-memory socket.
+
+        @param fd: file descriptor of in-memory socket
+        @type fd: C{int}
+        """
+        if fd not in self._woken:
+            self._woken.add(fd)
+            self._reactor.callLater(0, self._doRead, fd)
+
+    def _doRead(self, fd):
+        self._woken.discard(fd)
+        reader = self._readers.get(fd)
+        if reader is not None:
+            log.callWithLogger(reader, reader.doRead)
+
+
+class ZmqMemoryPipe(object):
+    """
+    One direction of connection between two simulated sockets.
+
+    Messages in flight are kept in order, pipe is full when number of
+    messages which haven't been received yet reaches high water mark.
+
+    @ivar source: sending socket
+    @type source: L{ZmqMemorySocket}
+    @ivar target: receiving socket
+    @type target: L{ZmqMemorySocket}
+    @ivar highWaterMark: maximum number of messages in pipe, 0 for no limit
+    @type highWaterMark: C{int}
+    @ivar inFlight: messages on the way with their arrival times
+    @type inFlight: C{deque}
+    @ivar arrived: messages waiting to be received
+    @type arrived: C{deque}
+    @ivar sent: number of messages sent through the pipe
+    @type sent: C{int}
+    @ivar dropped: number of messages dropped by the network model
+    @type dropped: C{int}
+    @ivar address: endpoint address the pipe was established through
+    @type address: C{str}
+    """
+
+    def __init__(self, source, target, highWaterMark):
+        self.source = source
+        self.target = target
+        self.highWaterMark = highWaterMark
+        self.inFlight = deque()
+        self.arrived = deque()
+        self.sent = 0
+        self.dropped = 0
+        self.closed = False
+        self.address = None
+        self._arrival = None
+
+    def __len__(self):
+        return len(self.inFlight) + len(self.arrived)
+
+    def writable(self):
+        """
+        Is there room for another message?
+
+        @rtype: C{bool}
+        """
+        return not self.highWaterMark or len(self) < self.highWaterMark
+
+    def write(self, frames):
+        """
+        Send message through the pipe.
+
+        @param frames: message frames
+        @type frames: C{list} of C{str}
+        """
+        context = self.source.context
+        self.sent += 1
+        context.messages += 1
+        if context.dropRate and context.random.random() < context.dropRate:
+            self.dropped += 1
+            context.dropped += 1
+            return
+
+        latency = context.latency
+        if callable(latency):
+            latency = latency()
+        if not latency and not self.inFlight:
+            self._deliver(frames)
+            return
+
+        # pipes are FIFO, message never overtakes previous one
+        now = context.reactor.seconds()
+        when = now + latency
+        if self.inFlight:
+            when = max(when, self.inFlight[-1][0])
+        self.inFlight.append((when, frames))
+        if self._arrival is None:
+            self._arrival = context.reactor.callLater(when - now, self._arrive)
+
+    def read(self):
+        """
+        Receive message from the pipe.
+
+        @return: message frames
+        @rtype: C{list} of C{str}
+        """
+        frames = self.arrived.popleft()
+        if self.highWaterMark and len(self) == self.highWaterMark - 1:
+            self.source._wakeUp()
+        return frames
+
+    def close(self):
+        """
+        Close the pipe, dropping messages in it.
+        """
+        self.closed = True
+        self.inFlight.clear()
+        self.arrived.clear()
+        if self._arrival is not None:
+            self._arrival.cancel()
+            self._arrival = None
+
+    def _deliver(self, frames):
+        self.arrived.append(frames)
+        if len(self.arrived) == 1:
+            self.target._pipeReadable(self)
+
+    def _arrive(self):
+        self._arrival = None
+        reactor = self.source.context.reactor
+        now = reactor.seconds()
+        while self.inFlight and self.inFlight[0][0] <= now:
+            self._deliver(self.inFlight.popleft()[1])
+        if self.inFlight:
+            self._arrival = reactor.callLater(
+                self.inFlight[0][0] - now, self._arrive)
+
+
+class ZmqMemorySocket(object):
+    """
+    In-memory socket implementing subset of ZeroMQ socket interface used
+    by L{ZmqConnection}.
+
+    Supported socket types are PUSH, PULL, PUB, SUB, DEALER, ROUTER and PAIR.
+    Outgoing messages are load-balanced over peers with room in their pipes
+    (PUSH, DEALER, PAIR), sent to all subscribed peers dropping them when
+    pipe is full (PUB) or routed by peer identity (ROUTER); incoming
+    messages are fair-queued. ROUTER with L{ROUTER_MANDATORY} option set
+    refuses messages to unknown peers (C{EHOSTUNREACH}) and to peers with
+    full pipes (C{EAGAIN}) instead of dropping them, like libzmq 4.x.
+
+    @ivar context: simulated context
+    @type context: L{ZmqMemoryContext}
+    @ivar socketType: socket type, from ZeroMQ
+    @type socketType: C{int}
+    @ivar fd: fake file descriptor
+    @type fd: C{int}
+    @ivar outPipes: pipes to peers
+    @type outPipes: C{list} of L{ZmqMemoryPipe}
+    @ivar inPipes: pipes from peers mapped to peer identities
+    @type inPipes: C{dict}
+    @ivar routes: pipes to peers by peer identity
+    @type routes: C{dict}
+    @ivar subscriptions: subscribed prefixes (SUB)
+    @type subscriptions: C{list} of C{str}
+    """
+
+    def __init__(self, context, socketType):
+        self.context = context
+        self.socketType = socketType
+        self.fd = context._nextFd()
+        self.closed = False
+        self.outPipes = []
+        self.inPipes = {}
+        self.routes = {}
+        self.subscriptions = []
+        self._options = {}
+        self._sending = []
+        self._receiving = deque()
+        self._readable = deque()
+        self._next = 0
+
+    def __repr__(self):
+        return "%s(%d)" % (self.__class__.__name__, self.fd)
+
+    def setsockopt(self, option, value):
+        if option == constants.SUBSCRIBE:
+            self.subscriptions.append(value)
+        elif option == constants.UNSUBSCRIBE:
+            if value in self.subscriptions:
+                self.subscriptions.remove(value)
+        else:
+            self._options[option] = value
+
+    def getsockopt(self, option):
+        if option == constants.FD:
+            return self.fd
+        elif option == constants.EVENTS:
+            events = 0
+            if self._receiving or self._readable:
+                events |= constants.POLLIN
+            if self._writable():
+                events |= constants.POLLOUT
+            return events
+        elif option == constants.RCVMORE:
+            return int(bool(self._receiving))
+        elif option == constants.TYPE:
+            return self.socketType
+        return self._options.get(option, 0)
+
+    def bind(self, address):
+        self.context._bind(self, address)
+
+    def connect(self, address):
+        self.context._connect(self, address)
+
+    def unbind(self, address):
+        self.context._unbind(self, address)
+
+    def disconnect(self, address):
+        self.context._disconnect(self, address)
+
+    def send(self, data, flags=0):
+        if self.socketType in (constants.PULL, constants.SUB):
+            raise error.ZMQError(constants.ENOTSUP)
+        if not self._sending and not self._writable():
+            raise error.ZMQError(constants.EAGAIN)
+        if not self._sending and self.socketType == constants.ROUTER and \
+                self._options.get(ROUTER_MANDATORY):
+            pipe = self.routes.get(data)
+            if pipe is None:
+                raise error.ZMQError(errno.EHOSTUNREACH)
+            if not pipe.writable():
+                raise error.ZMQError(constants.EAGAIN)
+
+        self._sending.append(data)
+        if not flags & constants.SNDMORE:
+            frames, self._sending = self._sending, []
+            self._route(frames)
+
+    def recv(self, flags=0):
+        if self.socketType in (constants.PUSH, constants.PUB):
+            raise error.ZMQError(constants.ENOTSUP)
+        if not self._receiving:
+            if not self._readable:
+                raise error.ZMQError(constants.EAGAIN)
+            pipe = self._readable.popleft()
+            frames = pipe.read()
+            if pipe.arrived:
+                self._readable.append(pipe)
+            if self.socketType == constants.ROUTER:
+                frames = [self.inPipes[pipe]] + frames
+            self._receiving.extend(frames)
+        return self._receiving.popleft()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.context._close(self)
+
+    def identity(self):
+        """
+        Identity of the socket as seen by ROUTER peers.
+
+        @rtype: C{str}
+        """
+        identity = self._options.get(constants.IDENTITY)
+        if not identity:
+            identity = self._options[constants.IDENTITY] = \
+                '\0' + struct.pack('!i', self.fd)
+        return identity
+
+    def highWaterMark(self):
+        """
+        High water mark set on the socket.
+
+        @rtype: C{int}
+        """
+        for name in ('SNDHWM', 'HWM'):
+            option = getattr(constants, name, None)
+            if option in self._options:
+                return self._options[option]
+        return 0
+
+    def _writable(self):
+        if self.socketType in (constants.PUB, constants.ROUTER):
+            return True
+        return any(pipe.writable() for pipe in self.outPipes)
+
+    def _route(self, frames):
+        if self.socketType == constants.PUB:
+            for pipe in self.outPipes:
+                if not any(frames[0].startswith(subscription)
+                           for subscription in pipe.target.subscriptions):
+                    continue
+                if pipe.writable():
+                    pipe.write(frames)
+                else:
+                    self.context.overflows += 1
+        elif self.socketType == constants.ROUTER:
+            pipe = self.routes.get(frames[0])
+            if pipe is None:
+                pass  # unknown peer
+            elif pipe.writable():
+                pipe.write(frames[1:])
+            else:
+                self.context.overflows += 1
+        else:
+            size = len(self.outPipes)
+            for i in xrange(self._next, self._next + size):
+                pipe = self.outPipes[i % size]
+                if pipe.writable():
+                    self._next = (i + 1) % size
+                    pipe.write(frames)
+                    break
+
+    def _pipeReadable(self, pipe):
+        self._readable.append(pipe)
+        self._wakeUp()
+
+    def _wakeUp(self):
+        if not self.closed:
+            self.context.reactor.wakeUp(self.fd)
+
+
+class ZmqMemoryContext(object):
+    """
+    In-memory network: endpoints and sockets connected through them.
+
+    Endpoint addresses are just names, any address could be bound once;
+    connecting before bind is allowed, connection is established as soon
+    as the endpoint is bound. Pipe between two sockets gets high water mark
+    which is the sum of high water marks of both sockets (or no limit if
+    any of them has none).
+
+    @ivar reactor: reactor waking up readers of sockets
+    @type reactor: L{ZmqSimulatedReactor} or L{ZmqMemoryReactor}
+    @ivar latency: message delivery latency, seconds, or callable returning
+        latency for every message
+    @type latency: C{float}
+    @ivar dropRate: probability of message being lost
+    @type dropRate: C{float}
+    @ivar random: random number generator of drop model
+    @type random: L{random.Random}
+    @ivar messages: number of messages sent
+    @type messages: C{int}
+    @ivar dropped: number of messages dropped by drop model
+    @type dropped: C{int}
+    @ivar overflows: number of messages dropped by PUB and ROUTER sockets
+        because of full pipe
+    @type overflows: C{int}
+    """
+
+    def __init__(self, reactor, latency=0, dropRate=0, seed=0):
+        self.reactor = reactor
+        self.latency = latency
+        self.dropRate = dropRate
+        self.random = random.Random(seed)
+        self.messages = 0
+        self.dropped = 0
+        self.overflows = 0
+        self.sockets = set()
+        self._bound = {}
+        self._connecting = {}
+        self._fds = count(-1, -1)
+
+    def socket(self, socketType):
+        socket = ZmqMemorySocket(self, socketType)
+        self.sockets.add(socket)
+        return socket
+
+    def term(self):
+        for socket in list(self.sockets):
+            socket.close()
+
+    def _nextFd(self):
+        return next(self._fds)
+
+    def _bind(self, socket, address):
+        if address in self._bound:
+            raise error.ZMQError(constants.EADDRINUSE)
+        self._bound[address] = socket
+        for peer in self._connecting.pop(address, []):
+            self._attach(peer, socket, address)
+
+    def _connect(self, socket, address):
+        if address in self._bound:
+            self._attach(socket, self._bound[address], address)
+        else:
+            self._connecting.setdefault(address, []).append(socket)
+
+    def _disconnect(self, socket, address):
+        if socket in self._connecting.get(address, []):
+            self._connecting[address].remove(socket)
+        for pipe in self._pipes(socket, address):
+            self._closePipe(pipe)
+
+    def _unbind(self, socket, address):
+        if self._bound.get(address) is not socket:
+            raise error.ZMQError(constants.ENOENT)
+        del self._bound[address]
+        for pipe in self._pipes(socket, address):
+            if pipe.source is socket:
+                # peer would reconnect when address is bound again
+                self._connecting.setdefault(address, []).append(pipe.target)
+            self._closePipe(pipe)
+
+    def _pipes(self, socket, address):
+        return [pipe for pipe in socket.outPipes + socket.inPipes.keys()
+                if pipe.address == address]
+
+    def _attach(self, a, b, address):
+        for source, target in ((a, b), (b, a)):
+            hwm = source.highWaterMark(), target.highWaterMark()
+            pipe = ZmqMemoryPipe(source, target, all(hwm) and sum(hwm))
+            pipe.address = address
+            source.outPipes.append(pipe)
+            source.routes[target.identity()] = pipe
+            target.inPipes[pipe] = source.identity()
+        a._wakeUp()
+        b._wakeUp()
+
+    def _close(self, socket):
+        self.sockets.discard(socket)
+        for address, bound in self._bound.items():
+            if bound is socket:
+                del self._bound[address]
+        for connecting in self._connecting.values():
+            if socket in connecting:
+                connecting.remove(socket)
+
+        for pipe in socket.outPipes + socket.inPipes.keys():
+            self._closePipe(pipe)
+
+    def _closePipe(self, pipe):
+        pipe.close()
+        source, target = pipe.source, pipe.target
+        source.outPipes.remove(pipe)
+        if source.routes.get(target.identity()) is pipe:
+            del source.routes[target.identity()]
+        del target.inPipes[pipe]
+        if pipe in target._readable:
+            target._readable.remove(pipe)
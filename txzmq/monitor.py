@@ -0,0 +1,171 @@
+"""
+ZeroMQ socket event monitoring.
+"""
+import struct
+
+from zmq.core import constants
+from zmq.core.version import zmq_version_info
+
+from txzmq.connection import MONITOR_INPROC_PREFIX
+from txzmq.connection import ZmqConnection, ZmqEndpoint, ZmqEndpointType
+
+
+# first frame of monitor event: event number and value (native byte order),
+# second frame is endpoint address
+MONITOR_EVENT = struct.Struct('=HI')
+
+
+class ZmqSocketEvent(object):
+    """
+    Socket events reported by ZeroMQ monitor (libzmq 4.x).
+    """
+    connected = 0x0001
+    connectDelayed = 0x0002
+    connectRetried = 0x0004
+    listening = 0x0008
+    bindFailed = 0x0010
+    accepted = 0x0020
+    acceptFailed = 0x0040
+    closed = 0x0080
+    closeFailed = 0x0100
+    disconnected = 0x0200
+    monitorStopped = 0x0400
+    handshakeFailedNoDetail = 0x0800
+    handshakeSucceeded = 0x1000
+    handshakeFailedProtocol = 0x2000
+    handshakeFailedAuth = 0x4000
+
+    all = 0xffff
+
+    names = dict((value, name) for name, value in locals().items()
+                 if isinstance(value, int) and name != 'all')
+
+
+class ZmqMonitorConnection(ZmqConnection):
+    """
+    Companion PAIR connection receiving events of monitored socket.
+
+    @ivar socketMonitor: monitor events are passed to
+    @type socketMonitor: L{ZmqSocketMonitor}
+    """
+    socketType = constants.PAIR
+
+    socketMonitor = None
+
+    def messageReceived(self, message):
+        self.socketMonitor._gotEvent(message)
+
+
+class ZmqSocketMonitor(object):
+    """
+    Monitor of connection's socket: ZeroMQ publishes socket events
+    (connects, disconnects, reconnect attempts, accepted connections, etc.)
+    to inproc PAIR socket, they're received by companion connection within
+    the reactor.
+
+    Every event is counted per endpoint address and passed to
+    C{socketEvent} of the monitored connection.
+
+    Socket monitoring requires libzmq 4.0 or newer.
+
+    @ivar connection: monitored connection
+    @type connection: L{ZmqConnection}
+    @ivar events: monitored events mask
+    @type events: C{int}
+    @ivar stats: number of events by endpoint address and event name
+    @type stats: C{dict}
+    @ivar companion: connection receiving events, C{None} if monitor
+        isn't running
+    @type companion: L{ZmqMonitorConnection}
+    """
+
+    connectionClass = ZmqMonitorConnection
+
+    def __init__(self, connection, events=ZmqSocketEvent.all):
+        """
+        Constructor.
+
+        @param connection: connection to monitor
+        @type connection: L{ZmqConnection}
+        @param events: mask of L{ZmqSocketEvent} values to monitor
+        @type events: C{int}
+        """
+        self.connection = connection
+        self.events = events
+        self.stats = {}
+        self.companion = None
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.connection)
+
+    @staticmethod
+    def supported():
+        """
+        Does ZeroMQ library support socket monitoring?
+
+        @rtype: C{bool}
+        """
+        return zmq_version_info() >= (4, 0)
+
+    def start(self):
+        """
+        Start monitoring: enable monitor on the socket and connect
+        companion connection to it.
+
+        @raise NotImplementedError: if libzmq doesn't support monitoring
+        """
+        if not self.supported() or \
+                not hasattr(self.connection.socket, 'monitor'):
+            raise NotImplementedError(
+                "Socket monitoring requires libzmq 4.0, got %s" % (
+                    '.'.join(map(str, zmq_version_info()))))
+
+        address = MONITOR_INPROC_PREFIX + "%x" % id(self)
+        self.connection.socket.monitor(address, self.events)
+        self.companion = self.connectionClass(
+            self.connection.factory,
+            ZmqEndpoint(ZmqEndpointType.connect, address))
+        self.companion.socketMonitor = self
+        self.connection.monitor = self
+
+    def stop(self):
+        """
+        Stop monitoring.
+        """
+        companion, self.companion = self.companion, None
+        if companion is None:
+            return
+        self.connection.monitor = None
+        if self.connection.socket is not None:
+            self.connection.socket.disable_monitor()
+        if companion.factory is not None:
+            companion.shutdown()
+
+    def count(self, address, event):
+        """
+        Number of events of the type for endpoint address.
+
+        @param address: endpoint address
+        @type address: C{str}
+        @param event: event type
+        @type event: C{int}
+        @rtype: C{int}
+        """
+        return self.stats.get(address, {}).get(
+            ZmqSocketEvent.names[event], 0)
+
+    def _gotEvent(self, message):
+        """
+        Monitor event has been received.
+
+        @param message: monitor event message
+        @type message: C{list} of C{str}
+        """
+        event, value = MONITOR_EVENT.unpack(message[0][:MONITOR_EVENT.size])
+        address = message[1] if len(message) > 1 else ''
+
+        name = ZmqSocketEvent.names.get(event, hex(event))
+        counts = self.stats.setdefault(address, {})
+        counts[name] = counts.get(name, 0) + 1
+
+        self.connection.socketEvent(event, value, address)
@@ -0,0 +1,379 @@
+"""
+Token bucket pacing of outgoing messages.
+"""
+from collections import deque
+
+
+class ZmqPacingUnit(object):
+    """
+    What rate of the token bucket is measured in.
+    """
+    messages = "messages"
+    bytes = "bytes"
+
+
+class ZmqTokenBucket(object):
+    """
+    Token bucket: tokens are added at C{rate} per second up to C{burst},
+    every message takes tokens according to its cost.
+
+    Message costing more than C{burst} is admitted when bucket is full,
+    leaving bucket in debt.
+
+    @ivar rate: tokens added per second
+    @type rate: C{float}
+    @ivar burst: bucket capacity
+    @type burst: C{float}
+    @ivar unit: what tokens stand for
+    @type unit: L{ZmqPacingUnit}
+    @ivar tokens: tokens available
+    @type tokens: C{float}
+    """
+
+    __slots__ = ('rate', 'burst', 'unit', 'tokens', 'updated')
+
+    def __init__(self, rate, burst=None, unit=ZmqPacingUnit.messages):
+        """
+        Constructor.
+
+        @param rate: tokens added per second
+        @type rate: C{float}
+        @param burst: bucket capacity, defaults to one second worth of
+            tokens
+        @type burst: C{float}
+        @param unit: what tokens stand for
+        @type unit: L{ZmqPacingUnit}
+        """
+        assert rate > 0, "Rate should be positive"
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.unit = unit
+        self.tokens = self.burst
+        self.updated = None
+
+    def __repr__(self):
+        return "%s(%r, %r, %r)" % (
+            self.__class__.__name__, self.rate, self.burst, self.unit)
+
+    def cost(self, frames):
+        """
+        Cost of the message.
+
+        @param frames: message frames
+        @type frames: C{list} of C{str}
+        @rtype: C{int}
+        """
+        if self.unit == ZmqPacingUnit.bytes:
+            return sum(map(len, frames))
+        return 1
+
+    def delay(self, cost, now):
+        """
+        How long message should wait for tokens.
+
+        @param cost: cost of the message
+        @type cost: C{int}
+        @param now: current time
+        @type now: C{float}
+        @return: delay, seconds; zero if message could be sent now
+        @rtype: C{float}
+        """
+        if self.updated is not None:
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        lacking = min(cost, self.burst) - self.tokens
+        return lacking / self.rate if lacking > 0 else 0.0
+
+    def take(self, cost):
+        """
+        Take tokens for the message.
+
+        @param cost: cost of the message
+        @type cost: C{int}
+        """
+        self.tokens -= cost
+
+
+class ZmqPacer(object):
+    """
+    Pacer smoothing bursts of messages sent by the connection.
+
+    Pacer is consulted by the connection before every message leaves send
+    queue. Connection-wide token bucket makes messages wait in the send
+    queue (behind the head one) until tokens are available. Per-tag
+    token buckets hold messages of over-limit tags aside, so that they
+    don't delay messages of other tags; held messages are put back in
+    front of the send queue in order when tokens are available. If more
+    than C{maxHeld} messages of the tag are held, the oldest one is
+    dropped.
+
+    Tag of the message is found by C{tagOf}, which understands messages
+    of L{ZmqPubConnection}.
+
+    Pacer is installed on the connection with C{start} and removed with
+    C{stop}. It shouldn't be used with connections that manage send queue
+    on their own (L{ZmqDurablePushConnection}, L{ZmqRouterConnection}).
+
+    @ivar connection: paced connection
+    @type connection: L{ZmqConnection}
+    @ivar bucket: connection-wide bucket, if any
+    @type bucket: L{ZmqTokenBucket}
+    @ivar tagBuckets: per-tag buckets by tag
+    @type tagBuckets: C{dict}
+    @ivar maxHeld: maximum number of held messages per tag
+    @type maxHeld: C{int}
+    @ivar sent: number of messages admitted
+    @type sent: C{int}
+    @ivar deferred: number of messages which had to wait for tokens
+    @type deferred: C{int}
+    @ivar dropped: number of held messages dropped
+    @type dropped: C{int}
+    """
+
+    def __init__(self, connection, rate=None, burst=None,
+                 unit=ZmqPacingUnit.messages, maxHeld=1000):
+        """
+        Constructor.
+
+        @param connection: connection to pace
+        @type connection: L{ZmqConnection}
+        @param rate: connection-wide rate, C{None} to pace only tags
+        @type rate: C{float}
+        @param burst: connection-wide burst
+        @type burst: C{float}
+        @param unit: what connection-wide rate is measured in
+        @type unit: L{ZmqPacingUnit}
+        @param maxHeld: maximum number of held messages per tag
+        @type maxHeld: C{int}
+        """
+        self.connection = connection
+        self.bucket = None
+        if rate is not None:
+            self.bucket = ZmqTokenBucket(rate, burst, unit)
+        self.tagBuckets = {}
+        self.maxHeld = maxHeld
+        self.sent = 0
+        self.deferred = 0
+        self.dropped = 0
+
+        self._clock = connection.factory.reactor
+        self._held = {}
+        self._released = {}
+        self._releaseAt = None
+        self._waiting = None
+        self._wakeCall = None
+
+    def __repr__(self):
+        return "%s(%r, %r)" % (
+            self.__class__.__name__, self.connection, self.bucket)
+
+    def setTagLimit(self, tag, rate, burst=None,
+                    unit=ZmqPacingUnit.messages):
+        """
+        Limit rate of messages with the tag.
+
+        @param tag: message tag
+        @type tag: C{str}
+        @param rate: rate of the tag
+        @type rate: C{float}
+        @param burst: burst of the tag
+        @type burst: C{float}
+        @param unit: what rate is measured in
+        @type unit: L{ZmqPacingUnit}
+        """
+        self.tagBuckets[tag] = ZmqTokenBucket(rate, burst, unit)
+
+    def start(self):
+        """
+        Start pacing.
+        """
+        self.connection.pacer = self
+
+    def stop(self):
+        """
+        Stop pacing, held messages are sent without further delay.
+        """
+        if self._wakeCall is not None and self._wakeCall.active():
+            self._wakeCall.cancel()
+        self._wakeCall = None
+
+        connection = self.connection
+        if connection.pacer is not self:
+            return
+        connection.pacer = None
+        held, self._held = self._held, {}
+        self._released.clear()
+        for messages in held.itervalues():
+            if connection._lane is None:
+                for queue, frames in reversed(messages):
+                    queue.extendleft(reversed(frames))
+            else:
+                # in the middle of message, can't put them in front
+                for queue, frames in messages:
+                    queue.extend(frames)
+        if held and connection.factory is not None:
+            connection._scheduleDoRead()
+
+    def stats(self):
+        """
+        Pacing statistics.
+
+        @rtype: C{dict}
+        """
+        return {
+            'sent': self.sent,
+            'deferred': self.deferred,
+            'dropped': self.dropped,
+            'held': sum(map(len, self._held.itervalues())),
+        }
+
+    def tagOf(self, frames):
+        """
+        Tag of the message: first frame of multipart message or part
+        of single frame up to C{'\\0'} (as sent by L{ZmqPubConnection}).
+
+        Could be overridden for other message layouts.
+
+        @param frames: message frames
+        @type frames: C{list} of C{str}
+        @rtype: C{str}
+        """
+        if len(frames) > 1:
+            return frames[0]
+        return frames[0].split('\0', 1)[0]
+
+    def admit(self, lane):
+        """
+        Decide on the message at the head of the send queue.
+
+        @param lane: index of the send queue
+        @type lane: C{int}
+        @return: C{True} to send the message, C{False} to stop sending
+            (connection-wide bucket is empty) or C{None} if message has
+            been held and next one should be chosen
+        """
+        queue = self.connection.lanes[lane]
+        head = queue[0]
+        frames = self._peek(queue)
+        now = self._clock.seconds()
+
+        tagBucket = None
+        if self.tagBuckets:
+            tag = self.tagOf(frames)
+            tagBucket = self.tagBuckets.get(tag)
+        if tagBucket is not None:
+            released = self._released.pop(id(head), None) is not None
+            tagCost = tagBucket.cost(frames)
+            if not released and tag in self._held:
+                # keep order behind messages already held
+                self._hold(tag, queue, frames, 0.0, now)
+                return None
+            delay = tagBucket.delay(tagCost, now)
+            if delay:
+                self._hold(tag, queue, frames, delay, now)
+                return None
+
+        if self.bucket is not None:
+            cost = self.bucket.cost(frames)
+            delay = self.bucket.delay(cost, now)
+            if delay:
+                if self._waiting is not head:
+                    self._waiting = head
+                    self.deferred += 1
+                if tagBucket is not None and released:
+                    self._released[id(head)] = tag
+                self._wake(delay)
+                return False
+            self.bucket.take(cost)
+
+        if tagBucket is not None:
+            tagBucket.take(tagCost)
+        self._waiting = None
+        self.sent += 1
+        return True
+
+    def release(self):
+        """
+        Put held messages which could be sent now back in front of their
+        send queues, called between messages.
+        """
+        if self._releaseAt is None:
+            return
+        now = self._clock.seconds()
+        if now < self._releaseAt:
+            return
+
+        self._releaseAt = None
+        outstanding = set(self._released.itervalues())
+        for tag, messages in self._held.items():
+            if tag in outstanding:
+                # next one is checked after released one is admitted,
+                # which happens on this or later flush
+                self._releaseAt = now
+                continue
+            queue, frames = messages[0]
+            bucket = self.tagBuckets[tag]
+            delay = bucket.delay(bucket.cost([f for _, f in frames]), now)
+            if delay:
+                self._wake(delay)
+                continue
+            messages.popleft()
+            if not messages:
+                del self._held[tag]
+            else:
+                self._releaseAt = now
+            queue.extendleft(reversed(frames))
+            self._released[id(frames[0])] = tag
+
+    def _peek(self, queue):
+        """
+        Frames of the message at the head of the send queue.
+        """
+        frames = []
+        for flags, frame in queue:
+            frames.append(frame)
+            if not flags:
+                break
+        return frames
+
+    def _hold(self, tag, queue, frames, delay, now):
+        """
+        Move message from the head of the send queue to held messages
+        of the tag.
+        """
+        entries = [queue.popleft() for _ in frames]
+        messages = self._held.get(tag)
+        if messages is None:
+            messages = self._held[tag] = deque()
+        messages.append((queue, entries))
+        self.deferred += 1
+        if len(messages) > self.maxHeld:
+            messages.popleft()
+            self.dropped += 1
+        if delay:
+            self._wake(delay)
+
+    def _wake(self, delay):
+        """
+        Make connection send again after delay.
+        """
+        at = self._clock.seconds() + delay
+        if self._releaseAt is None or at < self._releaseAt:
+            self._releaseAt = at
+        if self._wakeCall is not None and self._wakeCall.active():
+            if self._wakeCall.getTime() <= at:
+                return
+            self._wakeCall.cancel()
+        self._wakeCall = self._clock.callLater(delay, self._wakeUp)
+
+    def _wakeUp(self):
+        self._wakeCall = None
+        if self.connection.factory is None:
+            return
+        now = self._clock.seconds()
+        if self._releaseAt is not None and self._releaseAt > now:
+            # later wake up has been requested meanwhile
+            self._wakeCall = self._clock.callLater(
+                self._releaseAt - now, self._wakeUp)
+        self.connection._scheduleDoRead()
@@ -0,0 +1,386 @@
+"""
+Acknowledged task pipeline over ROUTER/DEALER: tasks are pulled by idle
+workers, acknowledged when handled and redelivered if not.
+"""
+import struct
+from collections import deque
+from itertools import count
+
+from twisted.internet import defer
+from twisted.python import log
+
+from txzmq.router_dealer import ZmqDealerConnection, ZmqRouterConnection
+
+
+# task ids and credits in pipeline protocol
+NUMBER = struct.Struct('!Q')
+
+# pipeline protocol commands, pusher to worker: task, request to announce
+# credit
+TASK = 'TASK'
+TASK_ANNOUNCE = 'ANNOUNCE'
+# worker to pusher: credit (number of tasks worker could take, followed
+# by TASK_ANNOUNCE if it's a reply), acknowledgement, rejection
+TASK_READY = 'READY'
+TASK_ACK = 'ACK'
+TASK_NACK = 'NACK'
+
+
+class ZmqTaskFailedError(Exception):
+    """
+    Task hasn't been handled: it has failed every attempt or pusher has
+    been shut down.
+    """
+
+
+class _Task(object):
+    """
+    Task pushed via L{ZmqAckedPushConnection}.
+
+    @ivar id: task id (packed)
+    @type id: C{str}
+    @ivar message: task data
+    @type message: C{list} of C{str}
+    @ivar deferred: deferred returned to the caller
+    @type deferred: L{defer.Deferred}
+    @ivar attempts: number of times task has been delivered
+    @type attempts: C{int}
+    @ivar workers: identities of workers task has been delivered to
+    @type workers: C{list} of C{str}
+    @ivar timeoutCall: pending timeout of the last delivery, C{None}
+        while task waits for (re)delivery
+    """
+
+    __slots__ = ('id', 'message', 'deferred', 'attempts', 'workers',
+                 'timeoutCall')
+
+    def __init__(self, id, message):
+        self.id = id
+        self.message = message
+        self.deferred = defer.Deferred()
+        self.attempts = 0
+        self.workers = []
+        self.timeoutCall = None
+
+
+class ZmqAckedPushConnection(ZmqRouterConnection):
+    """
+    Pushing tasks to L{ZmqAckedPullConnection} workers with
+    acknowledgements.
+
+    Instead of being distributed round-robin, tasks are queued until some
+    worker asks for more (grants credit); worker acknowledges every task
+    when it has been handled, which grants credit back, so that fast
+    workers take more tasks than slow ones. Worker unknown to the pusher
+    (expired or talking to restarted pusher) is asked to announce its
+    credit again when anything is received from it, including
+    heartbeats. Tasks not acknowledged in
+    C{ackTimeout} seconds, rejected by the worker or left with expired
+    worker (see C{peerIdleTimeout}) are redelivered, preferably to
+    another worker, up to C{maxAttempts} times. Delivery is at least
+    once: task which has timed out may still be handled by slow worker.
+
+    @cvar ackTimeout: time to wait for acknowledgement, seconds
+    @type ackTimeout: C{float}
+    @cvar maxAttempts: maximum number of deliveries of the task,
+        C{None} for no limit
+    @type maxAttempts: C{int}
+
+    @ivar pending: tasks waiting for a worker, in order
+    @type pending: C{deque}
+    @ivar inFlight: tasks delivered and not yet acknowledged by task id
+    @type inFlight: C{dict}
+    @ivar credits: number of tasks workers are ready to take, by worker
+        identity
+    @type credits: C{dict}
+    @ivar completed: number of acknowledged tasks
+    @type completed: C{int}
+    @ivar redelivered: number of task redeliveries
+    @type redelivered: C{int}
+    @ivar failed: number of tasks which failed all attempts
+    @type failed: C{int}
+    """
+    __slots__ = ('pending', 'inFlight', 'credits', 'completed',
+                 'redelivered', 'failed', '_ids', '_workers', '_announcing')
+
+    ackTimeout = 30.0
+    maxAttempts = None
+
+    def __init__(self, *args, **kwargs):
+        self.pending = deque()
+        self.inFlight = {}
+        self.credits = {}
+        self.completed = 0
+        self.redelivered = 0
+        self.failed = 0
+        self._ids = count()
+        self._workers = deque()
+        self._announcing = set()
+
+        ZmqRouterConnection.__init__(self, *args, **kwargs)
+
+    def shutdown(self):
+        """
+        Shutdown connection and socket, failing tasks not yet handled.
+        """
+        tasks = list(self.pending) + self.inFlight.values()
+        self.pending.clear()
+        self.inFlight.clear()
+        ZmqRouterConnection.shutdown(self)
+        for task in tasks:
+            if task.timeoutCall is not None and task.timeoutCall.active():
+                task.timeoutCall.cancel()
+            task.deferred.errback(ZmqTaskFailedError("Connection shut down"))
+
+    def push(self, message):
+        """
+        Push task to the workers.
+
+        @param message: task data
+        @type message: C{str} or C{list} of C{str}
+        @return: Deferred firing with identity of the worker which has
+            handled the task, failing with L{ZmqTaskFailedError}
+        """
+        if not hasattr(message, '__iter__'):
+            message = [message]
+        task = _Task(NUMBER.pack(self._ids.next()), list(message))
+        self.pending.append(task)
+        self._dispatchTasks()
+        return task.deferred
+
+    def stats(self):
+        """
+        Pipeline statistics.
+
+        @rtype: C{dict}
+        """
+        return {
+            'pending': len(self.pending),
+            'inFlight': len(self.inFlight),
+            'workers': len(self._workers),
+            'completed': self.completed,
+            'redelivered': self.redelivered,
+            'failed': self.failed,
+        }
+
+    def messageReceived(self, message):
+        worker = message[0]
+        if worker not in self.credits and message[1:2] != [TASK_READY]:
+            # worker has been expired or pusher restarted, credit of the
+            # worker is unknown until it's announced again
+            self.credits[worker] = 0
+            self._workers.append(worker)
+            self._announcing.add(worker)
+            self.sendMultipart(worker, [TASK_ANNOUNCE])
+        ZmqRouterConnection.messageReceived(self, message)
+
+    def gotMessage(self, sender, message):
+        command = message[0] if message else None
+        if command == TASK_READY and len(message) in (2, 3) and \
+                len(message[1]) == NUMBER.size and \
+                message[2:] in ([], [TASK_ANNOUNCE]):
+            self._announce(sender, NUMBER.unpack(message[1])[0],
+                           len(message) == 3)
+        elif command == TASK_ACK and len(message) == 2:
+            task = self.inFlight.pop(message[1], None)
+            if task is not None:
+                if task.timeoutCall is None:
+                    # timed out, waiting for redelivery
+                    self.pending.remove(task)
+                elif task.timeoutCall.active():
+                    task.timeoutCall.cancel()
+                self.completed += 1
+            # late acknowledgement of finished task still returns credit
+            self._grant(sender, 1)
+            if task is not None:
+                task.deferred.callback(sender)
+        elif command == TASK_NACK and len(message) in (2, 3):
+            task = self.inFlight.get(message[1])
+            self._grant(sender, 1)
+            if task is not None and self._deliveredTo(task, sender):
+                self._redeliver(task, message[2] if len(message) == 3
+                                else "Rejected by worker")
+        else:
+            log.msg("Malformed pipeline message from %r: %r" % (
+                sender, message))
+
+    def peerExpired(self, peer):
+        self._announcing.discard(peer.identity)
+        if self.credits.pop(peer.identity, None) is not None:
+            self._workers.remove(peer.identity)
+        for task in self.inFlight.values():
+            if self._deliveredTo(task, peer.identity):
+                self._redeliver(task, "Worker expired")
+
+    def _deliveredTo(self, task, worker):
+        """
+        Is task waiting for acknowledgement from the worker?
+        """
+        return task.timeoutCall is not None and task.workers[-1] == worker
+
+    def _announce(self, worker, credit, reply):
+        """
+        Set credit of the worker announced by it and dispatch tasks.
+
+        While worker is asked to announce its credit, only the reply
+        counts (credit sent on worker start may be already stale);
+        otherwise only credit sent on worker start does.
+
+        @param reply: is it reply to C{TASK_ANNOUNCE}?
+        @type reply: C{bool}
+        """
+        if reply != (worker in self._announcing):
+            return
+        if worker not in self.credits:
+            self._workers.append(worker)
+        self._announcing.discard(worker)
+        self.credits[worker] = credit
+        self._dispatchTasks()
+
+    def _grant(self, worker, credit):
+        """
+        Add credit of the worker and dispatch tasks.
+
+        Credit returned by worker which is about to announce its credit
+        is ignored, announced credit already includes it.
+        """
+        if worker in self._announcing:
+            return
+        self.credits[worker] += credit
+        self._dispatchTasks()
+
+    def _dispatchTasks(self):
+        """
+        Deliver pending tasks to workers with credit.
+        """
+        while self.pending and self.factory is not None:
+            worker = self._chooseWorker(self.pending[0])
+            if worker is None:
+                return
+            task = self.pending.popleft()
+            self.credits[worker] -= 1
+            task.attempts += 1
+            task.workers.append(worker)
+            self.inFlight[task.id] = task
+            task.timeoutCall = self.factory.reactor.callLater(
+                self.ackTimeout, self._timedOut, task)
+            self.sendMultipart(worker, [TASK, task.id] + task.message)
+
+    def _chooseWorker(self, task):
+        """
+        Choose worker with credit, round-robin, preferring workers task
+        hasn't been delivered to.
+
+        @return: worker identity or C{None} if no worker has credit
+        @rtype: C{str}
+        """
+        chosen = None
+        for i, worker in enumerate(self._workers):
+            if self.credits[worker] <= 0:
+                continue
+            if worker not in task.workers:
+                chosen = i
+                break
+            if chosen is None:
+                chosen = i
+        if chosen is None:
+            return None
+        worker = self._workers[chosen]
+        del self._workers[chosen]
+        self._workers.append(worker)
+        return worker
+
+    def _timedOut(self, task):
+        task.timeoutCall = None
+        if self.inFlight.get(task.id) is task:
+            self._redeliver(task, "Acknowledgement timed out")
+
+    def _redeliver(self, task, reason):
+        """
+        Redeliver task or fail it if it has been delivered too many times.
+
+        Task stays in flight, so that acknowledgement of any delivery
+        completes it.
+        """
+        if task.timeoutCall is not None and task.timeoutCall.active():
+            task.timeoutCall.cancel()
+        task.timeoutCall = None
+        if self.maxAttempts is not None and \
+                task.attempts >= self.maxAttempts:
+            del self.inFlight[task.id]
+            self.failed += 1
+            task.deferred.errback(ZmqTaskFailedError(
+                "%s after %d attempts" % (reason, task.attempts)))
+            return
+        self.redelivered += 1
+        self.pending.appendleft(task)
+        self._dispatchTasks()
+
+
+class ZmqAckedPullConnection(ZmqDealerConnection):
+    """
+    Worker pulling tasks from L{ZmqAckedPushConnection}.
+
+    Worker asks for C{prefetch} tasks on start and for one more every
+    time task is handled. Task is handled when C{onPull} returns or,
+    if it returns Deferred, when Deferred fires; then it's acknowledged.
+    If C{onPull} fails, task is rejected and pusher redelivers it.
+
+    Worker sends heartbeats every C{heartbeatInterval} seconds, which
+    keep idle worker from being expired by the pusher (interval should
+    be shorter than C{peerIdleTimeout} of the pusher) and let restarted
+    pusher find the worker.
+
+    @cvar prefetch: number of tasks handled at the same time
+    @type prefetch: C{int}
+
+    @ivar handling: ids of tasks being handled
+    @type handling: C{set}
+    """
+    __slots__ = ('handling',)
+
+    prefetch = 1
+    heartbeatInterval = 1.0
+
+    def __init__(self, *args, **kwargs):
+        self.handling = set()
+
+        ZmqDealerConnection.__init__(self, *args, **kwargs)
+
+        self.sendMultipart([TASK_READY, NUMBER.pack(self.prefetch)])
+
+    def gotMessage(self, message):
+        if message == [TASK_ANNOUNCE]:
+            self.sendMultipart([TASK_READY, NUMBER.pack(
+                self.prefetch - len(self.handling)), TASK_ANNOUNCE])
+            return
+        if len(message) < 2 or message[0] != TASK:
+            log.msg("Malformed pipeline message: %r" % (message,))
+            return
+        taskId = message[1]
+        self.handling.add(taskId)
+        d = defer.maybeDeferred(self.onPull, message[2:])
+        d.addCallbacks(self._handled, self._failed,
+                       callbackArgs=(taskId,), errbackArgs=(taskId,))
+
+    def onPull(self, message):
+        """
+        Called on incoming task.
+
+        @param message: task data
+        @type message: C{list} of C{str}
+        @return: C{None} or Deferred firing when task has been handled
+        """
+        raise NotImplementedError(self)
+
+    def _handled(self, result, taskId):
+        self.handling.discard(taskId)
+        if self.factory is not None:
+            self.sendMultipart([TASK_ACK, taskId])
+
+    def _failed(self, failure, taskId):
+        log.err(failure, "Failed to handle task")
+        self.handling.discard(taskId)
+        if self.factory is not None:
+            self.sendMultipart([TASK_NACK, taskId,
+                                failure.getErrorMessage()])
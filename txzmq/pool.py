@@ -0,0 +1,167 @@
+"""
+Pool of ZeroMQ REQ connections.
+"""
+import bisect
+import hashlib
+
+from zmq.core import constants
+
+from txzmq.req_rep import ZmqREQConnection
+
+
+class ZmqREQPool(object):
+    """
+    Pool of L{ZmqREQConnection}s, spreading requests over several
+    sockets (and ZeroMQ IO threads) and endpoints.
+
+    Connections are assigned to endpoints and IO threads of the factory
+    in round-robin manner. Request goes to connection with the least
+    number of requests in flight, or, if key is given, to the connection
+    chosen by consistent hashing of the key.
+
+    @cvar connectionClass: class of pooled connections
+    @cvar hashReplicas: number of points on hash ring per connection
+    @type hashReplicas: C{int}
+
+    @ivar factory: ZeroMQ Twisted factory reference
+    @type factory: L{ZmqFactory}
+    @ivar connections: pooled connections
+    @type connections: C{list} of L{ZmqREQConnection}
+    @ivar requests: number of requests sent via each connection
+    @type requests: C{list} of C{int}
+    """
+
+    connectionClass = ZmqREQConnection
+    hashReplicas = 64
+
+    def __init__(self, factory, endpoints, size=None):
+        """
+        Constructor.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        @param endpoints: endpoints to connect to
+        @type endpoints: C{list} of L{ZmqEndpoint}
+        @param size: number of connections, defaults to number of endpoints
+        @type size: C{int}
+        """
+        assert endpoints, "At least one endpoint is required"
+        if size is None:
+            size = len(endpoints)
+
+        self.factory = factory
+        self.connections = []
+        self.requests = [0] * size
+        self._next = 0
+
+        for i in xrange(size):
+            connection = self.connectionClass(factory)
+            connection.socket.setsockopt(
+                constants.AFFINITY, 1 << (i % factory.ioThreads))
+            connection.addEndpoints([endpoints[i % len(endpoints)]])
+            self.connections.append(connection)
+
+        self._ring = []
+        for i, connection in enumerate(self.connections):
+            for replica in xrange(self.hashReplicas):
+                self._ring.append((self._hash("%s#%d#%d" % (
+                    connection.endpoints[0].address, i, replica)), i))
+        self._ring.sort()
+
+    def __repr__(self):
+        return "%s(%r, %d)" % (
+            self.__class__.__name__, self.factory, len(self.connections))
+
+    def sendMsg(self, *messageParts, **kwargs):
+        """
+        Send request via one of the connections.
+
+        @param messageParts: message data
+        @type messageParts: C{tuple}
+        @param key: if given, connection is chosen by consistent hashing
+            of the key, so requests with the same key go through the same
+            connection
+        @type key: C{str}
+        @param timeout: request timeout, seconds
+        @type timeout: C{float}
+        @return: Deferred that will fire when response comes back
+        """
+        key = kwargs.pop('key', None)
+        if key is None:
+            i = self._leastLoaded()
+        else:
+            i = self._byKey(key)
+
+        self.requests[i] += 1
+        return self.connections[i].sendMsg(*messageParts, **kwargs)
+
+    def inFlight(self):
+        """
+        Number of requests in flight via each connection.
+
+        @rtype: C{list} of C{int}
+        """
+        return [len(connection._requests) for connection in self.connections]
+
+    def stats(self):
+        """
+        Aggregate statistics of the pool.
+
+        @return: total number of requests sent and number of requests
+            in flight
+        @rtype: C{dict}
+        """
+        return {
+            'connections': len(self.connections),
+            'requests': sum(self.requests),
+            'inFlight': sum(self.inFlight()),
+        }
+
+    def shutdown(self):
+        """
+        Shutdown all connections.
+        """
+        for connection in self.connections:
+            connection.shutdown()
+        self.connections = []
+        self.factory = None
+
+    def _leastLoaded(self):
+        """
+        Choose connection with the least number of requests in flight.
+
+        Ties are broken in round-robin manner.
+
+        @return: index of connection
+        @rtype: C{int}
+        """
+        size = len(self.connections)
+        best, bestLoad = None, None
+        for j in xrange(self._next, self._next + size):
+            i = j % size
+            load = len(self.connections[i]._requests)
+            if best is None or load < bestLoad:
+                best, bestLoad = i, load
+                if load == 0:
+                    break
+        self._next = (best + 1) % size
+        return best
+
+    def _byKey(self, key):
+        """
+        Choose connection by consistent hashing of the key.
+
+        @return: index of connection
+        @rtype: C{int}
+        """
+        pos = bisect.bisect(self._ring, (self._hash(key),))
+        return self._ring[pos % len(self._ring)][1]
+
+    @staticmethod
+    def _hash(value):
+        """
+        Hash value to the position on the ring.
+
+        @rtype: C{long}
+        """
+        return long(hashlib.md5(value).hexdigest()[:16], 16)
@@ -0,0 +1,181 @@
+"""
+Profiling of incoming message dispatch.
+"""
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from twisted.python import log
+
+
+class ZmqDispatchStats(object):
+    """
+    Dispatch statistics of single connection class.
+
+    @ivar calls: number of messages dispatched
+    @type calls: C{int}
+    @ivar totalTime: total time spent in handlers, seconds
+    @type totalTime: C{float}
+    @ivar maxTime: longest handler call, seconds
+    @type maxTime: C{float}
+    @ivar slow: number of handler calls which took longer than threshold
+    @type slow: C{int}
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.slow = 0
+
+    def __repr__(self):
+        return "%s(calls=%d, totalTime=%.6f, maxTime=%.6f, slow=%d)" % (
+            self.__class__.__name__, self.calls, self.totalTime,
+            self.maxTime, self.slow)
+
+
+class ZmqDispatchProfiler(object):
+    """
+    Profiler timing every C{messageReceived} call of factory connections
+    (including C{gotMessage}, C{onPull}, etc. called from it).
+
+    Handler calls taking longer than threshold are recorded as slow
+    samples. If stack sampling is enabled, watchdog thread captures stack
+    of the reactor thread while slow handler is still running, so sample
+    shows where handler spends its time.
+
+    Profiler is installed on the factory with C{enable} and removed with
+    C{disable}, that could be done at any time.
+
+    @cvar clock: time function
+    @cvar sampleStacks: capture stacks of slow handlers?
+    @type sampleStacks: C{bool}
+
+    @ivar threshold: handler call duration to be considered slow, seconds
+    @type threshold: C{float}
+    @ivar stats: dispatch statistics by connection class name
+    @type stats: C{dict}
+    @ivar samples: recent slow handler calls: connection, duration and stack
+        (list of formatted frames or C{None} if it wasn't captured)
+    @type samples: C{deque}
+    """
+
+    clock = staticmethod(time.time)
+    sampleStacks = True
+
+    def __init__(self, threshold=0.1, maxSamples=100):
+        """
+        Constructor.
+
+        @param threshold: handler call duration to be considered slow,
+            seconds
+        @type threshold: C{float}
+        @param maxSamples: number of recent slow samples to keep
+        @type maxSamples: C{int}
+        """
+        self.threshold = threshold
+        self.stats = {}
+        self.samples = deque(maxlen=maxSamples)
+        self.factory = None
+
+        self._dispatches = 0
+        self._current = None
+        self._stack = None
+        self._watchdog = None
+        self._threadId = None
+
+    def enable(self, factory):
+        """
+        Start profiling connections of the factory.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        """
+        assert self.factory is None, "Profiler is already enabled"
+        self.factory = factory
+        factory.profiler = self
+
+        if self.sampleStacks:
+            self._threadId = threading.current_thread().ident
+            self._watchdog = threading.Event()
+            thread = threading.Thread(
+                target=self._watch, args=(self._watchdog,),
+                name="txzmq dispatch watchdog")
+            thread.daemon = True
+            thread.start()
+
+    def disable(self):
+        """
+        Stop profiling.
+        """
+        if self.factory is not None:
+            self.factory.profiler = None
+            self.factory = None
+        if self._watchdog is not None:
+            self._watchdog.set()
+            self._watchdog = None
+
+    def reset(self):
+        """
+        Clear collected statistics and samples.
+        """
+        self.stats = {}
+        self.samples.clear()
+
+    def dispatch(self, connection, handler, message):
+        """
+        Call message handler, measuring its duration.
+
+        @param connection: connection which received the message
+        @type connection: L{ZmqConnection}
+        @param handler: message handler
+        @param message: message data
+        """
+        self._dispatches += 1
+        token = self._dispatches
+        start = self.clock()
+        self._current = (token, start)
+        try:
+            log.callWithLogger(connection, handler, message)
+        finally:
+            self._current = None
+            elapsed = self.clock() - start
+
+            name = connection.__class__.__name__
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = ZmqDispatchStats()
+            stats.calls += 1
+            stats.totalTime += elapsed
+            if elapsed > stats.maxTime:
+                stats.maxTime = elapsed
+            if elapsed >= self.threshold:
+                stats.slow += 1
+                sampled = self._stack
+                stack = sampled[1] if sampled and sampled[0] == token \
+                    else None
+                self.samples.append((repr(connection), elapsed, stack))
+
+    def _watch(self, stopped):
+        """
+        Watchdog thread: capture stack of the reactor thread when
+        current handler runs longer than threshold.
+
+        @param stopped: event signalling watchdog to stop
+        @type stopped: L{threading.Event}
+        """
+        interval = self.threshold / 2
+        while not stopped.wait(interval):
+            current = self._current
+            if current is None:
+                continue
+            token, start = current
+            if self._stack is not None and self._stack[0] == token:
+                continue
+            if self.clock() - start < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._threadId)
+            if frame is not None:
+                self._stack = (token, traceback.format_stack(frame))
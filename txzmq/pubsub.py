@@ -1,17 +1,60 @@
 """
 ZeroMQ PUB-SUB wrappers.
 """
+import os
+import struct
+
 from zmq.core import constants
 
 from txzmq.connection import ZmqConnection
 
 
+# header frame of sequenced messages: mode, publisher ID, sequence number
+SEQUENCE_HEADER = struct.Struct('!BIQ')
+
+
+class ZmqSequencing(object):
+    """
+    Sequencing of published messages: single counter for all the messages
+    of the publisher or separate counter for every tag.
+    """
+    publisher = "publisher"
+    topic = "topic"
+
+
+_SEQUENCING_MODES = {ZmqSequencing.publisher: 1, ZmqSequencing.topic: 2}
+
+
 class ZmqPubConnection(ZmqConnection):
     """
     Publishing in broadcast manner.
+
+    If sequencing is enabled, messages are published as C{[tag, header,
+    message]} multipart messages, where header carries randomly chosen
+    publisher ID and sequence number of the message, so that subscribers
+    could detect lost and duplicate messages.
+
+    @cvar sequencing: sequencing mode, L{ZmqSequencing} or C{None}
+    @type sequencing: C{str}
+
+    @ivar publisherId: publisher ID sent in sequence headers
+    @type publisherId: C{int}
+    @ivar sequence: sequence number of the last published message
+        (with L{ZmqSequencing.publisher} sequencing)
+    @type sequence: C{int}
     """
+    __slots__ = ('publisherId', 'sequence', '_topicSequences')
+
     socketType = constants.PUB
 
+    sequencing = None
+
+    def __init__(self, *args, **kwargs):
+        ZmqConnection.__init__(self, *args, **kwargs)
+        self.publisherId, = struct.unpack('!I', os.urandom(4))
+        self.sequence = 0
+        self._topicSequences = {}
+
     def publish(self, message, tag=''):
         """
         Broadcast L{message} with specified L{tag}.
@@ -21,15 +64,54 @@ class ZmqPubConnection(ZmqConnection):
         @param tag: message tag
         @type tag: C{str}
         """
-        self.send(tag + '\0' + message)
+        if self.sequencing is None:
+            self.send(tag + '\0' + message)
+            return
+
+        if self.sequencing == ZmqSequencing.publisher:
+            self.sequence += 1
+            sequence = self.sequence
+        else:
+            sequence = self._topicSequences.get(tag, 0) + 1
+            self._topicSequences[tag] = sequence
+        self.send([tag, SEQUENCE_HEADER.pack(
+            _SEQUENCING_MODES[self.sequencing], self.publisherId, sequence),
+            message])
 
 
 class ZmqSubConnection(ZmqConnection):
     """
     Subscribing to messages.
+
+    Sequenced messages (see L{ZmqPubConnection}) are checked for gaps and
+    duplicates: gaps are reported to C{sequenceGap}, duplicates are
+    reported to C{sequenceDuplicate} and dropped. With
+    L{ZmqSequencing.publisher} sequencing gaps are detected correctly only
+    if all the publisher's messages are subscribed to.
+
+    With C{conflate} set only the newest message for every tag is
+    delivered out of a backlog (C{conflationKey} gets messages as
+    C{[tag, message]}); sequence numbers are checked before conflation,
+    so conflated messages don't count as lost.
+
+    @ivar gaps: number of gaps detected
+    @type gaps: C{int}
+    @ivar lostMessages: total number of messages missing in gaps
+    @type lostMessages: C{int}
+    @ivar duplicates: number of duplicate messages dropped
+    @type duplicates: C{int}
     """
+    __slots__ = ('gaps', 'lostMessages', 'duplicates', '_sequences')
+
     socketType = constants.SUB
 
+    def __init__(self, *args, **kwargs):
+        ZmqConnection.__init__(self, *args, **kwargs)
+        self.gaps = 0
+        self.lostMessages = 0
+        self.duplicates = 0
+        self._sequences = {}
+
     def subscribe(self, tag):
         """
         Subscribe to messages with specified tag (prefix).
@@ -38,6 +120,7 @@ class ZmqSubConnection(ZmqConnection):
         @type tag: C{str}
         """
         self.socket.setsockopt(constants.SUBSCRIBE, tag)
+        self._scheduleDoRead()
 
     def unsubscribe(self, tag):
         """
@@ -47,6 +130,7 @@ class ZmqSubConnection(ZmqConnection):
         @type tag: C{str}
         """
         self.socket.setsockopt(constants.UNSUBSCRIBE, tag)
+        self._scheduleDoRead()
 
     def messageReceived(self, message):
         """
@@ -54,13 +138,100 @@ class ZmqSubConnection(ZmqConnection):
 
         @param message: message data
         """
-        if len(message) == 2:  # XXX: this will be a bug with a 2 char string
+        if self._isSequenced(message):
+            if self._checkSequence(message[0], message[1]) is not None:
+                self.gotMessage(message[2], message[0])
+        elif len(message) == 2:  # XXX: this will be a bug with a 2 char string
             # compatibility receiving of tag as first part
             # of multi-part message
             self.gotMessage(message[1], message[0])
         else:
             self.gotMessage(*reversed(message[0].split('\0', 1)))
 
+    def _conflateMessage(self, latest, message):
+        # conflation keys see messages as [tag, message]
+        if self._isSequenced(message):
+            if self._checkSequence(message[0], message[1]) is None:
+                return
+            message = [message[0], message[2]]
+        elif len(message) != 2:
+            message = message[0].split('\0', 1)
+        ZmqConnection._conflateMessage(self, latest, message)
+
+    def _isSequenced(self, message):
+        """
+        Is message published with sequence header (see
+        L{ZmqPubConnection})?
+
+        Other messages, even those of three parts, are received the plain
+        way.
+
+        @param message: message data
+        @type message: C{list} of C{str}
+        @rtype: C{bool}
+        """
+        return len(message) == 3 and \
+            len(message[1]) == SEQUENCE_HEADER.size and \
+            ord(message[1][0]) in _SEQUENCING_MODES.values()
+
+    def _checkSequence(self, tag, header):
+        """
+        Check sequence number of the message for gaps and duplicates.
+
+        @param tag: message tag
+        @type tag: C{str}
+        @param header: sequence header frame
+        @type header: C{str}
+        @return: sequence number or C{None} if message is a duplicate
+        @rtype: C{int}
+        """
+        mode, publisherId, sequence = SEQUENCE_HEADER.unpack(header)
+        if mode == _SEQUENCING_MODES[ZmqSequencing.topic]:
+            key = (publisherId, tag)
+        else:
+            key = publisherId
+
+        last = self._sequences.get(key)
+        if last is not None:
+            if sequence <= last:
+                self.duplicates += 1
+                self.sequenceDuplicate(publisherId, tag, sequence)
+                return None
+            if sequence > last + 1:
+                self.gaps += 1
+                self.lostMessages += sequence - last - 1
+                self.sequenceGap(publisherId, tag, last + 1, sequence)
+        self._sequences[key] = sequence
+        return sequence
+
+    def sequenceGap(self, publisherId, tag, expected, received):
+        """
+        Called when gap in sequence numbers has been detected, messages
+        with sequence numbers from C{expected} up to C{received}
+        (exclusive) have been lost.
+
+        @param publisherId: publisher ID
+        @type publisherId: C{int}
+        @param tag: tag of the message which revealed the gap
+        @type tag: C{str}
+        @param expected: expected sequence number
+        @type expected: C{int}
+        @param received: received sequence number
+        @type received: C{int}
+        """
+
+    def sequenceDuplicate(self, publisherId, tag, sequence):
+        """
+        Called when duplicate (or out of order) message has been dropped.
+
+        @param publisherId: publisher ID
+        @type publisherId: C{int}
+        @param tag: message tag
+        @type tag: C{str}
+        @param sequence: sequence number of the message
+        @type sequence: C{int}
+        """
+
     def gotMessage(self, message, tag):
         """
         Called on incoming message recevied by subscriber
@@ -1,15 +1,20 @@
 """
 ZeroMQ PUSH-PULL wrappers.
 """
+from collections import deque
+
 from zmq.core import constants
 
 from txzmq.connection import ZmqConnection
+from txzmq.spool import ZmqSpool
 
 
 class ZmqPushConnection(ZmqConnection):
     """
     Publishing in broadcast manner.
     """
+    __slots__ = ()
+
     socketType = constants.PUSH
 
     def push(self, message):
@@ -22,10 +27,154 @@ class ZmqPushConnection(ZmqConnection):
         self.send(message)
 
 
+class ZmqDurablePushConnection(ZmqPushConnection):
+    """
+    Pushing messages with outgoing queue spilling to disk.
+
+    Up to C{spoolThreshold} frames are kept in memory queue, when queue
+    grows beyond that (e.g. there are no workers to pull messages), messages
+    are appended to the on-disk spool of memory-mapped segment files.
+    Spooled messages are moved back into memory as queue drains, and they're
+    removed from the spool only after they have been handed over to ZeroMQ;
+    messages left in the spool on shutdown (or crash) are pushed again when
+    connection is created with the same spool directory.
+
+    Setting C{spoolThreshold} to zero makes all messages go through the spool.
+    As ZeroMQ queues messages on its own, C{highWaterMark} should be set
+    to keep this queue bounded.
+
+    @cvar spoolThreshold: maximum number of frames in memory queue
+    @type spoolThreshold: C{int}
+    @cvar spoolSegmentSize: size of each spool segment file
+    @type spoolSegmentSize: C{int}
+
+    @ivar spool: on-disk spool
+    @type spool: L{ZmqSpool}
+    """
+    __slots__ = ('spool', '_queued', '_sentFrames')
+
+    highWaterMark = 1000
+    spoolThreshold = 10000
+    spoolSegmentSize = 16 * 1024 * 1024
+
+    def __init__(self, factory, endpoint=None, identity=None,
+                 spoolPath=None, socketOptions=None):
+        """
+        Constructor.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        @param endpoint: ZeroMQ address for connect/bind
+        @type endpoint: L{ZmqEndpoint}
+        @param identity: socket identity (ZeroMQ)
+        @type identity: C{str}
+        @param spoolPath: spool directory
+        @type spoolPath: C{str}
+        @param socketOptions: socket options
+        @type socketOptions: C{dict}
+        """
+        assert spoolPath is not None, "Spool directory is required"
+        self.spool = ZmqSpool(spoolPath, self.spoolSegmentSize)
+        # (number of frames, spool acknowledgement marker or None)
+        # for every message in memory queue
+        self._queued = deque()
+        self._sentFrames = 0
+
+        ZmqPushConnection.__init__(self, factory, endpoint, identity,
+                                   socketOptions)
+
+        if self.spool.pending:
+            self._refill()
+
+    def shutdown(self):
+        """
+        Shutdown connection and socket, closing the spool.
+        """
+        ZmqPushConnection.shutdown(self)
+        self.spool.close()
+
+    def send(self, message, priority=None):
+        """
+        Send message via ZeroMQ, spooling it if memory queue is full.
+
+        Spooled messages are kept in order in the single queue of the
+        lowest priority, other priorities aren't supported.
+
+        @param message: message data
+        @param priority: priority level, only C{None} or the lowest one
+            (C{priorities - 1})
+        @type priority: C{int}
+        """
+        if priority is not None and priority != self.priorities - 1:
+            raise ValueError(
+                "Durable push connection supports only the lowest "
+                "priority %d, got %r" % (self.priorities - 1, priority))
+
+        if not hasattr(message, '__iter__'):
+            message = [message]
+
+        if not self.spool.pending and \
+                len(self.queue) + len(message) <= self.spoolThreshold:
+            self._queued.append((len(message), None))
+            ZmqPushConnection.send(self, message)
+        else:
+            self.spool.append(message)
+            self._refill()
+
+    def doRead(self):
+        """
+        Send queued messages, acknowledge sent spooled ones and
+        refill memory queue from the spool.
+
+        Part of L{IReadDescriptor}.
+        """
+        before = len(self.queue)
+        try:
+            ZmqPushConnection.doRead(self)
+        finally:
+            if self.factory is not None:
+                self._ack(before - len(self.queue))
+                self._refill()
+
+    def _ack(self, sent):
+        """
+        Account for sent frames, acknowledging spooled messages
+        which have been completely sent.
+
+        @param sent: number of frames sent
+        @type sent: C{int}
+        """
+        self._sentFrames += sent
+        marker = None
+        while self._queued and self._queued[0][0] <= self._sentFrames:
+            frames, spooled = self._queued.popleft()
+            self._sentFrames -= frames
+            if spooled is not None:
+                marker = spooled
+        if marker is not None:
+            self.spool.ack(marker)
+
+    def _refill(self):
+        """
+        Move messages from the spool to memory queue while there's room.
+        """
+        while self.spool.pending and (
+                len(self.queue) < self.spoolThreshold or not self.queue):
+            message, marker = self.spool.read()
+            self._queued.append((len(message), marker))
+            ZmqPushConnection.send(self, message)
+
+
 class ZmqPullConnection(ZmqConnection):
     """
     Pull messages from a socket
+
+    With C{conflate} set only the newest message for every key (first part
+    of the message by default, see C{conflationKey}) is delivered
+    out of a backlog.
     """
+    __slots__ = ()
+
     socketType = constants.PULL
 
     def messageReceived(self, message):
@@ -0,0 +1,250 @@
+"""
+Reliable request-reply client ("Lazy Pirate" pattern).
+"""
+from twisted.internet import defer
+
+from txzmq.heartbeat import ZmqPeerLostError
+from txzmq.req_rep import ZmqREQConnection, ZmqRequestTimeoutError
+
+
+class _ReliableRequest(object):
+    """
+    State of single request sent via L{ZmqReliableREQClient}.
+
+    @ivar parts: request message parts
+    @type parts: C{tuple}
+    @ivar deferred: deferred returned to the caller
+    @type deferred: L{defer.Deferred}
+    @ivar attempt: deferred of the request currently on the wire
+    @type attempt: L{defer.Deferred}
+    @ivar delayedCall: scheduled retry
+    @ivar retries: number of retries done so far
+    @type retries: C{int}
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.deferred = None
+        self.attempt = None
+        self.delayedCall = None
+        self.retries = 0
+
+
+class ZmqReliableREQClient(object):
+    """
+    Request client which retries requests on timeout.
+
+    Client maintains single L{ZmqREQConnection} connected to one of the
+    server endpoints. When request times out (or peer is reported lost by
+    heartbeating), socket is closed and new one is connected to the next
+    endpoint in the list; request is retried after backoff delay, requests
+    which were in flight on the old socket are resent immediately.
+
+    Reply to a request which has been already retried, cancelled or failed
+    is ignored, so every request fires at most once.
+
+    @cvar connectionClass: class of underlying connection
+    @cvar requestTimeout: timeout of single attempt, seconds
+    @type requestTimeout: C{float}
+    @cvar maxRetries: number of retries before giving up
+    @type maxRetries: C{int}
+    @cvar retryDelay: delay before the first retry, seconds
+    @type retryDelay: C{float}
+    @cvar retryBackoff: multiplier of delay for each subsequent retry
+    @type retryBackoff: C{float}
+    @cvar maxRetryDelay: upper limit of delay between retries, seconds
+    @type maxRetryDelay: C{float}
+
+    @ivar factory: ZeroMQ Twisted factory reference
+    @type factory: L{ZmqFactory}
+    @ivar endpoints: server endpoints, used in round-robin manner
+    @type endpoints: C{list} of L{ZmqEndpoint}
+    @ivar connection: current connection
+    @type connection: L{ZmqREQConnection}
+    @ivar requests: number of requests sent
+    @type requests: C{int}
+    @ivar retries: number of retries done
+    @type retries: C{int}
+    @ivar timeouts: number of attempts which timed out
+    @type timeouts: C{int}
+    @ivar reconnects: number of times socket was recreated
+    @type reconnects: C{int}
+    @ivar failures: number of requests failed after all retries
+    @type failures: C{int}
+    """
+
+    connectionClass = ZmqREQConnection
+    requestTimeout = 2.5
+    maxRetries = 3
+    retryDelay = 0.1
+    retryBackoff = 2.0
+    maxRetryDelay = 5.0
+
+    def __init__(self, factory, endpoints, identity=None):
+        """
+        Constructor.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        @param endpoints: server endpoints to connect to
+        @type endpoints: C{list} of L{ZmqEndpoint}
+        @param identity: socket identity (ZeroMQ)
+        @type identity: C{str}
+        """
+        assert endpoints, "At least one endpoint is required"
+
+        self.factory = factory
+        self.endpoints = list(endpoints)
+        self.identity = identity
+        self.connection = None
+
+        self.requests = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.failures = 0
+
+        self._endpointIndex = -1
+        self._pending = set()
+
+        self._connect()
+
+    def __repr__(self):
+        return "%s(%r, %r)" % (
+            self.__class__.__name__, self.factory, self.endpoints)
+
+    def sendMsg(self, *messageParts):
+        """
+        Send request and deliver response back when available.
+
+        Deferred fails with L{ZmqRequestTimeoutError} if all retries
+        have been exhausted.
+
+        @param messageParts: message data
+        @type messageParts: C{tuple}
+        @return: Deferred that will fire when response comes back
+        """
+        request = _ReliableRequest(messageParts)
+        request.deferred = defer.Deferred(
+            canceller=lambda _: self._cancel(request))
+
+        self._pending.add(request)
+        self.requests += 1
+        self._attempt(request)
+        return request.deferred
+
+    def shutdown(self):
+        """
+        Shutdown client and its connection.
+
+        Pending requests fail with L{defer.CancelledError}.
+        """
+        pending, self._pending = self._pending, set()
+        for request in pending:
+            self._abandon(request)
+
+        self.connection.shutdown()
+        self.connection = None
+        self.factory = None
+
+        for request in pending:
+            request.deferred.errback(
+                defer.CancelledError("Client has been shut down"))
+
+    def _connect(self):
+        """
+        Create new connection to the next endpoint.
+        """
+        self._endpointIndex = (self._endpointIndex + 1) % len(self.endpoints)
+        self.connection = self.connectionClass(
+            self.factory, self.endpoints[self._endpointIndex],
+            identity=self.identity)
+
+    def _reconnect(self):
+        """
+        Replace connection with the new one, resending requests in flight.
+        """
+        old = self.connection
+        self._connect()
+        self.reconnects += 1
+
+        for request in self._pending:
+            if request.attempt is not None:
+                self._abandon(request)
+                self._attempt(request)
+
+        old.shutdown()
+
+    def _attempt(self, request):
+        """
+        Send request via current connection.
+
+        @param request: request to send
+        @type request: L{_ReliableRequest}
+        """
+        request.delayedCall = None
+        attempt = request.attempt = self.connection.sendMsg(
+            *request.parts, timeout=self.requestTimeout)
+        attempt.addCallbacks(
+            self._gotReply, self._attemptFailed,
+            callbackArgs=(request, attempt), errbackArgs=(request, attempt))
+
+    def _abandon(self, request):
+        """
+        Stop waiting for current attempt and scheduled retry.
+
+        @param request: request to abandon
+        @type request: L{_ReliableRequest}
+        """
+        if request.delayedCall is not None:
+            request.delayedCall.cancel()
+            request.delayedCall = None
+        if request.attempt is not None:
+            attempt, request.attempt = request.attempt, None
+            attempt.cancel()
+
+    def _cancel(self, request):
+        """
+        Cancel request, called on deferred cancellation.
+
+        @param request: request to cancel
+        @type request: L{_ReliableRequest}
+        """
+        self._pending.discard(request)
+        self._abandon(request)
+
+    def _gotReply(self, reply, request, attempt):
+        """
+        Reply to an attempt has been received.
+        """
+        if request.attempt is not attempt:
+            return  # abandoned attempt
+        request.attempt = None
+        self._pending.discard(request)
+        request.deferred.callback(reply)
+
+    def _attemptFailed(self, failure, request, attempt):
+        """
+        Attempt has failed: retry it or give up.
+        """
+        if request.attempt is not attempt:
+            return  # abandoned attempt
+        request.attempt = None
+
+        retriable = failure.check(ZmqRequestTimeoutError, ZmqPeerLostError)
+        if retriable:
+            self.timeouts += 1
+        if not retriable or request.retries >= self.maxRetries:
+            self._pending.discard(request)
+            self.failures += 1
+            request.deferred.errback(failure)
+            return
+
+        self._reconnect()
+
+        request.retries += 1
+        self.retries += 1
+        delay = min(self.retryDelay * self.retryBackoff ** (
+            request.retries - 1), self.maxRetryDelay)
+        request.delayedCall = self.factory.reactor.callLater(
+            delay, self._attempt, request)
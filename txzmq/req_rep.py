@@ -9,6 +9,13 @@ from zmq.core import constants
 from twisted.internet import defer
 
 from txzmq.connection import ZmqConnection
+from txzmq.heartbeat import HEARTBEAT_PING, HEARTBEAT_PONG, ZmqPeerLostError
+
+
+class ZmqRequestTimeoutError(Exception):
+    """
+    Request has timed out.
+    """
 
 
 class ZmqREQConnection(ZmqConnection):
@@ -18,12 +25,19 @@ class ZmqREQConnection(ZmqConnection):
     This is implemented with an underlying DEALER socket, even though
     semantics are closer to REQ socket.
 
+    @cvar defaultRequestTimeout: default timeout for requests, seconds;
+        C{None} means no timeout
+    @type defaultRequestTimeout: C{float}
     """
+    __slots__ = ('_requests', '_uuids')
+
     socketType = constants.DEALER
 
     # the number of new UUIDs to generate when the pool runs out of them
     UUID_POOL_GEN_SIZE = 5
 
+    defaultRequestTimeout = None
+
     def __init__(self, *args, **kwargs):
         ZmqConnection.__init__(self, *args, **kwargs)
         self._requests = {}
@@ -56,30 +70,128 @@ class ZmqREQConnection(ZmqConnection):
         if len(self._uuids) > 2 * self.UUID_POOL_GEN_SIZE:
             self._uuids[-self.UUID_POOL_GEN_SIZE:] = []
 
-    def sendMsg(self, *messageParts):
+    def sendMsg(self, *messageParts, **kwargs):
         """
-        Send L{message} with specified L{tag}.
+        Send request and deliver response back when available.
+
+        If heartbeating is enabled and peer is considered lost,
+        request fails immediately with L{ZmqPeerLostError}.
+
+        Returned deferred could be cancelled, reply to cancelled
+        request is ignored.
 
         @param messageParts: message data
         @type messageParts: C{tuple}
+        @param timeout: fail request with L{ZmqRequestTimeoutError}
+            if no reply comes back in C{timeout} seconds
+            (defaults to C{defaultRequestTimeout})
+        @type timeout: C{float}
+        @return: Deferred that will fire when response comes back
         """
-        d = defer.Deferred()
+        timeout = kwargs.pop('timeout', self.defaultRequestTimeout)
+        assert not kwargs, "Unsupported keyword arguments: %r" % kwargs
+
+        if self.heartbeat is not None and not self.heartbeat.alive:
+            return defer.fail(ZmqPeerLostError())
+
         messageId = self._getNextId()
-        self._requests[messageId] = d
-        self.send([messageId, ''] + list(messageParts))
+        d = defer.Deferred(canceller=lambda _: self._cancel(messageId))
+
+        timeoutCall = None
+        if timeout is not None:
+            timeoutCall = self.factory.reactor.callLater(
+                timeout, self._timeoutRequest, messageId)
+
+        self._requests[messageId] = (d, timeoutCall)
+        self._sendRequest(messageId, messageParts)
         return d
 
+    def _sendRequest(self, messageId, messageParts):
+        """
+        Put request on the wire.
+
+        @param messageId: message ID
+        @type messageId: C{str}
+        @param messageParts: message data
+        @type messageParts: C{tuple}
+        """
+        self.send([messageId, ''] + list(messageParts))
+
+    def _cancel(self, msgId):
+        """
+        Forget about pending request, called on deferred cancellation.
+
+        Message ID is not released, as reply might still arrive.
+
+        @param msgId: message ID
+        @type msgId: C{str}
+        """
+        _, timeoutCall = self._requests.pop(msgId, (None, None))
+        if timeoutCall is not None and timeoutCall.active():
+            timeoutCall.cancel()
+
+    def _timeoutRequest(self, msgId):
+        """
+        Fail pending request which hasn't been replied to in time.
+
+        @param msgId: message ID
+        @type msgId: C{str}
+        """
+        d, _ = self._requests.pop(msgId, (None, None))
+        if d is not None:
+            d.errback(ZmqRequestTimeoutError(msgId))
+
     def messageReceived(self, message):
         """
         Called on incoming message from ZeroMQ.
 
         @param message: message data
         """
-        msgId, _, msg = message[0], message[1], message[2:]
-        d = self._requests.pop(msgId)
+        msgId, msg = message[0], message[2:]
+        if msgId == HEARTBEAT_PONG:
+            return
+        d, timeoutCall = self._requests.pop(msgId, (None, None))
+        if d is None:
+            # late reply to the request which has been already
+            # failed or cancelled
+            return
+        if timeoutCall is not None:
+            timeoutCall.cancel()
         self._releaseId(msgId)
         d.callback(msg)
 
+    def shutdown(self):
+        """
+        Shutdown connection and socket.
+
+        Pending requests are not fired, but their timeouts are cancelled.
+        """
+        for _, timeoutCall in self._requests.itervalues():
+            if timeoutCall is not None and timeoutCall.active():
+                timeoutCall.cancel()
+        ZmqConnection.shutdown(self)
+
+    def _sendHeartbeat(self):
+        """
+        Send single heartbeat (ping) to the peer.
+        """
+        self._sendPing([HEARTBEAT_PING, ''])
+
+    def _peerLost(self):
+        """
+        Heartbeat detected that peer has been lost.
+
+        All pending requests are failed with L{ZmqPeerLostError}.
+        Their message IDs are not released, as replies might still arrive.
+        """
+        requests, self._requests = self._requests, {}
+        for d, timeoutCall in requests.itervalues():
+            if timeoutCall is not None:
+                timeoutCall.cancel()
+            if not d.called:  # could be cancelled by previous errbacks
+                d.errback(ZmqPeerLostError())
+        ZmqConnection._peerLost(self)
+
 
 class ZmqREPConnection(ZmqConnection):
     """
@@ -88,6 +200,8 @@ class ZmqREPConnection(ZmqConnection):
     This is implemented with an underlying ROUTER socket, but the semantics
     are close to REP socket.
     """
+    __slots__ = ('_routingInfo',)
+
     socketType = constants.ROUTER
 
     def __init__(self, *args, **kwargs):
@@ -116,6 +230,9 @@ class ZmqREPConnection(ZmqConnection):
         assert i > 0
         (routingInfo, msgId, payload) = (
             message[:i - 1], message[i - 1], message[i + 1:])
+        if msgId == HEARTBEAT_PING:
+            self.send(routingInfo + [HEARTBEAT_PONG, ''], 0)
+            return
         msgParts = payload[0:]
         self._routingInfo[msgId] = routingInfo
         self.gotMessage(msgId, *msgParts)
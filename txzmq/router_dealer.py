@@ -1,9 +1,13 @@
 """
 ZeroMQ ROUTER and DEALER connection types.
 """
-from zmq.core import constants
+import errno
+from collections import deque
+
+from zmq.core import constants, error
 
 from txzmq.connection import ZmqConnection
+from txzmq.heartbeat import HEARTBEAT_PING, HEARTBEAT_PONG
 
 
 # TODO: ideally, all connection classes would inherit from this in the future
@@ -25,6 +29,8 @@ class ZmqBase(ZmqConnection):
     Subclasses can/should add their own semantic aliases for sendMsg and
     sendMultipart, such as publish and publishMultipart for a PUB socket.
     """
+    __slots__ = ()
+
     def sendMsg(self, message):
         """
         Provides a higher level wrapper over ZmqConnection.send for sending
@@ -62,22 +68,325 @@ class ZmqBase(ZmqConnection):
 class ZmqDealerConnection(ZmqBase):
     """
     A DEALER connection.
+
+    Heartbeats are single-part messages, peer is expected to reply to ping
+    with pong (L{ZmqRouterConnection} does that automatically); they're
+    sent with the highest priority.
     """
+    __slots__ = ()
+
     socketType = constants.DEALER
 
+    def messageReceived(self, message):
+        if message == [HEARTBEAT_PONG]:
+            return
+        if message == [HEARTBEAT_PING]:
+            self.send(HEARTBEAT_PONG, 0)
+            return
+        self.gotMessage(message)
+
+    def _sendHeartbeat(self):
+        """
+        Send single heartbeat (ping) to the peer.
+        """
+        self._sendPing([HEARTBEAT_PING])
+
+
+class ZmqRouterPeer(object):
+    """
+    Peer of ROUTER connection: outgoing queue and statistics.
+
+    @ivar identity: peer identity
+    @type identity: C{str}
+    @ivar queue: messages waiting to be sent to the peer (without identity)
+    @type queue: C{deque} of C{list}
+    @ivar weight: number of messages sent to the peer in its turn
+    @type weight: C{int}
+    @ivar sent: number of messages sent to the peer
+    @type sent: C{int}
+    @ivar received: number of messages received from the peer
+    @type received: C{int}
+    @ivar blocked: number of times ZeroMQ refused message to the peer
+    @type blocked: C{int}
+    @ivar lastSeen: time of last message sent to or received from the peer
+    @type lastSeen: C{float}
+    """
+
+    __slots__ = ('identity', 'queue', 'weight', 'sent', 'received',
+                 'blocked', 'lastSeen')
+
+    def __init__(self, identity, weight, now):
+        self.identity = identity
+        self.queue = deque()
+        self.weight = weight
+        self.sent = 0
+        self.received = 0
+        self.blocked = 0
+        self.lastSeen = now
+
+    def __repr__(self):
+        return "%s(%r, queued=%d, sent=%d, received=%d, blocked=%d)" % (
+            self.__class__.__name__, self.identity, len(self.queue),
+            self.sent, self.received, self.blocked)
+
 
 class ZmqRouterConnection(ZmqBase):
     """
     A ROUTER connection.
+
+    Outgoing messages are queued per peer and peers with queued messages
+    are served round-robin, every peer sending up to its weight of
+    messages in its turn. When ZeroMQ refuses message to a peer (it is
+    unknown or its pipe is full, reported only with C{ROUTER_MANDATORY}
+    socket option set), the peer is skipped until next C{doRead} (retried
+    in C{peerRetryInterval} seconds at latest), while other peers are
+    still served.
+
+    Every peer ever seen gets into the peer table, so peers which haven't
+    sent or received anything for C{peerIdleTimeout} are forgotten
+    together with messages queued to them, see L{peerExpired}.
+
+    @cvar peerWeight: default weight of peers
+    @type peerWeight: C{int}
+    @cvar peerIdleTimeout: time after which idle peer is forgotten,
+        seconds, C{None} to keep peers forever (peer table then grows
+        with every new peer)
+    @type peerIdleTimeout: C{float}
+    @cvar peerRetryInterval: delay before retrying to send to blocked
+        peers, seconds
+    @type peerRetryInterval: C{float}
+
+    @ivar peers: peers by identity
+    @type peers: C{dict} of L{ZmqRouterPeer}
+    @ivar expired: number of expired peers
+    @type expired: C{int}
+    @ivar dropped: number of messages dropped with expired peers
+    @type dropped: C{int}
     """
+    __slots__ = ('peers', 'expired', 'dropped', '_ready', '_retry',
+                 '_expiry')
+
     socketType = constants.ROUTER
 
+    peerWeight = 1
+    peerIdleTimeout = 300.0
+    peerRetryInterval = 1.0
+
+    def __init__(self, *args, **kwargs):
+        self.peers = {}
+        self.expired = 0
+        self.dropped = 0
+        self._ready = deque()
+        self._retry = None
+        self._expiry = None
+        if self.peerWeight < 1:
+            raise ValueError("Peer weight should be at least 1, got %r" % (
+                self.peerWeight,))
+
+        ZmqBase.__init__(self, *args, **kwargs)
+
+    def shutdown(self):
+        if self._expiry is not None and self._expiry.active():
+            self._expiry.cancel()
+        self._expiry = None
+        if self._retry is not None and self._retry.active():
+            self._retry.cancel()
+        self._retry = None
+        ZmqBase.shutdown(self)
+
+    def hasQueued(self):
+        """
+        Are there messages waiting in send queues, including peer queues?
+
+        @rtype: C{bool}
+        """
+        return bool(self._ready) or ZmqBase.hasQueued(self)
+
     def sendMsg(self, recipientId, message):
         self.send([recipientId, message])
 
     def sendMultipart(self, recipientId, parts):
         self.send([recipientId] + parts)
 
+    def send(self, message, priority=None):
+        """
+        Queue message to the peer identified by its first part.
+
+        @param message: message data, identity of the peer first, at
+            least one more part
+        @type message: C{list} of C{str}
+        @param priority: priority level, only C{None} or the lowest one
+            (C{priorities - 1}), peer queues have no priority levels
+        @type priority: C{int}
+        @raise ValueError: if message has no parts after identity or
+            priority isn't supported
+        """
+        if priority is not None and priority != self.priorities - 1:
+            raise ValueError(
+                "ROUTER connection supports only the lowest priority %d, "
+                "got %r" % (self.priorities - 1, priority))
+        if not hasattr(message, '__iter__') or len(message) < 2:
+            raise ValueError(
+                "Expected peer identity and message, got %r" % (message,))
+
+        if self.capture is not None:
+            self.capture.sent(message)
+        peer = self.getPeer(message[0])
+        if not peer.queue:
+            self._ready.append(peer)
+        peer.queue.append(message[1:])
+
+        self._scheduleDoRead()
+
+    def getPeer(self, identity):
+        """
+        Get peer by identity, adding it to the peer table if needed.
+
+        @param identity: peer identity
+        @type identity: C{str}
+        @rtype: L{ZmqRouterPeer}
+        """
+        peer = self.peers.get(identity)
+        if peer is None:
+            peer = self.peers[identity] = ZmqRouterPeer(
+                identity, self.peerWeight, self.factory.reactor.seconds())
+            self._scheduleExpiry()
+        return peer
+
+    def setPeerWeight(self, identity, weight):
+        """
+        Set number of messages sent to the peer in its turn.
+
+        @param identity: peer identity
+        @type identity: C{str}
+        @param weight: peer weight, at least 1
+        @type weight: C{int}
+        @raise ValueError: if weight is less than 1
+        """
+        if weight < 1:
+            raise ValueError("Peer weight should be at least 1, got %r" % (
+                weight,))
+        self.getPeer(identity).weight = weight
+
+    def expirePeers(self):
+        """
+        Forget peers which have been idle for longer than
+        C{peerIdleTimeout}, dropping messages queued to them.
+        """
+        deadline = self.factory.reactor.seconds() - self.peerIdleTimeout
+        for identity, peer in self.peers.items():
+            if peer.lastSeen >= deadline:
+                continue
+            del self.peers[identity]
+            if peer.queue:
+                self._ready.remove(peer)
+                self.dropped += len(peer.queue)
+            self.expired += 1
+            self.peerExpired(peer)
+
+    def _scheduleExpiry(self):
+        """
+        Schedule expiry of idle peers, if there are any peers.
+
+        Expiry runs every C{peerIdleTimeout / 2} seconds while peer table
+        isn't empty.
+        """
+        if self.peerIdleTimeout is None or self._expiry is not None or \
+                not self.peers or self.factory is None:
+            return
+        self._expiry = self.factory.reactor.callLater(
+            self.peerIdleTimeout / 2.0, self._expirePeers)
+
+    def _expirePeers(self):
+        self._expiry = None
+        self.expirePeers()
+        self._scheduleExpiry()
+
+    def peerExpired(self, peer):
+        """
+        Called when idle peer is forgotten.
+
+        Override in subclasses to log the event or report messages left
+        in C{peer.queue}.
+
+        @param peer: expired peer
+        @type peer: L{ZmqRouterPeer}
+        """
+
     def messageReceived(self, message):
+        peer = self.getPeer(message[0])
+        peer.received += 1
+        peer.lastSeen = self.factory.reactor.seconds()
+        if len(message) > 1 and message[1] == HEARTBEAT_PING:
+            # answer ping, echoing the rest of the message back
+            self.send([message[0], HEARTBEAT_PONG] + message[2:])
+            return
         sender_id = message.pop(0)
         self.gotMessage(sender_id, message)
+
+    def _sendQueued(self):
+        """
+        Send queued messages, serving peers round-robin.
+        """
+        ZmqBase._sendQueued(self)
+
+        now = self.factory.reactor.seconds()
+        blocked = []
+        try:
+            while self._ready:
+                peer = self._ready[0]
+                for i in xrange(peer.weight):
+                    if not self._sendToPeer(peer):
+                        blocked.append(self._ready.popleft())
+                        break
+                    peer.lastSeen = now
+                    if not peer.queue:
+                        self._ready.popleft()
+                        break
+                else:
+                    self._ready.rotate(-1)
+        finally:
+            if self._ready and not self._ready[0].queue:
+                # message which failed to be sent was the last one
+                self._ready.popleft()
+            self._ready.extend(blocked)
+
+        if blocked and self._retry is None:
+            self._retry = self.factory.reactor.callLater(
+                self.peerRetryInterval, self._retryBlocked)
+
+    def _sendToPeer(self, peer):
+        """
+        Send first message queued to the peer.
+
+        @param peer: peer with queued messages
+        @type peer: L{ZmqRouterPeer}
+        @return: C{False} if ZeroMQ refused the message
+        @rtype: C{bool}
+        """
+        message = peer.queue[0]
+        try:
+            self.socket.send(
+                peer.identity, constants.NOBLOCK | constants.SNDMORE)
+        except error.ZMQError as e:
+            if e.errno in (constants.EAGAIN, errno.EHOSTUNREACH):
+                peer.blocked += 1
+                return False
+            peer.queue.popleft()
+            raise e
+
+        # once identity is accepted, rest of the message goes through
+        peer.queue.popleft()
+        for part in message[:-1]:
+            self.socket.send(part, constants.NOBLOCK | constants.SNDMORE)
+        self.socket.send(message[-1], constants.NOBLOCK)
+        peer.sent += 1
+        return True
+
+    def _retryBlocked(self):
+        """
+        Retry sending to peers blocked by ZeroMQ.
+        """
+        self._retry = None
+        if self.factory is not None:
+            self.doRead()
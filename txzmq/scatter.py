@@ -0,0 +1,271 @@
+"""
+Scatter-gather: sending the same request to many peers and gathering
+first, first K, quorum or all replies.
+"""
+import struct
+from itertools import count
+
+from twisted.internet import defer
+
+from txzmq.router_dealer import ZmqRouterConnection
+
+
+# request ids of scatter-gather over ROUTER
+REQUEST_ID = struct.Struct('!Q')
+
+
+class ZmqScatterGatherError(Exception):
+    """
+    Not enough replies have been gathered: deadline has passed or too
+    many requests have failed.
+
+    @ivar results: replies gathered so far, list of (peer, reply)
+    @type results: C{list}
+    @ivar failures: failed requests, list of (peer, failure)
+    @type failures: C{list}
+    """
+
+    def __init__(self, message, results, failures):
+        Exception.__init__(self, message)
+        self.results = results
+        self.failures = failures
+
+
+class ZmqGatherPolicy(object):
+    """
+    Number of replies to gather: first one, quorum (majority of peers)
+    or all of them. Any number could be used as well.
+    """
+    first = "first"
+    quorum = "quorum"
+    all = "all"
+
+    @classmethod
+    def needed(cls, policy, size):
+        """
+        Number of replies needed by the policy.
+
+        @param policy: one of policies or number of replies
+        @param size: number of peers
+        @type size: C{int}
+        @rtype: C{int}
+        """
+        if policy == cls.first:
+            return min(1, size)
+        elif policy == cls.quorum:
+            return size // 2 + 1 if size else 0
+        elif policy == cls.all:
+            return size
+        if not isinstance(policy, (int, long)) or policy < 0:
+            raise ValueError("Unknown gather policy %r" % (policy,))
+        return min(policy, size)
+
+
+class _Gather(object):
+    """
+    State of single scatter-gather.
+
+    @ivar need: number of replies needed
+    @type need: C{int}
+    @ivar pending: peers which haven't replied yet
+    @type pending: C{set}
+    @ivar results: replies gathered so far, list of (peer, reply)
+    @type results: C{list}
+    @ivar failures: failed requests, list of (peer, failure)
+    @type failures: C{list}
+    @ivar deferred: deferred returned to the caller
+    @type deferred: L{defer.Deferred}
+    """
+
+    def __init__(self, peers, need, cancel):
+        self.need = need
+        self.pending = set(peers)
+        self.results = []
+        self.failures = []
+        self.timeoutCall = None
+        self._cancel = cancel
+        self.deferred = defer.Deferred(canceller=lambda _: self._finish(None))
+
+    def start(self, clock, timeout):
+        if self.deferred.called:  # requests have failed right away
+            return
+        if timeout is not None:
+            self.timeoutCall = clock.callLater(timeout, self._timedOut)
+        self._check()
+
+    def gotResult(self, result, peer):
+        if peer in self.pending:
+            self.pending.discard(peer)
+            self.results.append((peer, result))
+            self._check()
+
+    def gotFailure(self, failure, peer):
+        if peer in self.pending:
+            self.pending.discard(peer)
+            self.failures.append((peer, failure))
+            self._check()
+
+    def _check(self):
+        if len(self.results) >= self.need:
+            self._finish(self.results)
+        elif len(self.results) + len(self.pending) < self.need:
+            self._finish(ZmqScatterGatherError(
+                "%d of %d needed replies gathered, %d requests failed" % (
+                    len(self.results), self.need, len(self.failures)),
+                self.results, self.failures))
+
+    def _timedOut(self):
+        self.timeoutCall = None
+        self._finish(ZmqScatterGatherError(
+            "Deadline passed with %d of %d needed replies gathered" % (
+                len(self.results), self.need),
+            self.results, self.failures))
+
+    def _finish(self, result):
+        """
+        Cancel stragglers and fire the deferred (unless it's being
+        cancelled).
+        """
+        if self.timeoutCall is not None and self.timeoutCall.active():
+            self.timeoutCall.cancel()
+        self.timeoutCall = None
+
+        stragglers, self.pending = self.pending, set()
+        for peer in stragglers:
+            self._cancel(peer)
+
+        if result is None or self.deferred.called:
+            return
+        if isinstance(result, Exception):
+            self.deferred.errback(result)
+        else:
+            self.deferred.callback(result)
+
+
+class ZmqREQScatter(object):
+    """
+    Scatter-gather over a set of L{ZmqREQConnection}s: request is sent
+    via every connection and deferred fires as soon as enough replies
+    have been gathered, cancelling requests still in flight.
+
+    @ivar connections: connections to send requests through
+    @type connections: C{list} of L{ZmqREQConnection}
+    """
+
+    def __init__(self, connections):
+        """
+        Constructor.
+
+        @param connections: connections to send requests through
+        @type connections: C{list} of L{ZmqREQConnection}
+        """
+        assert connections, "At least one connection is required"
+        self.connections = connections
+
+    def __repr__(self):
+        return "%s(%d)" % (self.__class__.__name__, len(self.connections))
+
+    def sendMsg(self, *messageParts, **kwargs):
+        """
+        Send request via every connection.
+
+        @param messageParts: message data
+        @type messageParts: C{tuple}
+        @param need: number of replies to gather or L{ZmqGatherPolicy}
+            (defaults to all)
+        @param timeout: deadline for gathering replies, seconds
+        @type timeout: C{float}
+        @return: Deferred firing with list of (connection, reply) in order
+            of arrival, failing with L{ZmqScatterGatherError}
+        """
+        need = kwargs.pop('need', ZmqGatherPolicy.all)
+        timeout = kwargs.pop('timeout', None)
+        assert not kwargs, "Unsupported keyword arguments: %r" % kwargs
+
+        requests = {}
+
+        def cancel(connection):
+            d = requests.pop(connection, None)
+            if d is not None:
+                d.cancel()
+
+        gather = _Gather(
+            self.connections,
+            ZmqGatherPolicy.needed(need, len(self.connections)), cancel)
+        for connection in self.connections:
+            if gather.deferred.called:
+                break
+            requests[connection] = d = connection.sendMsg(*messageParts)
+            d.addCallbacks(gather.gotResult, gather.gotFailure,
+                           callbackArgs=(connection,),
+                           errbackArgs=(connection,))
+        gather.start(self.connections[0].factory.reactor, timeout)
+        return gather.deferred
+
+
+class ZmqScatterRouterConnection(ZmqRouterConnection):
+    """
+    Scatter-gather over ROUTER: request is sent to many peers via single
+    socket, deferred fires as soon as enough replies have been gathered,
+    later replies are ignored.
+
+    Request to the peer is C{[requestId, '', parts...]}, peer (usually
+    DEALER) is expected to reply with the same envelope:
+    C{[requestId, '', reply parts...]}.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._gathers = {}
+        self._ids = count()
+
+        ZmqRouterConnection.__init__(self, *args, **kwargs)
+
+    def scatter(self, peers, *messageParts, **kwargs):
+        """
+        Send request to the peers.
+
+        @param peers: identities of the peers, C{None} for all known peers
+            (see C{peers}), which requires C{timeout}: known peers include
+            dead ones until they expire
+        @type peers: C{list} of C{str}
+        @param messageParts: message data
+        @type messageParts: C{tuple}
+        @param need: number of replies to gather or L{ZmqGatherPolicy}
+            (defaults to all)
+        @param timeout: deadline for gathering replies, seconds
+        @type timeout: C{float}
+        @return: Deferred firing with list of (peer identity, reply) in
+            order of arrival, failing with L{ZmqScatterGatherError}
+        @raise ValueError: if request to all known peers has no timeout
+        """
+        need = kwargs.pop('need', ZmqGatherPolicy.all)
+        timeout = kwargs.pop('timeout', None)
+        assert not kwargs, "Unsupported keyword arguments: %r" % kwargs
+
+        if peers is None:
+            if timeout is None:
+                raise ValueError(
+                    "Request to all known peers requires timeout")
+            peers = self.peers.keys()
+        requestId = REQUEST_ID.pack(self._ids.next())
+        gather = self._gathers[requestId] = _Gather(
+            peers, ZmqGatherPolicy.needed(need, len(peers)),
+            lambda peer: None)
+        gather.deferred.addBoth(self._forget, requestId)
+
+        envelope = [requestId, ''] + list(messageParts)
+        for peer in peers:
+            self.send([peer] + envelope)
+        gather.start(self.factory.reactor, timeout)
+        return gather.deferred
+
+    def gotMessage(self, sender, message):
+        if len(message) < 2 or message[1] != '':
+            return
+        gather = self._gathers.get(message[0])
+        if gather is not None:
+            gather.gotResult(message[2:], sender)
+
+    def _forget(self, result, requestId):
+        del self._gathers[requestId]
+        return result
@@ -0,0 +1,234 @@
+"""
+Publishing sharded by topic over several PUB sockets.
+"""
+import zlib
+
+from zmq.core import constants
+
+from txzmq.pubsub import ZmqPubConnection, ZmqSubConnection
+
+
+class ZmqTopicSharding(object):
+    """
+    Mapping of tags to shards.
+
+    Shard is chosen by hash of the shard key: part of the tag up to the
+    first separator (whole tag if there's no separator), so that all tags
+    starting with C{"key."} belong to the same shard. Subscription prefix
+    containing separator is served by single shard, shorter prefixes may
+    match tags of any shard.
+
+    @ivar shards: number of shards
+    @type shards: C{int}
+    @ivar separator: separator of the shard key
+    @type separator: C{str}
+    """
+
+    def __init__(self, shards, separator='.'):
+        """
+        Constructor.
+
+        @param shards: number of shards
+        @type shards: C{int}
+        @param separator: separator of the shard key
+        @type separator: C{str}
+        """
+        assert shards > 0, "At least one shard is required"
+        self.shards = shards
+        self.separator = separator
+
+    def __repr__(self):
+        return "%s(%d, %r)" % (
+            self.__class__.__name__, self.shards, self.separator)
+
+    def shardOf(self, tag):
+        """
+        Shard the tag belongs to.
+
+        @param tag: message tag
+        @type tag: C{str}
+        @return: index of the shard
+        @rtype: C{int}
+        """
+        key = tag.split(self.separator, 1)[0]
+        return (zlib.crc32(key) & 0xffffffff) % self.shards
+
+    def shardsOf(self, prefix):
+        """
+        Shards which may have tags matching the prefix.
+
+        @param prefix: subscription prefix
+        @type prefix: C{str}
+        @return: indices of the shards
+        @rtype: C{list} of C{int}
+        """
+        if self.separator in prefix:
+            return [self.shardOf(prefix)]
+        return range(self.shards)
+
+
+class ZmqShardedPublisher(object):
+    """
+    Publisher spreading tags over several PUB connections, one per shard.
+
+    Every connection is bound to its own endpoint and assigned to IO thread
+    of the factory in round-robin manner, so that publishing scales
+    with number of IO threads. Subscribers should use
+    L{ZmqShardedSubscriber} with the same endpoints (in the same order)
+    and separator.
+
+    @cvar connectionClass: class of shard connections
+
+    @ivar factory: ZeroMQ Twisted factory reference
+    @type factory: L{ZmqFactory}
+    @ivar sharding: mapping of tags to shards
+    @type sharding: L{ZmqTopicSharding}
+    @ivar connections: shard connections
+    @type connections: C{list} of L{ZmqPubConnection}
+    @ivar published: number of messages published via each shard
+    @type published: C{list} of C{int}
+    """
+
+    connectionClass = ZmqPubConnection
+
+    def __init__(self, factory, endpoints, separator='.'):
+        """
+        Constructor.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        @param endpoints: endpoints to bind shards to, one per shard
+        @type endpoints: C{list} of L{ZmqEndpoint}
+        @param separator: separator of the shard key
+        @type separator: C{str}
+        """
+        self.factory = factory
+        self.sharding = ZmqTopicSharding(len(endpoints), separator)
+        self.connections = []
+        self.published = [0] * len(endpoints)
+
+        for i, endpoint in enumerate(endpoints):
+            connection = self.connectionClass(factory)
+            connection.socket.setsockopt(
+                constants.AFFINITY, 1 << (i % factory.ioThreads))
+            connection.addEndpoints([endpoint])
+            self.connections.append(connection)
+
+    def __repr__(self):
+        return "%s(%r, %d)" % (
+            self.__class__.__name__, self.factory, len(self.connections))
+
+    def publish(self, message, tag=''):
+        """
+        Broadcast L{message} with specified L{tag} via shard owning the tag.
+
+        @param message: message data
+        @type message: C{str}
+        @param tag: message tag
+        @type tag: C{str}
+        """
+        i = self.sharding.shardOf(tag)
+        self.published[i] += 1
+        self.connections[i].publish(message, tag)
+
+    def shutdown(self):
+        """
+        Shutdown all connections.
+        """
+        for connection in self.connections:
+            connection.shutdown()
+        self.connections = []
+        self.factory = None
+
+
+class ZmqShardedSubConnection(ZmqSubConnection):
+    """
+    Subscribing connection of L{ZmqShardedSubscriber}.
+    """
+
+    subscriber = None
+
+    def gotMessage(self, message, tag):
+        self.subscriber.gotMessage(message, tag)
+
+
+class ZmqShardedSubscriber(object):
+    """
+    Subscriber of L{ZmqShardedPublisher}, connected only to shards which
+    may publish tags it's subscribed to.
+
+    Shards are connected on subscription; unsubscribing doesn't
+    disconnect them.
+
+    @cvar connectionClass: class of subscribing connection
+
+    @ivar sharding: mapping of tags to shards
+    @type sharding: L{ZmqTopicSharding}
+    @ivar endpoints: endpoints of the shards
+    @type endpoints: C{list} of L{ZmqEndpoint}
+    @ivar connection: subscribing connection
+    @type connection: L{ZmqShardedSubConnection}
+    @ivar connected: indices of connected shards
+    @type connected: C{set}
+    """
+
+    connectionClass = ZmqShardedSubConnection
+
+    def __init__(self, factory, endpoints, separator='.'):
+        """
+        Constructor.
+
+        @param factory: ZeroMQ Twisted factory
+        @type factory: L{ZmqFactory}
+        @param endpoints: endpoints of the shards, in order of the publisher
+        @type endpoints: C{list} of L{ZmqEndpoint}
+        @param separator: separator of the shard key
+        @type separator: C{str}
+        """
+        self.sharding = ZmqTopicSharding(len(endpoints), separator)
+        self.endpoints = list(endpoints)
+        self.connected = set()
+        self.connection = self.connectionClass(factory)
+        self.connection.subscriber = self
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.endpoints)
+
+    def subscribe(self, prefix):
+        """
+        Subscribe to messages with tags starting with the prefix,
+        connecting to shards which may publish them.
+
+        @param prefix: tag prefix
+        @type prefix: C{str}
+        """
+        shards = [i for i in self.sharding.shardsOf(prefix)
+                  if i not in self.connected]
+        if shards:
+            self.connection.addEndpoints([self.endpoints[i] for i in shards])
+            self.connected.update(shards)
+        self.connection.subscribe(prefix)
+
+    def unsubscribe(self, prefix):
+        """
+        Unsubscribe from messages with tags starting with the prefix.
+
+        @param prefix: tag prefix
+        @type prefix: C{str}
+        """
+        self.connection.unsubscribe(prefix)
+
+    def shutdown(self):
+        """
+        Shutdown subscribing connection.
+        """
+        self.connection.shutdown()
+
+    def gotMessage(self, message, tag):
+        """
+        Called on incoming message.
+
+        @param message: message data
+        @param tag: message tag
+        """
+        raise NotImplementedError(self)
@@ -0,0 +1,112 @@
+"""
+Deterministic in-memory transport for ZeroMQ connections, driven
+by virtual time.
+
+Simulated factory could be used in place of L{ZmqFactory}: connections
+created with it get in-memory sockets instead of ZeroMQ ones, and all the
+scheduling happens on L{ZmqSimulatedReactor} (a L{task.Clock}), so load,
+backpressure and timeouts could be tested quickly and reproducibly.
+"""
+from twisted.internet import task
+from twisted.python import log
+
+from txzmq.factory import ZmqFactory
+from txzmq.memory import ZmqMemoryContext
+
+
+class ZmqSimulatedReactor(task.Clock):
+    """
+    Virtual time reactor, running readers of simulated sockets.
+
+    Simulated sockets wake up their readers (connections) when they become
+    readable or writable, C{doRead} of the reader is called on the next
+    iteration (at the same virtual time).
+    """
+
+    def __init__(self):
+        task.Clock.__init__(self)
+        self._readers = {}
+        self._woken = set()
+
+    def addReader(self, reader):
+        self._readers[reader.fileno()] = reader
+
+    def removeReader(self, reader):
+        self._readers.pop(reader.fileno(), None)
+
+    def getReaders(self):
+        return self._readers.values()
+
+    def wakeUp(self, fd):
+        """
+        Schedule C{doRead} of the reader of file descriptor.
+
+        @param fd: file descriptor of simulated socket
+        @type fd: C{int}
+        """
+        if fd not in self._woken:
+            self._woken.add(fd)
+            self.callLater(0, self._doRead, fd)
+
+    def run(self, until=None):
+        """
+        Run scheduled calls in order of their time, advancing the clock.
+
+        @param until: stop at this time (time is advanced up to it),
+            C{None} to run while there are scheduled calls
+        @type until: C{float}
+        """
+        while self.calls:
+            when = self.calls[0].getTime()
+            if until is not None and when > until:
+                break
+            self.advance(max(0, when - self.seconds()))
+        if until is not None and self.seconds() < until:
+            self.advance(until - self.seconds())
+
+    def _doRead(self, fd):
+        self._woken.discard(fd)
+        reader = self._readers.get(fd)
+        if reader is not None:
+            log.callWithLogger(reader, reader.doRead)
+
+
+class ZmqSimulatedFactory(ZmqFactory):
+    """
+    Factory creating connections over simulated in-memory transport.
+
+    Every factory has its own virtual time reactor and simulated network.
+
+    @ivar reactor: virtual time reactor
+    @type reactor: L{ZmqSimulatedReactor}
+    @ivar context: simulated network
+    @type context: L{ZmqMemoryContext}
+    """
+
+    def __init__(self, latency=0, dropRate=0, seed=0, socketOptions=None):
+        """
+        Constructor.
+
+        @param latency: message delivery latency, seconds, or callable
+            returning latency for every message
+        @type latency: C{float}
+        @param dropRate: probability of message being lost
+        @type dropRate: C{float}
+        @param seed: seed of random number generator of drop model
+        @type seed: C{int}
+        @param socketOptions: socket options set on sockets of all
+            connections
+        @type socketOptions: C{dict}
+        """
+        self.reactor = ZmqSimulatedReactor()
+        self._network = (latency, dropRate, seed)
+        ZmqFactory.__init__(self, socketOptions)
+
+    def __repr__(self):
+        return "ZmqSimulatedFactory()"
+
+    def _createContext(self):
+        return ZmqMemoryContext(self.reactor, *self._network)
+
+    def registerForShutdown(self):
+        raise NotImplementedError("Simulated factory isn't bound to reactor")
@@ -0,0 +1,329 @@
+"""
+Append-only on-disk message spool, used to keep outgoing messages
+when they don't fit into memory.
+"""
+import mmap
+import os
+import struct
+from collections import deque
+
+
+class ZmqSpoolSegment(object):
+    """
+    Single memory-mapped spool segment file.
+
+    Segment starts with header (magic, acknowledged offset and write offset)
+    followed by records. Each record is a multipart message: number of parts
+    followed by length-prefixed parts.
+
+    @ivar path: path to segment file
+    @type path: C{str}
+    @ivar size: size of the file
+    @type size: C{int}
+    @ivar ackOffset: offset of the first record which isn't acknowledged
+    @type ackOffset: C{int}
+    @ivar writeOffset: offset where next record would be written
+    @type writeOffset: C{int}
+    """
+
+    MAGIC = 'TXZS'
+    HEADER = struct.Struct('!4sII')
+    COUNT = struct.Struct('!I')
+
+    def __init__(self, path, size=None):
+        """
+        Open existing segment or create new one.
+
+        @param path: path to segment file
+        @type path: C{str}
+        @param size: size of the new segment, C{None} to open existing
+        @type size: C{int}
+        """
+        self.path = path
+
+        if size is None:
+            fd = os.open(path, os.O_RDWR)
+            size = os.fstat(fd).st_size
+        else:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+            os.ftruncate(fd, size)
+        try:
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+
+        magic, self.ackOffset, self.writeOffset = \
+            self.HEADER.unpack_from(self._map)
+        if magic != self.MAGIC:
+            if magic != '\0' * 4:
+                raise ValueError("%s is not a spool segment" % path)
+            self.ackOffset = self.writeOffset = self.HEADER.size
+            self._writeHeader()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.path)
+
+    @classmethod
+    def recordSize(cls, parts):
+        """
+        Size of the record holding the message.
+
+        @param parts: message parts
+        @type parts: C{list} of C{str}
+        @rtype: C{int}
+        """
+        return cls.COUNT.size * (len(parts) + 1) + sum(map(len, parts))
+
+    def fits(self, parts):
+        """
+        Would message fit into the segment?
+
+        @param parts: message parts
+        @type parts: C{list} of C{str}
+        @rtype: C{bool}
+        """
+        return self.writeOffset + self.recordSize(parts) <= self.size
+
+    def append(self, parts):
+        """
+        Append message to the segment.
+
+        @param parts: message parts
+        @type parts: C{list} of C{str}
+        """
+        offset = self.writeOffset
+        self.COUNT.pack_into(self._map, offset, len(parts))
+        offset += self.COUNT.size
+        for part in parts:
+            self.COUNT.pack_into(self._map, offset, len(part))
+            offset += self.COUNT.size
+            self._map[offset:offset + len(part)] = part
+            offset += len(part)
+
+        # header goes last, so that crash never exposes partial record
+        self.writeOffset = offset
+        self._writeHeader()
+
+    def read(self, offset):
+        """
+        Read message from the segment.
+
+        @param offset: offset of the record
+        @type offset: C{int}
+        @return: message parts and offset of the next record
+        @rtype: C{tuple}
+        """
+        count, = self.COUNT.unpack_from(self._map, offset)
+        offset += self.COUNT.size
+        parts = []
+        for _ in xrange(count):
+            length, = self.COUNT.unpack_from(self._map, offset)
+            offset += self.COUNT.size
+            parts.append(self._map[offset:offset + length])
+            offset += length
+        return parts, offset
+
+    def ack(self, offset):
+        """
+        Acknowledge all the records before the offset.
+
+        @param offset: offset of the first unacknowledged record
+        @type offset: C{int}
+        """
+        self.ackOffset = offset
+        self._writeHeader()
+
+    def rewind(self):
+        """
+        Reuse the segment from the beginning, it should be fully
+        acknowledged.
+        """
+        assert self.ackOffset == self.writeOffset
+        self.ackOffset = self.writeOffset = self.HEADER.size
+        self._writeHeader()
+
+    def flush(self):
+        """
+        Flush segment contents to disk.
+        """
+        self._map.flush()
+
+    def close(self):
+        """
+        Close segment file.
+        """
+        self._map.close()
+        self._map = None
+
+    def remove(self):
+        """
+        Close and remove segment file.
+        """
+        self.close()
+        os.unlink(self.path)
+
+    def _writeHeader(self):
+        self.HEADER.pack_into(
+            self._map, 0, self.MAGIC, self.ackOffset, self.writeOffset)
+
+
+class ZmqSpool(object):
+    """
+    FIFO queue of messages stored in the sequence of memory-mapped segment
+    files in the directory.
+
+    Messages are read in order they were appended, but they're kept on
+    disk until acknowledged; unacknowledged messages are read again after
+    reopening the spool. Fully acknowledged segments are removed.
+
+    @ivar path: spool directory
+    @type path: C{str}
+    @ivar segmentSize: size of newly created segments
+    @type segmentSize: C{int}
+    @ivar pending: number of messages which haven't been read yet
+    @type pending: C{int}
+    """
+
+    SEGMENT_NAME = 'segment-%016d.spool'
+
+    def __init__(self, path, segmentSize):
+        """
+        Open spool, creating directory if necessary.
+
+        @param path: spool directory
+        @type path: C{str}
+        @param segmentSize: size of newly created segments
+        @type segmentSize: C{int}
+        """
+        self.path = path
+        self.segmentSize = segmentSize
+        self.pending = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._segments = deque()
+        self._nextSegment = 0
+        for name in sorted(os.listdir(path)):
+            if not (name.startswith('segment-') and name.endswith('.spool')):
+                continue
+            segment = ZmqSpoolSegment(os.path.join(path, name))
+            self._segments.append(segment)
+            self._nextSegment = int(name[8:-6]) + 1
+
+            offset = segment.ackOffset
+            while offset < segment.writeOffset:
+                _, offset = segment.read(offset)
+                self.pending += 1
+
+        # read cursor: index of segment and offset within it
+        self._readSegment = 0
+        if self._segments:
+            self._readOffset = self._segments[0].ackOffset
+            self._compact()
+        else:
+            self._readOffset = None
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.path)
+
+    def __len__(self):
+        return self.pending
+
+    def append(self, parts):
+        """
+        Append message to the spool.
+
+        @param parts: message parts
+        @type parts: C{list} of C{str}
+        """
+        if not self._segments or not self._segments[-1].fits(parts):
+            self._addSegment(ZmqSpoolSegment.recordSize(parts))
+        self._segments[-1].append(parts)
+        self.pending += 1
+
+    def read(self):
+        """
+        Read next message from the spool.
+
+        Message should be acknowledged later with the returned marker.
+
+        @return: message parts and acknowledgement marker
+        @rtype: C{tuple}
+        """
+        assert self.pending > 0, "Spool is empty"
+
+        segment = self._segments[self._readSegment]
+        while self._readOffset == segment.writeOffset:
+            self._readSegment += 1
+            segment = self._segments[self._readSegment]
+            self._readOffset = segment.ackOffset
+
+        parts, self._readOffset = segment.read(self._readOffset)
+        self.pending -= 1
+        return parts, (segment, self._readOffset)
+
+    def ack(self, marker):
+        """
+        Acknowledge message and all messages read before it.
+
+        @param marker: acknowledgement marker returned from C{read}
+        """
+        segment, offset = marker
+        for previous in self._segments:
+            if previous is segment:
+                break
+            previous.ack(previous.writeOffset)
+        segment.ack(offset)
+        self._compact()
+
+    def flush(self):
+        """
+        Flush all segments to disk.
+        """
+        for segment in self._segments:
+            segment.flush()
+
+    def close(self):
+        """
+        Close all segments.
+        """
+        for segment in self._segments:
+            segment.close()
+        self._segments.clear()
+
+    def _compact(self):
+        """
+        Remove fully acknowledged segments, rewind the last one if
+        everything has been acknowledged.
+        """
+        segments = self._segments
+        while len(segments) > 1 and \
+                segments[0].ackOffset == segments[0].writeOffset:
+            if self._readSegment == 0:
+                # read cursor is at the end of the segment
+                self._readSegment, self._readOffset = \
+                    1, segments[1].ackOffset
+            segments.popleft().remove()
+            self._readSegment -= 1
+
+        if len(segments) == 1 and self.pending == 0 and \
+                segments[0].ackOffset == segments[0].writeOffset:
+            segments[0].rewind()
+            self._readSegment, self._readOffset = 0, segments[0].ackOffset
+
+    def _addSegment(self, minSize):
+        """
+        Create new segment file.
+
+        @param minSize: minimal size of the record which should fit
+        @type minSize: C{int}
+        """
+        segment = ZmqSpoolSegment(
+            os.path.join(self.path, self.SEGMENT_NAME % self._nextSegment),
+            max(self.segmentSize, minSize + ZmqSpoolSegment.HEADER.size))
+        self._nextSegment += 1
+        self._segments.append(segment)
+        if self._readOffset is None:
+            self._readSegment, self._readOffset = 0, segment.ackOffset
@@ -0,0 +1,495 @@
+"""
+Streaming large payloads in chunks over DEALER/ROUTER with credit-based
+flow control.
+"""
+import mmap
+import os
+import struct
+from itertools import count
+
+from twisted.internet import defer
+from twisted.python import log
+
+from txzmq.router_dealer import ZmqDealerConnection, ZmqRouterConnection
+
+
+# stream ids, sizes and credits in stream protocol
+NUMBER = struct.Struct('!Q')
+
+# stream protocol commands, sender to receiver
+STREAM_OPEN = 'OPEN'
+STREAM_CHUNK = 'CHUNK'
+STREAM_END = 'END'
+# receiver to sender
+STREAM_CREDIT = 'CREDIT'
+STREAM_DONE = 'DONE'
+# both directions
+STREAM_ABORT = 'ABORT'
+
+
+class ZmqStreamAbortedError(Exception):
+    """
+    Stream has been aborted by the other side or due to local failure.
+    """
+
+
+class ZmqMappedFileConsumer(object):
+    """
+    Stream consumer writing payload of known size into memory-mapped file.
+
+    @ivar path: path to the file
+    @type path: C{str}
+    @ivar size: expected size of the payload
+    @type size: C{int}
+    @ivar offset: number of bytes written so far
+    @type offset: C{int}
+    """
+
+    def __init__(self, path, size):
+        """
+        Create (or truncate) the file and map it into memory.
+
+        @param path: path to the file
+        @type path: C{str}
+        @param size: size of the payload
+        @type size: C{int}
+        """
+        self.path = path
+        self.size = size
+        self.offset = 0
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size) if size else None
+        finally:
+            os.close(fd)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.path)
+
+    def write(self, data):
+        """
+        Write next chunk of the payload.
+
+        @param data: chunk data
+        @type data: C{str}
+        @raise ValueError: if payload is larger than expected
+        """
+        end = self.offset + len(data)
+        if end > self.size:
+            raise ValueError("%s: payload exceeds %d bytes" % (
+                self.path, self.size))
+        self._map[self.offset:end] = data
+        self.offset = end
+
+    def close(self):
+        """
+        Flush written data to the file and unmap it.
+        """
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+
+
+class _OutgoingStream(object):
+    """
+    State of single stream sent via L{ZmqStreamSenderConnection}.
+
+    @ivar id: stream id (packed)
+    @type id: C{str}
+    @ivar source: object with C{read(size)} method
+    @ivar deferred: deferred returned to the caller
+    @type deferred: L{defer.Deferred}
+    @ivar credit: number of chunks which could be sent now
+    @type credit: C{int}
+    @ivar sent: number of bytes sent
+    @type sent: C{int}
+    """
+
+    def __init__(self, id, source, closeSource):
+        self.id = id
+        self.source = source
+        self.closeSource = closeSource
+        self.deferred = defer.Deferred()
+        self.credit = 0
+        self.sent = 0
+        self.reading = False
+        self.pumping = False
+        self.eof = False
+
+
+class _IncomingStream(object):
+    """
+    State of single stream received by L{ZmqStreamReceiverConnection}.
+
+    @ivar sender: identity of the sender
+    @type sender: C{str}
+    @ivar id: stream id (packed)
+    @type id: C{str}
+    @ivar consumer: object with C{write(data)} and C{close()} methods
+    @ivar size: size of the payload announced by the sender, C{None} if
+        unknown
+    @type size: C{int}
+    @ivar received: number of bytes written to the consumer
+    @type received: C{int}
+    @ivar pending: chunks waiting for the consumer
+    @type pending: C{list} of C{str}
+    """
+
+    def __init__(self, sender, id, consumer, size):
+        self.sender = sender
+        self.id = id
+        self.consumer = consumer
+        self.size = size
+        self.received = 0
+        self.pending = []
+        self.writing = False
+        self.consuming = False
+        self.ended = False
+
+
+class ZmqStreamSenderConnection(ZmqDealerConnection):
+    """
+    Sending streams to L{ZmqStreamReceiverConnection}.
+
+    Payload is read from the source in chunks of C{chunkSize} bytes and
+    every chunk is sent only when receiver has granted credit for it, so
+    that no more than receiver's window of chunks is in memory or on the
+    wire at any time, however large the payload is.
+
+    Sender has a single endpoint: DEALER would spread chunks of a stream
+    over all connected receivers. For the same reason only one receiver
+    should connect to the bound sender.
+
+    @cvar chunkSize: size of the chunk, bytes
+    @type chunkSize: C{int}
+
+    @ivar streams: streams in progress by (packed) stream id
+    @type streams: C{dict}
+    """
+    __slots__ = ('streams', '_ids')
+
+    chunkSize = 64 * 1024
+
+    def __init__(self, *args, **kwargs):
+        self.streams = {}
+        self._ids = count()
+
+        ZmqDealerConnection.__init__(self, *args, **kwargs)
+
+    def addEndpoints(self, endpoints):
+        """
+        Add the endpoint, see L{ZmqConnection.addEndpoints}.
+
+        @raise ValueError: if connection would have more than one
+            endpoint
+        """
+        self._checkEndpoints(self.endpoints + list(endpoints))
+        ZmqDealerConnection.addEndpoints(self, endpoints)
+
+    def setEndpoints(self, endpoints):
+        """
+        Replace the endpoint, see L{ZmqConnection.setEndpoints}.
+
+        @raise ValueError: if more than one endpoint is given
+        """
+        self._checkEndpoints(endpoints)
+        ZmqDealerConnection.setEndpoints(self, endpoints)
+
+    def _checkEndpoints(self, endpoints):
+        if len(endpoints) > 1:
+            raise ValueError(
+                "Stream sender supports single endpoint, got %r" % (
+                    endpoints,))
+
+    def shutdown(self):
+        """
+        Shutdown connection and socket, failing streams in progress.
+        """
+        streams, self.streams = self.streams, {}
+        ZmqDealerConnection.shutdown(self)
+        for stream in streams.itervalues():
+            self._finish(stream, ZmqStreamAbortedError("Connection shut down"))
+
+    def sendStream(self, source, size=None, metadata=''):
+        """
+        Send stream to the receiver.
+
+        Source is any object with C{read(size)} method (like file) returning
+        next chunk of the payload or Deferred firing with it; empty string
+        marks end of the payload.
+
+        @param source: source of the payload
+        @param size: size of the payload if known
+        @type size: C{int}
+        @param metadata: application-specific description of the stream
+        @type metadata: C{str}
+        @return: Deferred firing with number of bytes sent when receiver
+            has consumed whole stream, failing with L{ZmqStreamAbortedError}
+            if stream is aborted
+        """
+        return self._open(source, size, metadata, False)
+
+    def sendFile(self, path, metadata=''):
+        """
+        Send contents of the file as a stream.
+
+        @param path: path to the file
+        @type path: C{str}
+        @param metadata: application-specific description of the stream
+        @type metadata: C{str}
+        @return: Deferred, see L{sendStream}
+        """
+        source = open(path, 'rb')
+        size = os.fstat(source.fileno()).st_size
+        return self._open(source, size, metadata, True)
+
+    def gotMessage(self, message):
+        stream = self.streams.get(message[1]) if len(message) > 1 else None
+        if stream is None:
+            return
+
+        if message[0] == STREAM_CREDIT:
+            stream.credit += NUMBER.unpack(message[2])[0]
+            self._pump(stream)
+        elif message[0] == STREAM_DONE:
+            del self.streams[stream.id]
+            self._finish(stream, stream.sent)
+        elif message[0] == STREAM_ABORT:
+            del self.streams[stream.id]
+            self._finish(stream, ZmqStreamAbortedError(message[2]))
+
+    def _open(self, source, size, metadata, closeSource):
+        stream = _OutgoingStream(
+            NUMBER.pack(self._ids.next()), source, closeSource)
+        self.streams[stream.id] = stream
+        self.sendMultipart([
+            STREAM_OPEN, stream.id,
+            NUMBER.pack(size) if size is not None else '', metadata])
+        return stream.deferred
+
+    def _finish(self, stream, result):
+        if stream.closeSource:
+            stream.source.close()
+        if isinstance(result, Exception):
+            stream.deferred.errback(result)
+        else:
+            stream.deferred.callback(result)
+
+    def _pump(self, stream):
+        """
+        Read and send chunks while there's credit for them.
+        """
+        stream.pumping = True
+        try:
+            while stream.credit > 0 and not stream.reading and \
+                    not stream.eof and stream.id in self.streams:
+                stream.reading = True
+                d = defer.maybeDeferred(stream.source.read, self.chunkSize)
+                d.addCallbacks(self._gotChunk, self._readFailed,
+                               callbackArgs=(stream,), errbackArgs=(stream,))
+        finally:
+            stream.pumping = False
+
+    def _gotChunk(self, data, stream):
+        stream.reading = False
+        if stream.id not in self.streams or self.factory is None:
+            return
+
+        if not data:
+            stream.eof = True
+            self.sendMultipart([STREAM_END, stream.id])
+            return
+
+        stream.credit -= 1
+        stream.sent += len(data)
+        self.sendMultipart([STREAM_CHUNK, stream.id, data])
+        if not stream.pumping:
+            # chunk has been read asynchronously
+            self._pump(stream)
+
+    def _readFailed(self, failure, stream):
+        stream.reading = False
+        if stream.id not in self.streams:
+            return
+
+        log.err(failure, "Failed to read stream %r" % (stream.source,))
+        del self.streams[stream.id]
+        if self.factory is not None:
+            self.sendMultipart([STREAM_ABORT, stream.id, "Read failed"])
+        self._finish(stream, ZmqStreamAbortedError(
+            failure.getErrorMessage()))
+
+
+class ZmqStreamReceiverConnection(ZmqRouterConnection):
+    """
+    Receiving streams from L{ZmqStreamSenderConnection}.
+
+    Every new stream is passed to C{streamReceived}, which returns consumer
+    (object with C{write(data)} and C{close()} methods, like file or
+    L{ZmqMappedFileConsumer}) for chunks of the payload. Up to C{window}
+    chunks are granted to the sender at once, more credit is granted as
+    consumer writes chunks; if C{write} returns Deferred, next chunk is
+    written after it fires, so slow consumer slows down the sender.
+
+    @cvar window: number of chunks sender could send ahead
+    @type window: C{int}
+
+    @ivar streams: streams in progress by sender identity and stream id
+    @type streams: C{dict}
+    """
+    __slots__ = ('streams',)
+
+    window = 16
+
+    def __init__(self, *args, **kwargs):
+        self.streams = {}
+
+        ZmqRouterConnection.__init__(self, *args, **kwargs)
+
+    def shutdown(self):
+        """
+        Shutdown connection and socket, aborting streams in progress.
+        """
+        streams, self.streams = self.streams, {}
+        ZmqRouterConnection.shutdown(self)
+        for stream in streams.itervalues():
+            self.streamAborted(stream.sender, stream.consumer,
+                               "Connection shut down")
+
+    def streamReceived(self, sender, size, metadata):
+        """
+        Called when sender opens new stream.
+
+        @param sender: identity of the sender
+        @type sender: C{str}
+        @param size: size of the payload, C{None} if unknown
+        @type size: C{int}
+        @param metadata: description of the stream given by the sender
+        @type metadata: C{str}
+        @return: consumer for the payload or C{None} to reject the stream
+        """
+        raise NotImplementedError(self)
+
+    def streamCompleted(self, sender, consumer):
+        """
+        Called when whole payload has been written to the consumer
+        and consumer has been closed.
+
+        @param sender: identity of the sender
+        @type sender: C{str}
+        @param consumer: consumer of the stream
+        """
+
+    def streamAborted(self, sender, consumer, reason):
+        """
+        Called when stream is aborted. Closes the consumer by default.
+
+        @param sender: identity of the sender
+        @type sender: C{str}
+        @param consumer: consumer of the stream
+        @param reason: description of the failure
+        @type reason: C{str}
+        """
+        consumer.close()
+
+    def peerExpired(self, peer):
+        for key, stream in self.streams.items():
+            if key[0] == peer.identity:
+                del self.streams[key]
+                self.streamAborted(stream.sender, stream.consumer,
+                                   "Sender expired")
+
+    def gotMessage(self, sender, message):
+        if len(message) < 2:
+            return
+        command, key = message[0], (sender, message[1])
+
+        if command == STREAM_OPEN:
+            self._gotOpen(sender, message[1], message[2], message[3])
+            return
+
+        stream = self.streams.get(key)
+        if stream is None:
+            return
+        if command == STREAM_CHUNK:
+            stream.pending.append(message[2])
+            self._consume(stream)
+        elif command == STREAM_END:
+            stream.ended = True
+            self._consume(stream)
+        elif command == STREAM_ABORT:
+            del self.streams[key]
+            self.streamAborted(sender, stream.consumer, message[2])
+
+    def _gotOpen(self, sender, id, size, metadata):
+        size = NUMBER.unpack(size)[0] if size else None
+        try:
+            consumer = self.streamReceived(sender, size, metadata)
+        except:
+            log.err(None, "Failed to open stream from %r" % (sender,))
+            consumer = None
+        if consumer is None:
+            self.sendMultipart(sender, [STREAM_ABORT, id, "Rejected"])
+            return
+
+        self.streams[sender, id] = _IncomingStream(
+            sender, id, consumer, size)
+        self.sendMultipart(sender, [STREAM_CREDIT, id,
+                                    NUMBER.pack(self.window)])
+
+    def _consume(self, stream):
+        """
+        Write pending chunks to the consumer, one at a time.
+        """
+        stream.consuming = True
+        try:
+            while stream.pending and not stream.writing:
+                data = stream.pending.pop(0)
+                stream.writing = True
+                d = defer.maybeDeferred(stream.consumer.write, data)
+                d.addCallbacks(self._written, self._writeFailed,
+                               callbackArgs=(stream, len(data)),
+                               errbackArgs=(stream,))
+        finally:
+            stream.consuming = False
+
+        if stream.ended and not stream.pending and not stream.writing and \
+                self.streams.get((stream.sender, stream.id)) is stream:
+            del self.streams[stream.sender, stream.id]
+            if stream.size is not None and stream.received != stream.size:
+                reason = "Expected %d bytes, received %d" % (
+                    stream.size, stream.received)
+                self.sendMultipart(stream.sender,
+                                   [STREAM_ABORT, stream.id, reason])
+                self.streamAborted(stream.sender, stream.consumer, reason)
+                return
+            stream.consumer.close()
+            self.sendMultipart(stream.sender, [STREAM_DONE, stream.id])
+            self.streamCompleted(stream.sender, stream.consumer)
+
+    def _written(self, result, stream, size):
+        stream.writing = False
+        if self.streams.get((stream.sender, stream.id)) is not stream:
+            return
+
+        stream.received += size
+        self.sendMultipart(stream.sender, [STREAM_CREDIT, stream.id,
+                                           NUMBER.pack(1)])
+        if not stream.consuming:
+            # chunk has been written asynchronously
+            self._consume(stream)
+
+    def _writeFailed(self, failure, stream):
+        stream.writing = False
+        if self.streams.get((stream.sender, stream.id)) is not stream:
+            return
+
+        log.err(failure, "Failed to write stream to %r" % (stream.consumer,))
+        del self.streams[stream.sender, stream.id]
+        self.sendMultipart(stream.sender, [STREAM_ABORT, stream.id,
+                                           "Write failed"])
+        self.streamAborted(stream.sender, stream.consumer,
+                           failure.getErrorMessage())
@@ -0,0 +1,134 @@
+"""
+Tests for L{txzmq.cache}.
+"""
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from txzmq.cache import ZmqRequestCache
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.req_rep import ZmqREQConnection, ZmqREPConnection
+from txzmq.req_rep import ZmqRequestTimeoutError
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqCountingREPConnection(ZmqREPConnection):
+    requests = 0
+
+    def gotMessage(self, messageId, *messageParts):
+        self.requests += 1
+        if messageParts[0] != 'ignore':
+            self.factory.reactor.callLater(
+                0.1, self.reply, messageId, 'reply', *messageParts)
+
+
+class ZmqTestREQConnection(ZmqREQConnection):
+    defaultRequestTimeout = 1.0
+
+
+class ZmqRequestCacheTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.cache.ZmqRequestCache}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.001)
+        self.clock = self.factory.reactor
+        self.rep = ZmqCountingREPConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://cache"))
+        self.req = ZmqTestREQConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://cache"))
+        self.cache = ZmqRequestCache(self.req, ttl=10, maxEntries=2)
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_hit(self):
+        d1 = self.cache.sendMsg('a', 'b')
+        self.clock.run()
+        d2 = self.cache.sendMsg('a', 'b')
+
+        self.failUnlessEqual(['reply', 'a', 'b'], self.successResultOf(d1))
+        self.failUnlessEqual(['reply', 'a', 'b'], self.successResultOf(d2))
+        self.failUnlessEqual(1, self.rep.requests)
+        stats = self.cache.stats()
+        self.failUnlessEqual(1, stats['hits'])
+        self.failUnlessEqual(1, stats['misses'])
+        self.failUnlessEqual(7, stats['size'])
+
+    def test_coalesce(self):
+        deferreds = [self.cache.sendMsg('a') for _ in xrange(3)]
+        self.clock.run()
+
+        self.failUnlessEqual(1, self.rep.requests)
+        self.failUnlessEqual(2, self.cache.coalesced)
+        replies = [self.successResultOf(d) for d in deferreds]
+        self.failUnlessEqual([['reply', 'a']] * 3, replies)
+        # every caller gets its own copy
+        self.failIf(replies[0] is replies[1])
+
+    def test_ttl(self):
+        self.cache.sendMsg('a')
+        self.clock.run()
+        self.clock.advance(11)
+        self.cache.sendMsg('a')
+        self.clock.run()
+
+        self.failUnlessEqual(2, self.rep.requests)
+        self.failUnlessEqual(1, self.cache.evictions)
+
+    def test_lru(self):
+        for parts in ('a', 'b', 'a', 'c'):
+            self.cache.sendMsg(parts)
+            self.clock.run()
+
+        self.failUnlessEqual(2, len(self.cache))
+        self.failUnlessEqual(1, self.cache.evictions)
+        self.cache.sendMsg('a')
+        self.failUnlessEqual(2, self.cache.hits)
+        self.cache.sendMsg('b')
+        self.failUnlessEqual(1, len(self.cache._inFlight))
+        self.clock.run()
+
+    def test_maxBytes(self):
+        self.cache.maxBytes = 15
+        self.cache.sendMsg('abcd')
+        self.clock.run()
+        self.cache.sendMsg('efgh')
+        self.clock.run()
+        self.failUnlessEqual([('efgh',)], self.cache._entries.keys())
+        self.failUnlessEqual(9, self.cache.size)
+
+    def test_failure(self):
+        deferreds = [self.cache.sendMsg('ignore') for _ in xrange(2)]
+        self.clock.run()
+
+        for d in deferreds:
+            self.failureResultOf(d, ZmqRequestTimeoutError)
+        self.failUnlessEqual(0, len(self.cache))
+        d = self.cache.sendMsg('ignore')
+        self.failUnlessEqual(2, self.cache.misses)
+        self.clock.run()
+        self.failureResultOf(d, ZmqRequestTimeoutError)
+
+    def test_cancel(self):
+        d1 = self.cache.sendMsg('a')
+        d2 = self.cache.sendMsg('a')
+        d1.cancel()
+        self.failureResultOf(d1, defer.CancelledError)
+        self.failUnlessEqual(1, len(self.req._requests))
+
+        d2.cancel()
+        self.failureResultOf(d2, defer.CancelledError)
+        self.failUnlessEqual(0, len(self.req._requests))
+        self.failUnlessEqual({}, self.cache._inFlight)
+        self.clock.run()
+        self.failUnlessEqual(0, len(self.cache))
+
+    def test_invalidate(self):
+        self.cache.sendMsg('a')
+        self.clock.run()
+        self.cache.invalidate('a')
+        self.failUnlessEqual(0, self.cache.size)
+        self.cache.sendMsg('a')
+        self.failUnlessEqual(2, self.cache.misses)
+        self.clock.run()
@@ -0,0 +1,189 @@
+"""
+Tests for L{txzmq.capture}.
+"""
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from txzmq.capture import ZmqCaptureDirection, ZmqCaptureLog, ZmqCaptureTap
+from txzmq.capture import ZmqReplay
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.pushpull import ZmqPushConnection, ZmqPullConnection
+from txzmq.req_rep import ZmqREQConnection, ZmqREPConnection
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestPullConnection(ZmqPullConnection):
+    def onPull(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+
+class ZmqTestREPConnection(ZmqREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(list(messageParts))
+        self.reply(messageId, *messageParts)
+
+
+class ZmqCaptureLogTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.capture.ZmqCaptureLog}.
+    """
+
+    def test_append(self):
+        path = self.mktemp()
+        log = ZmqCaptureLog(path, 64)
+        log.append(1.5, ZmqCaptureDirection.sent, ['abcd'])
+        log.append(2.5, ZmqCaptureDirection.received, ['ef', 'x' * 1000])
+        log.append(3.5, ZmqCaptureDirection.sent, [])
+        self.failUnlessEqual(2048, log.size)
+        log.close()
+
+        log = ZmqCaptureLog(path)
+        self.failUnlessEqual(
+            [(1.5, 'S', ['abcd']), (2.5, 'R', ['ef', 'x' * 1000]),
+             (3.5, 'S', [])],
+            list(log.records()))
+        self.failUnlessEqual(
+            [1.5, 3.5],
+            [t for t, _, _ in log.records(ZmqCaptureDirection.sent)])
+        log.close()
+
+    def test_invalid(self):
+        path = self.mktemp()
+        with open(path, 'wb') as f:
+            f.write('junk' * 10)
+        self.failUnlessRaises(ValueError, ZmqCaptureLog, path)
+
+
+class ZmqCaptureReplayTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.capture.ZmqCaptureTap} and
+    L{txzmq.capture.ZmqReplay}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.01)
+        self.clock = self.factory.reactor
+        self.r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://capture"))
+        self.s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect,
+                                      "sim://capture"))
+        self.log = ZmqCaptureLog(self.mktemp(), 1024)
+
+    def tearDown(self):
+        self.log.close()
+        self.factory.shutdown()
+
+    def capture(self):
+        taps = [ZmqCaptureTap(c, self.log) for c in (self.s, self.r)]
+        for tap in taps:
+            tap.start()
+        for i in xrange(4):
+            self.s.push(['abcd', str(i)])
+            self.clock.advance(1)
+        self.clock.run()
+        for tap in taps:
+            tap.stop()
+        self.failUnlessIdentical(None, self.s.capture)
+        del self.r.messages
+
+    def test_capture(self):
+        self.capture()
+        records = list(self.log.records())
+        self.failUnlessEqual(8, len(records))
+        self.failUnlessEqual(
+            [(float(i), ['abcd', str(i)]) for i in xrange(4)],
+            [(t, m) for t, d, m in records if d == ZmqCaptureDirection.sent])
+        received = [(t, m) for t, d, m in records
+                    if d == ZmqCaptureDirection.received]
+        self.failUnlessEqual(
+            [['abcd', str(i)] for i in xrange(4)], [m for t, m in received])
+        for i, (t, m) in enumerate(received):
+            self.failUnless(t > i)
+
+    def test_replay_scaled(self):
+        self.capture()
+        start = self.clock.seconds()
+        replay = ZmqReplay(self.s, self.log, speed=2.0)
+        d = replay.start()
+        self.clock.advance(0)
+        self.failUnlessEqual(1, replay.report.messages)
+        self.clock.advance(0.5)
+        self.failUnlessEqual(2, replay.report.messages)
+        self.clock.run()
+
+        report = self.successResultOf(d)
+        self.failUnlessEqual(4, report.messages)
+        self.failUnlessEqual(20, report.bytes)
+        self.failUnlessEqual(1.5, report.duration)
+        self.failUnlessEqual(
+            1.51, round(self.clock.seconds() - start, 6))
+        self.failUnlessEqual(
+            [['abcd', str(i)] for i in xrange(4)], self.r.messages)
+
+    def test_replay_max_speed(self):
+        self.capture()
+        self.patch(ZmqReplay, 'batchSize', 3)
+        replay = ZmqReplay(self.s, self.log, speed=None)
+        d = replay.start()
+        self.clock.run()
+
+        report = self.successResultOf(d)
+        self.failUnlessEqual(4, report.messages)
+        self.failUnlessEqual(0, report.duration)
+        self.failUnlessEqual(4, len(self.r.messages))
+
+    def test_replay_received(self):
+        self.capture()
+        replay = ZmqReplay(self.r, self.log, ZmqCaptureDirection.received)
+        d = replay.start()
+        self.clock.run()
+        self.successResultOf(d)
+        self.failUnlessEqual(
+            [['abcd', str(i)] for i in xrange(4)], self.r.messages)
+
+    def test_replay_latency(self):
+        self.capture()
+
+        def inject(frames):
+            return task.deferLater(self.clock, 0.2, lambda: None)
+
+        def fail(frames):
+            return defer.fail(RuntimeError("fail"))
+
+        d = ZmqReplay(self.s, self.log, inject=inject).start()
+        self.clock.run()
+        report = self.successResultOf(d)
+        self.failUnlessEqual([0.2] * 4, [round(l, 6) for l in
+                                         report.latencies])
+        self.failUnlessEqual(0.2, round(report.latency(50), 6))
+        self.failUnlessEqual(4 / 3.2, report.throughput())
+
+        d = ZmqReplay(self.s, self.log, speed=None, inject=fail).start()
+        self.clock.run()
+        self.failUnlessEqual(4, self.successResultOf(d).errors)
+        self.failUnlessEqual(4, len(self.flushLoggedErrors(RuntimeError)))
+
+    def test_replay_req(self):
+        r = ZmqTestREPConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://req"))
+        s = ZmqREQConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://req"))
+        tap = ZmqCaptureTap(s, self.log)
+        tap.start()
+        s.sendMsg('abcd')
+        self.clock.run()
+        tap.stop()
+        del r.messages
+
+        d = ZmqReplay(s, self.log,
+                      inject=lambda frames: s.sendMsg(*frames[2:])).start()
+        self.clock.run()
+        self.failUnlessEqual(1, self.successResultOf(d).messages)
+        self.failUnlessEqual([['abcd']], r.messages)
@@ -0,0 +1,167 @@
+"""
+Tests for L{txzmq.clone}.
+"""
+from twisted.trial import unittest
+
+from txzmq.clone import ZmqCloneSubscriber, ZmqClonePublisher
+from txzmq.clone import ZmqLastValueCache
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.factory import ZmqFactory
+from txzmq.simulation import ZmqSimulatedFactory
+from txzmq.test import _wait
+
+
+class ZmqLastValueCacheTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.clone.ZmqLastValueCache}.
+    """
+
+    def test_set(self):
+        cache = ZmqLastValueCache()
+        cache.set('a', 1, 'aaa')
+        cache.set('b', 2, 'bb')
+        cache.set('a', 3, 'a')
+        self.failUnlessEqual((3, 'a'), cache.get('a'))
+        self.failUnlessEqual(2, len(cache))
+        self.failUnlessEqual(3, cache.size)
+        self.failUnlessEqual([('b', 2, 'bb'), ('a', 3, 'a')], cache.items())
+
+    def test_prefix(self):
+        cache = ZmqLastValueCache()
+        cache.set('a.1', 1, 'x')
+        cache.set('b.1', 2, 'y')
+        cache.set('a.2', 3, 'z')
+        self.failUnlessEqual([('a.1', 1, 'x'), ('a.2', 3, 'z')],
+                             cache.items('a.'))
+
+    def test_max_entries(self):
+        cache = ZmqLastValueCache(maxEntries=2)
+        cache.set('a', 1, 'x')
+        cache.set('b', 2, 'y')
+        cache.set('a', 3, 'x')
+        cache.set('c', 4, 'z')
+        self.failIf('b' in cache)
+        self.failUnlessEqual(['a', 'c'], [e[0] for e in cache.items()])
+        self.failUnlessEqual(1, cache.evictions)
+
+    def test_max_bytes(self):
+        cache = ZmqLastValueCache(maxBytes=10)
+        cache.set('a', 1, '12345')
+        cache.set('b', 2, '12345')
+        cache.set('c', 3, '1')
+        self.failUnlessEqual(['b', 'c'], [e[0] for e in cache.items()])
+        self.failUnlessEqual(6, cache.size)
+
+
+class ZmqTestCloneSubscriber(ZmqCloneSubscriber):
+    def gotMessage(self, message, tag):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append([tag, message])
+
+    def snapshotReceived(self):
+        self.snapshot = list(getattr(self, 'messages', []))
+
+
+class ZmqCloneTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.clone} publisher and subscriber.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        self.publisher = ZmqClonePublisher(
+            self.factory,
+            ZmqEndpoint(ZmqEndpointType.bind, "inproc://updates"),
+            ZmqEndpoint(ZmqEndpointType.bind, "inproc://snapshot"))
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def subscribe(self, prefix=''):
+        return ZmqTestCloneSubscriber(
+            self.factory,
+            ZmqEndpoint(ZmqEndpointType.connect, "inproc://updates"),
+            ZmqEndpoint(ZmqEndpointType.connect, "inproc://snapshot"),
+            prefix)
+
+    def test_snapshot_and_updates(self):
+        self.publisher.publish('1', 'tag1')
+        self.publisher.publish('2', 'tag2')
+        self.publisher.publish('3', 'tag1')
+        self.publisher.publish('4', 'other')
+
+        s = self.subscribe('tag')
+
+        def update(ignore):
+            self.publisher.publish('5', 'tag2')
+            self.publisher.publish('6', 'other')
+            return _wait(0.05)
+
+        def check(ignore):
+            self.failUnlessEqual([['tag2', '2'], ['tag1', '3']], s.snapshot)
+            self.failUnlessEqual(
+                [['tag2', '2'], ['tag1', '3'], ['tag2', '5']], s.messages)
+            self.failUnlessEqual(5, s.sequence)
+            self.failUnlessEqual(None, s.snapshots)
+
+        return _wait(0.05).addCallback(update).addCallback(check)
+
+    def test_updates_during_snapshot(self):
+        self.publisher.publish('1', 'tag1')
+        s = self.subscribe()
+        # arrives before snapshot is served, but after subscription
+        s._gotUpdate('tag1', 2, '2')
+        self.publisher.publish('2', 'tag1')
+
+        def check(ignore):
+            self.failUnlessEqual([['tag1', '2']], s.messages)
+
+        return _wait(0.05).addCallback(check)
+
+    def test_max_pending(self):
+        s = self.subscribe()
+        s.maxPending = 2
+        s._gotUpdate('tag1', 1, '1')
+        s._gotUpdate('tag1', 2, '2')
+        s._gotUpdate('tag1', 3, '3')
+        self.failUnlessEqual([('tag1', 2, '2'), ('tag1', 3, '3')],
+                             list(s._pending))
+        self.failUnlessEqual(1, s.dropped)
+        s.shutdown()
+
+
+class ZmqCloneRetryTestCase(unittest.TestCase):
+    """
+    Test case for snapshot retries of L{txzmq.clone.ZmqCloneSubscriber}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.01)
+        self.clock = self.factory.reactor
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_snapshot_retry(self):
+        s = ZmqTestCloneSubscriber(
+            self.factory,
+            ZmqEndpoint(ZmqEndpointType.connect, "sim://updates"),
+            ZmqEndpoint(ZmqEndpointType.connect, "sim://snapshot"))
+        self.clock.run(until=s.snapshotTimeout + 1.0)
+        self.failUnlessEqual(2, s.snapshotAttempts)
+        self.failUnlessEqual(None, s.sequence)
+
+        publisher = ZmqClonePublisher(
+            self.factory,
+            ZmqEndpoint(ZmqEndpointType.bind, "sim://updates"),
+            ZmqEndpoint(ZmqEndpointType.bind, "sim://snapshot"))
+        publisher.publish('1', 'tag1')
+        self.clock.run(until=self.clock.seconds() + 1.0)
+
+        self.failUnlessEqual([['tag1', '1']], s.snapshot)
+        self.failUnlessEqual(1, s.sequence)
+        self.failUnlessEqual(2, s.snapshotAttempts)
+        self.failUnlessEqual(None, s.snapshots)
+        self.failUnlessEqual(None, s._timeoutCall)
@@ -2,14 +2,24 @@
 Tests for L{txzmq.connection}.
 """
 from zmq.core import constants
+from zmq.core.version import zmq_version_info
 
 from zope.interface import verify as ziv
 
+from twisted.internet import reactor
 from twisted.internet.interfaces import IFileDescriptor, IReadDescriptor
 from twisted.trial import unittest
 
 from txzmq.connection import ZmqConnection, ZmqEndpoint, ZmqEndpointType
+from txzmq.connection import socketOption
 from txzmq.factory import ZmqFactory
+from txzmq.pipeline import ZmqAckedPullConnection, ZmqAckedPushConnection
+from txzmq.pushpull import ZmqDurablePushConnection
+from txzmq.req_rep import ZmqREQConnection, ZmqREPConnection
+from txzmq.router_dealer import ZmqRouterConnection
+from txzmq.simulation import ZmqSimulatedFactory
+from txzmq.streaming import ZmqStreamReceiverConnection
+from txzmq.streaming import ZmqStreamSenderConnection
 from txzmq.test import _wait
 
 
@@ -126,3 +136,287 @@ class ZmqConnectionTestCase(unittest.TestCase):
                 result, expected, "Messages should have been received")
 
         return _wait(0.01).addCallback(check)
+
+
+class ZmqTestBatchReceiver(ZmqTestReceiver):
+    readBatchSize = 3
+
+
+class ZmqTestAdaptiveSender(ZmqTestSender):
+    adaptiveHighWaterMark = (2, 16)
+
+
+class ZmqSocketOptionsTestCase(unittest.TestCase):
+    """
+    Test case for socket options of L{txzmq.connection.ZmqConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory(socketOptions={'SNDBUF': 65536,
+                                                 'RCVBUF': 65536})
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_socketOption(self):
+        self.failUnlessEqual(constants.SNDBUF, socketOption('SNDBUF'))
+        self.failUnlessEqual(constants.SNDBUF, socketOption(constants.SNDBUF))
+        self.failUnlessRaises(ValueError, socketOption, 'NO_SUCH_OPTION')
+        if zmq_version_info() < (4, 0):
+            self.failUnlessRaises(ValueError, socketOption, 'CONFLATE')
+
+    def test_merge(self):
+        s = ZmqTestSender(self.factory, socketOptions={
+            'SNDBUF': 32768, constants.RECONNECT_IVL: 500})
+        self.failUnlessEqual(32768, s.socket.getsockopt(constants.SNDBUF))
+        self.failUnlessEqual(65536, s.socket.getsockopt(constants.RCVBUF))
+        self.failUnlessEqual(
+            500, s.socket.getsockopt(constants.RECONNECT_IVL))
+
+    def test_unsupported(self):
+        self.failUnlessRaises(ValueError, ZmqTestSender, self.factory,
+                              socketOptions={'NO_SUCH_OPTION': 1})
+        self.failUnlessEqual(set(), self.factory.connections)
+
+    def test_setSocketOptions(self):
+        s = ZmqTestSender(self.factory)
+        s.setSocketOptions({'RCVBUF': 16384})
+        self.failUnlessEqual(16384, s.socket.getsockopt(constants.RCVBUF))
+
+    def test_readBatchSize(self):
+        r = ZmqTestBatchReceiver(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        s = ZmqTestSender(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"))
+
+        for i in xrange(10):
+            s.send(str(i))
+
+        def check(ignore):
+            result = getattr(r, 'messages', [])
+            expected = [[str(i)] for i in xrange(10)]
+            self.failUnlessEqual(
+                result, expected, "Messages should have been received")
+
+        return _wait(0.05).addCallback(check)
+
+    def test_adaptiveHighWaterMark(self):
+        s = ZmqTestAdaptiveSender(self.factory)
+        self.failUnlessEqual(2, s.currentHighWaterMark)
+
+        # no peers: messages stay in the queue
+        s.send('abcd')
+        for _ in xrange(5):
+            s.doRead()
+        self.failUnlessEqual(16, s.currentHighWaterMark)
+
+        s.queue.clear()
+        for _ in xrange(2):
+            s.doRead()
+        self.failUnlessEqual(4, s.currentHighWaterMark)
+
+    def test_adaptiveHighWaterMark_invalid(self):
+        for limits in ((0, 16), (16, 2)):
+            self.patch(ZmqTestAdaptiveSender, 'adaptiveHighWaterMark', limits)
+            self.failUnlessRaises(ValueError, ZmqTestAdaptiveSender,
+                                  self.factory)
+        self.failUnlessEqual(set(), self.factory.connections)
+
+
+class ZmqTestPrioritySender(ZmqTestSender):
+    priorities = 3
+
+
+class ZmqTestWeightedSender(ZmqTestSender):
+    priorities = 2
+    priorityWeights = (1, 2)
+
+
+class ZmqPrioritiesTestCase(unittest.TestCase):
+    """
+    Test case for priorities of outgoing messages.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.r = ZmqTestReceiver(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://test"))
+        self.connect = ZmqEndpoint(ZmqEndpointType.connect, "sim://test")
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_strict(self):
+        # no peers: messages stay queued until sender is connected
+        s = ZmqTestPrioritySender(self.factory)
+        s.send('bulk')
+        s.send(['multi', 'part'])
+        s.send('normal', 1)
+        s.send(['urgent', 'multi'], 0)
+        self.failUnlessIdentical(s.lanes[-1], s.queue)
+        s.addEndpoints([self.connect])
+        self.factory.reactor.run()
+
+        self.failUnlessEqual(
+            [['urgent', 'multi'], ['normal'], ['bulk'], ['multi', 'part']],
+            self.r.messages)
+
+    def test_weighted(self):
+        s = ZmqTestWeightedSender(self.factory)
+        for i in xrange(4):
+            s.send('a%d' % i, 0)
+            s.send(['b%d' % i, 'x'], 1)
+        s.addEndpoints([self.connect])
+        self.factory.reactor.run()
+
+        self.failUnlessEqual(
+            [['a0'], ['b0', 'x'], ['b1', 'x'], ['a1'], ['b2', 'x'],
+             ['b3', 'x'], ['a2'], ['a3']],
+            self.r.messages)
+
+    def test_invalid(self):
+        s = ZmqTestPrioritySender(self.factory)
+        self.failUnlessRaises(ValueError, s.send, 'abcd', 3)
+        self.failUnlessRaises(ValueError, s.send, 'abcd', -1)
+        for weights in ((1, 2, 3), (1, 0), (1, -2), (1, 1.5), (1, '2')):
+            self.patch(ZmqTestWeightedSender, 'priorityWeights', weights)
+            self.failUnlessRaises(ValueError, ZmqTestWeightedSender,
+                                  self.factory)
+
+
+class ZmqTestREQConnection(ZmqREQConnection):
+    drainTimeout = 1.0
+
+
+class ZmqTestDelayedREPConnection(ZmqREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        reactor.callLater(0.05, self.reply, messageId, self.name)
+
+
+class ZmqEndpointsTestCase(unittest.TestCase):
+    """
+    Test case for changing endpoints of L{txzmq.connection.ZmqConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        self.r1 = ZmqTestReceiver(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        self.r2 = ZmqTestReceiver(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#2"))
+        self.e1 = ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1")
+        self.e2 = ZmqEndpoint(ZmqEndpointType.connect, "inproc://#2")
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_removeEndpoints(self):
+        s = ZmqTestSender(self.factory)
+        s.addEndpoints([self.e1, self.e2])
+        s.removeEndpoints([self.e1])
+        self.failUnlessEqual([self.e2], s.endpoints)
+
+        for i in xrange(4):
+            s.send(str(i))
+
+        def check(ignore):
+            self.failIf(hasattr(self.r1, 'messages'))
+            self.failUnlessEqual(
+                [[str(i)] for i in xrange(4)], self.r2.messages)
+
+        return _wait(0.01).addCallback(check)
+
+    def test_removeEndpoints_unknown(self):
+        s = ZmqTestSender(self.factory, self.e1)
+        self.failUnlessRaises(ValueError, s.removeEndpoints, [self.e2])
+
+    def test_setEndpoints_queue(self):
+        s = ZmqTestSender(self.factory)
+        for i in xrange(4):
+            s.send(str(i))
+        s.addEndpoints([self.e1])
+        s.setEndpoints([self.e2])
+
+        def check(ignore):
+            self.failIf(hasattr(self.r1, 'messages'))
+            self.failUnlessEqual(
+                [[str(i)] for i in xrange(4)], self.r2.messages)
+
+        return _wait(0.01).addCallback(check)
+
+    def test_setEndpoints_in_flight(self):
+        for name in ('#3', '#4'):
+            r = ZmqTestDelayedREPConnection(
+                self.factory, ZmqEndpoint(ZmqEndpointType.bind,
+                                          "inproc://" + name))
+            r.name = name
+        s = ZmqTestREQConnection(self.factory, ZmqEndpoint(
+            ZmqEndpointType.connect, "inproc://#3"))
+        d = s.sendMsg('request')
+
+        def move(ignore):
+            s.setEndpoints([ZmqEndpoint(ZmqEndpointType.connect,
+                                        "inproc://#4")])
+            return d
+
+        def check(reply):
+            self.failUnlessEqual(['#3'], reply)
+            return s.sendMsg('request')
+
+        return _wait(0.01).addCallback(move).addCallback(check).addCallback(
+            self.failUnlessEqual, ['#4'])
+
+    def test_setEndpoints_keep_bound(self):
+        r = ZmqTestReceiver(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#3"))
+        if zmq_version_info() >= (3, 2):
+            raise unittest.SkipTest("libzmq supports unbind")
+        r.addEndpoints([ZmqEndpoint(ZmqEndpointType.bind, "inproc://#4")])
+        self.failUnlessRaises(ValueError, r.removeEndpoints,
+                              [ZmqEndpoint(ZmqEndpointType.bind,
+                                           "inproc://#4")])
+        self.failUnlessEqual(2, len(r.endpoints))
+
+
+class ZmqCompactConnectionTestCase(unittest.TestCase):
+    """
+    Test case for lazily allocated state of L{ZmqConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_lazy(self):
+        r = ZmqTestReceiver(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://lazy"))
+        s = ZmqTestSender(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://lazy"))
+        self.failIf(hasattr(s, '__dict__') and s.__dict__)
+        self.failUnlessIdentical(None, s._lanes)
+        self.failIf(s.hasQueued())
+
+        s.send(['abcd', 'efgh'])
+        self.failUnless(s.hasQueued())
+        self.factory.reactor.run()
+
+        self.failIf(s.hasQueued())
+        self.failUnlessEqual([['abcd', 'efgh']], r.messages)
+        self.failUnlessIdentical(None, r._lanes)
+        self.failUnlessIdentical(None, r.recv_parts)
+
+    def test_subclass_slots(self):
+        e = ZmqEndpoint(ZmqEndpointType.bind, "sim://slots")
+        for cls, kwargs in [
+                (ZmqRouterConnection, {}),
+                (ZmqDurablePushConnection, {'spoolPath': self.mktemp()}),
+                (ZmqStreamSenderConnection, {}),
+                (ZmqStreamReceiverConnection, {}),
+                (ZmqAckedPushConnection, {}),
+                (ZmqAckedPullConnection, {})]:
+            c = cls(self.factory, **kwargs)
+            c.addEndpoints([e])
+            self.failIf(c.__dict__, cls)
+            c.shutdown()
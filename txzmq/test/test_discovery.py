@@ -0,0 +1,98 @@
+"""
+Tests for L{txzmq.discovery}.
+"""
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.discovery import ZmqEndpointDiscovery, readEndpointsFile
+from txzmq.pushpull import ZmqPushConnection, ZmqPullConnection
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestPullConnection(ZmqPullConnection):
+    def onPull(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+
+class ZmqEndpointDiscoveryTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.discovery.ZmqEndpointDiscovery}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.clock = self.factory.reactor
+        self.path = self.mktemp()
+        self.r1 = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://1"))
+        self.r2 = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://2"))
+        self.s = ZmqPushConnection(self.factory)
+        self.discovery = ZmqEndpointDiscovery(
+            self.s, lambda: readEndpointsFile(self.path), interval=1.0)
+
+    def tearDown(self):
+        self.discovery.stop()
+        self.factory.shutdown()
+
+    def write(self, content):
+        with open(self.path, 'w') as f:
+            f.write(content)
+
+    def test_readEndpointsFile(self):
+        self.write("# backends\n\ntcp://10.0.0.1:5555\n"
+                   "bind   tcp://*:5556\n")
+        self.failUnlessEqual(
+            [ZmqEndpoint(ZmqEndpointType.connect, "tcp://10.0.0.1:5555"),
+             ZmqEndpoint(ZmqEndpointType.bind, "tcp://*:5556")],
+            readEndpointsFile(self.path))
+
+    def test_readEndpointsFile_invalid(self):
+        for content in ("tcp://10.0.0.1:5555\nconect tcp://10.0.0.1:5556\n",
+                        "tcp://10.0.0.1:5555\nbind tcp://*:5556 extra\n"):
+            self.write(content)
+            e = self.failUnlessRaises(ValueError, readEndpointsFile,
+                                      self.path)
+            self.failUnlessIn("%s:2:" % (self.path,), str(e))
+
+    def test_rebalance(self):
+        self.write("sim://1\n")
+        self.discovery.start()
+        self.s.push('a')
+        self.clock.run(0.5)
+
+        self.write("sim://2\n")
+        self.clock.run(1.5)
+        self.s.push('b')
+        self.clock.run(1.6)
+
+        self.failUnlessEqual(
+            [ZmqEndpoint(ZmqEndpointType.connect, "sim://2")],
+            self.s.endpoints)
+        self.failUnlessEqual(2, self.discovery.updates)
+        self.failUnlessEqual([['a']], self.r1.messages)
+        self.failUnlessEqual([['b']], self.r2.messages)
+
+    def test_unchanged(self):
+        self.write("sim://1\nsim://2\n")
+        self.discovery.start()
+        self.write("sim://2\nsim://1\n")
+        self.clock.run(2.5)
+        self.failUnlessEqual(1, self.discovery.updates)
+
+    def test_empty(self):
+        self.write("sim://1\n")
+        self.discovery.start()
+        self.write("")
+        self.clock.run(1.5)
+        self.failUnlessEqual(1, len(self.s.endpoints))
+
+    def test_failure(self):
+        self.discovery.source = lambda: defer.fail(RuntimeError("down"))
+        self.discovery.start()
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(RuntimeError)))
+        self.failUnlessEqual([], self.s.endpoints)
@@ -1,9 +1,19 @@
 """
 Tests for L{txzmq.factory}.
 """
+from zmq.core import constants
+
 from twisted.trial import unittest
 
+from txzmq.connection import MONITOR_INPROC_PREFIX
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
 from txzmq.factory import ZmqFactory
+from txzmq.pool import ZmqREQPool
+from txzmq.pushpull import ZmqPushConnection, ZmqPullConnection
+from txzmq.req_rep import ZmqREPConnection
+from txzmq.sharding import ZmqShardedPublisher, ZmqShardedSubscriber
+from txzmq.simulation import ZmqSimulatedFactory
+from txzmq.test import _wait
 
 
 class ZmqFactoryTestCase(unittest.TestCase):
@@ -16,3 +26,212 @@ class ZmqFactoryTestCase(unittest.TestCase):
 
     def test_shutdown(self):
         self.factory.shutdown()
+
+    def test_socketOptions(self):
+        self.factory.shutdown()
+        self.failUnlessRaises(ValueError, ZmqFactory,
+                              socketOptions={'NO_SUCH_OPTION': 1})
+        self.factory = ZmqFactory(socketOptions={'SNDBUF': 65536,
+                                                 constants.RCVBUF: 65536})
+        self.failUnlessEqual({'SNDBUF': 65536, constants.RCVBUF: 65536},
+                             self.factory.socketOptions)
+        self.factory.shutdown()
+
+    def test_shared(self):
+        self.factory.shutdown()
+        f1 = ZmqFactory.shared('test')
+        f2 = ZmqFactory.shared('test')
+        self.failUnlessIdentical(f1, f2)
+        self.failIfIdentical(f1, ZmqFactory.shared('other'))
+        ZmqFactory.shared('other').shutdown()
+        ZmqFactory.shared('other').shutdown()
+
+        f1.shutdown()
+        self.failIfIdentical(None, f2.context)
+        f2.shutdown()
+        self.failUnlessIdentical(None, f2.context)
+        self.failIfIdentical(f2, ZmqFactory.shared('test'))
+        ZmqFactory.shared('test').shutdown()
+
+    def test_shutdownAsync(self):
+        s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect,
+                                      "ipc://shutdown-async"))
+        s.push('abcd')
+        d = self.factory.shutdownAsync(timeout=0.05)
+        self.failIfIdentical(None, self.factory.context)
+
+        def check(ignore):
+            self.failUnlessIdentical(None, self.factory.context)
+            self.failUnlessIdentical(None, self.factory.connections)
+            self.failUnlessIdentical(None, s.socket)
+
+        return d.addCallback(check)
+
+
+class ZmqAsyncShutdownTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.factory.ZmqFactory.shutdownAsync} in virtual time.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.clock = self.factory.reactor
+        self.s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect,
+                                      "sim://shutdown"))
+
+    def test_drain(self):
+        self.s.push('abcd')
+        self.failUnless(self.s.hasQueued())
+        d = self.factory.shutdownAsync(timeout=1.0)
+        self.clock.advance(0.5)
+        self.failIf(d.called)
+
+        r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://shutdown"))
+        self.clock.advance(0.1)
+        self.successResultOf(d)
+        self.failUnlessEqual([['abcd']], r.messages)
+        self.failUnlessIdentical(None, self.factory.connections)
+
+    def test_deadline(self):
+        self.s.push('abcd')
+        d = self.factory.shutdownAsync(timeout=1.0)
+        self.clock.advance(0.99)
+        self.failIf(d.called)
+        self.clock.advance(0.01)
+        self.successResultOf(d)
+        self.failUnlessIdentical(None, self.s.factory)
+
+
+class ZmqTestInprocFactory(ZmqFactory):
+    inprocFastPath = True
+
+
+class ZmqTestPullConnection(ZmqPullConnection):
+    def onPull(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+
+class ZmqTestREPConnection(ZmqREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        self.reply(messageId, *messageParts)
+
+
+class ZmqTestShardedSubscriber(ZmqShardedSubscriber):
+    def gotMessage(self, message, tag):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append((tag, message))
+
+
+class ZmqInprocFastPathTestCase(unittest.TestCase):
+    """
+    Test case for in-memory C{inproc://} connections.
+    """
+
+    def setUp(self):
+        self.factory = ZmqTestInprocFactory()
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_send_recv(self):
+        r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"))
+        self.failUnless(r.inproc)
+        self.failUnless(s.inproc)
+
+        payload = "0" * 10000
+        s.push(['abcd', payload])
+
+        def check(ignore):
+            self.failUnlessEqual([['abcd', payload]], r.messages)
+            self.failUnlessIdentical(payload, r.messages[0][1])
+
+        return _wait(0.01).addCallback(check)
+
+    def test_mixed(self):
+        r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind,
+                                      "tcp://127.0.0.1:5560"))
+        s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect,
+                                      "tcp://127.0.0.1:5560"))
+        self.failIf(r.inproc)
+        s.push('abcd')
+
+        def check(ignore):
+            self.failUnlessEqual([['abcd']], r.messages)
+
+        return _wait(0.05).addCallback(check)
+
+    def test_non_inproc_endpoint(self):
+        r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        self.failUnlessRaises(
+            ValueError, r.addEndpoints,
+            [ZmqEndpoint(ZmqEndpointType.bind, "tcp://127.0.0.1:5560")])
+
+    def test_added_endpoint(self):
+        r = ZmqTestPullConnection(self.factory)
+        self.failIf(r.inproc)
+        r.addEndpoints([ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1")])
+        s = ZmqPushConnection(self.factory)
+        s.push('abcd')
+        s.setEndpoints(
+            [ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1")])
+        self.failUnless(r.inproc)
+        self.failUnless(s.inproc)
+
+        def check(ignore):
+            self.failUnlessEqual([['abcd']], r.messages)
+
+        return _wait(0.01).addCallback(check)
+
+    def test_monitor_endpoint(self):
+        r = ZmqTestPullConnection(self.factory, ZmqEndpoint(
+            ZmqEndpointType.bind, MONITOR_INPROC_PREFIX + "0"))
+        self.failIf(r.inproc)
+
+    def test_pool(self):
+        ZmqTestREPConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://svc"))
+        pool = ZmqREQPool(
+            self.factory,
+            [ZmqEndpoint(ZmqEndpointType.connect, "inproc://svc")], size=2)
+        self.failUnless(all(c.inproc for c in pool.connections))
+
+        d = pool.sendMsg('a')
+        d.addCallback(self.failUnlessEqual, ['a'])
+        return d
+
+    def test_sharding(self):
+        addresses = ["inproc://shard%d" % i for i in xrange(2)]
+        publisher = ZmqShardedPublisher(
+            self.factory,
+            [ZmqEndpoint(ZmqEndpointType.bind, a) for a in addresses])
+        subscriber = ZmqTestShardedSubscriber(
+            self.factory,
+            [ZmqEndpoint(ZmqEndpointType.connect, a) for a in addresses])
+        subscriber.subscribe('')
+        self.failUnless(subscriber.connection.inproc)
+
+        def publish(ignore):
+            for i in xrange(4):
+                publisher.publish(str(i), 'topic%d' % i)
+            return _wait(0.01)
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [('topic%d' % i, str(i)) for i in xrange(4)],
+                sorted(subscriber.messages))
+
+        return _wait(0.01).addCallback(publish).addCallback(check)
@@ -0,0 +1,162 @@
+"""
+Tests for L{txzmq.heartbeat}.
+"""
+from twisted.internet import task
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.factory import ZmqFactory
+from txzmq.heartbeat import HEARTBEAT_PING, ZmqHeartbeat
+from txzmq.router_dealer import ZmqDealerConnection, ZmqRouterConnection
+from txzmq.simulation import ZmqSimulatedFactory
+from txzmq.test import _wait
+
+
+class FakeFactory(object):
+    def __init__(self):
+        self.reactor = task.Clock()
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.factory = FakeFactory()
+        self.pings = 0
+        self.events = []
+
+    def _sendHeartbeat(self):
+        self.pings += 1
+
+    def _peerLost(self):
+        self.events.append('lost')
+
+    def _peerRecovered(self):
+        self.events.append('recovered')
+
+
+class ZmqHeartbeatTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.heartbeat.ZmqHeartbeat}.
+    """
+
+    def setUp(self):
+        self.connection = FakeConnection()
+        self.clock = self.connection.factory.reactor
+        self.heartbeat = ZmqHeartbeat(self.connection, 1.0, 3)
+        self.heartbeat.start()
+
+    def tearDown(self):
+        self.heartbeat.stop()
+
+    def test_pings(self):
+        self.failUnlessEqual(1, self.connection.pings)
+        self.clock.pump([1.0] * 4)
+        self.failUnlessEqual(5, self.connection.pings)
+
+    def test_lost(self):
+        self.clock.pump([1.0] * 2)
+        self.failUnless(self.heartbeat.alive)
+        self.clock.advance(1.0)
+        self.failIf(self.heartbeat.alive)
+        self.failUnlessEqual(['lost'], self.connection.events)
+
+        self.clock.pump([1.0] * 5)
+        self.failUnlessEqual(['lost'], self.connection.events)
+
+    def test_touch(self):
+        for _ in xrange(10):
+            self.clock.advance(1.0)
+            self.heartbeat.touch()
+        self.failUnless(self.heartbeat.alive)
+        self.failUnlessEqual([], self.connection.events)
+
+    def test_recovered(self):
+        self.clock.pump([1.0] * 3)
+        self.heartbeat.touch()
+        self.failUnless(self.heartbeat.alive)
+        self.failUnlessEqual(['lost', 'recovered'], self.connection.events)
+
+
+class ZmqTestDealerConnection(ZmqDealerConnection):
+    heartbeatInterval = 0.01
+
+    def peerLost(self):
+        self.lost = True
+
+
+class ZmqTestRouterConnection(ZmqRouterConnection):
+    def gotMessage(self, *args):
+        self.messages = getattr(self, 'messages', []) + [args]
+
+
+class ZmqDealerHeartbeatTestCase(unittest.TestCase):
+    """
+    Test case for heartbeating between DEALER and ROUTER.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_alive(self):
+        ZmqTestRouterConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        d = ZmqTestDealerConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"))
+
+        def check(ignore):
+            self.failUnless(d.heartbeat.alive)
+            self.failIf(hasattr(d, 'lost'))
+
+        return _wait(0.1).addCallback(check)
+
+    def test_lost(self):
+        d = ZmqTestDealerConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect,
+                                      "tcp://127.0.0.1:5557"))
+
+        def check(ignore):
+            self.failIf(d.heartbeat.alive)
+            self.failUnless(d.lost)
+
+        return _wait(0.1).addCallback(check)
+
+    def test_pings_hidden(self):
+        r = ZmqTestRouterConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        d = ZmqTestDealerConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"),
+            identity='dealer')
+        d.sendMsg('abcd')
+
+        def check(ignore):
+            self.failUnlessEqual([('dealer', ['abcd'])], r.messages)
+
+        return _wait(0.05).addCallback(check)
+
+
+class ZmqPingQueueTestCase(unittest.TestCase):
+    """
+    Test case for pings queued while peer is unreachable.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.clock = self.factory.reactor
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_single_ping(self):
+        d = ZmqTestDealerConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://#1"))
+        self.clock.run(until=0.1)
+        self.failUnlessEqual([(0, HEARTBEAT_PING)], list(d.lanes[0]))
+
+        r = ZmqTestRouterConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://#1"))
+        self.clock.run(until=0.105)
+        self.failUnless(d.heartbeat.alive)
+        self.failIf(hasattr(r, 'messages'))
+        self.failUnlessEqual(1, r.peers.values()[0].received)
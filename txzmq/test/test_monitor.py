@@ -0,0 +1,134 @@
+"""
+Tests for L{txzmq.monitor}.
+"""
+from zmq.core import constants
+
+from twisted.trial import unittest
+
+from txzmq.connection import MONITOR_INPROC_PREFIX
+from txzmq.connection import ZmqConnection, ZmqEndpoint, ZmqEndpointType
+from txzmq.factory import ZmqFactory
+from txzmq.monitor import MONITOR_EVENT, ZmqSocketEvent, ZmqSocketMonitor
+from txzmq.pushpull import ZmqPullConnection
+from txzmq.test import _wait
+
+
+class ZmqTestConnection(ZmqConnection):
+    socketType = constants.PUSH
+
+    def socketEvent(self, event, value, address):
+        if not hasattr(self, 'events'):
+            self.events = []
+
+        self.events.append((event, value, address))
+
+
+class ZmqTestMonitoredSocket(object):
+    """
+    Socket pretending to support monitoring, whatever libzmq version is.
+    """
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.monitored = None
+
+    def monitor(self, address, events):
+        self.monitored = address
+
+    def disable_monitor(self):
+        self.monitored = None
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+
+class ZmqTestPairConnection(ZmqConnection):
+    socketType = constants.PAIR
+
+
+class ZmqSocketMonitorTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.monitor.ZmqSocketMonitor}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        self.connection = ZmqTestConnection(self.factory)
+        self.monitor = ZmqSocketMonitor(self.connection)
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def event(self, event, value, address):
+        return [MONITOR_EVENT.pack(event, value), address]
+
+    def test_names(self):
+        self.failUnlessEqual(
+            'connectRetried',
+            ZmqSocketEvent.names[ZmqSocketEvent.connectRetried])
+        self.failIfIn(ZmqSocketEvent.all, ZmqSocketEvent.names)
+
+    def test_gotEvent(self):
+        address = "tcp://127.0.0.1:5559"
+        self.monitor._gotEvent(
+            self.event(ZmqSocketEvent.connectDelayed, 0, address))
+        self.monitor._gotEvent(
+            self.event(ZmqSocketEvent.connectRetried, 100, address))
+        self.monitor._gotEvent(
+            self.event(ZmqSocketEvent.connectRetried, 200, address))
+
+        self.failUnlessEqual(
+            2, self.monitor.count(address, ZmqSocketEvent.connectRetried))
+        self.failUnlessEqual(
+            0, self.monitor.count(address, ZmqSocketEvent.connected))
+        self.failUnlessEqual(
+            {address: {'connectDelayed': 1, 'connectRetried': 2}},
+            self.monitor.stats)
+        self.failUnlessEqual(
+            [(ZmqSocketEvent.connectDelayed, 0, address),
+             (ZmqSocketEvent.connectRetried, 100, address),
+             (ZmqSocketEvent.connectRetried, 200, address)],
+            self.connection.events)
+
+    def test_unsupported(self):
+        if ZmqSocketMonitor.supported():
+            raise unittest.SkipTest("libzmq supports socket monitoring")
+        self.failUnlessRaises(NotImplementedError, self.monitor.start)
+        self.failUnlessIdentical(None, self.connection.monitor)
+
+    def test_shutdown(self):
+        self.patch(self.monitor, 'supported', lambda: True)
+        socket = self.connection.socket = ZmqTestMonitoredSocket(
+            self.connection.socket)
+        address = MONITOR_INPROC_PREFIX + "%x" % id(self.monitor)
+        ZmqTestPairConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, address))
+        self.monitor.start()
+        companion = self.monitor.companion
+        self.failUnlessEqual(address, socket.monitored)
+        self.failUnlessIdentical(self.monitor, companion.socketMonitor)
+        self.failUnlessIdentical(self.monitor, self.connection.monitor)
+
+        self.connection.shutdown()
+        self.failUnlessIdentical(None, self.monitor.companion)
+        self.failUnlessIdentical(None, self.connection.monitor)
+        self.failUnlessIdentical(None, companion.factory)
+        self.failUnlessIdentical(None, socket.monitored)
+
+    def test_connect(self):
+        if not ZmqSocketMonitor.supported():
+            raise unittest.SkipTest("Socket monitoring requires libzmq 4.0")
+        self.monitor.start()
+        address = "tcp://127.0.0.1:5559"
+        ZmqPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, address))
+        self.connection.addEndpoints(
+            [ZmqEndpoint(ZmqEndpointType.connect, address)])
+
+        def check(ignore):
+            self.failUnlessEqual(
+                1, self.monitor.count(address, ZmqSocketEvent.connected))
+            self.connection.shutdown()
+            self.failUnlessIdentical(None, self.monitor.companion)
+
+        return _wait(0.1).addCallback(check)
@@ -0,0 +1,174 @@
+"""
+Tests for L{txzmq.pacing}.
+"""
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.pacing import ZmqPacer, ZmqPacingUnit, ZmqTokenBucket
+from txzmq.pubsub import ZmqPubConnection, ZmqSubConnection
+from txzmq.pushpull import ZmqPushConnection, ZmqPullConnection
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestPullConnection(ZmqPullConnection):
+    def onPull(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append((self.factory.reactor.seconds(), message[0]))
+
+
+class ZmqTestSubConnection(ZmqSubConnection):
+    def gotMessage(self, message, tag):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append((self.factory.reactor.seconds(), tag, message))
+
+
+class ZmqTokenBucketTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.pacing.ZmqTokenBucket}.
+    """
+
+    def test_delay(self):
+        bucket = ZmqTokenBucket(10, 2)
+        for _ in xrange(2):
+            self.failUnlessEqual(0, bucket.delay(1, 0.0))
+            bucket.take(1)
+        self.failUnlessEqual(0.1, bucket.delay(1, 0.0))
+        self.failUnlessEqual(0, bucket.delay(1, 0.1))
+        bucket.take(1)
+        self.failUnlessEqual(2.0, bucket.delay(1, 10.0) + 2.0)
+
+    def test_bytes(self):
+        bucket = ZmqTokenBucket(100, 10, ZmqPacingUnit.bytes)
+        self.failUnlessEqual(30, bucket.cost(['a' * 10, 'b' * 20]))
+        # message larger than burst goes when bucket is full
+        self.failUnlessEqual(0, bucket.delay(30, 0.0))
+        bucket.take(30)
+        self.failUnlessEqual(0.3, bucket.delay(30, 0.0))
+
+
+class ZmqPacerTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.pacing.ZmqPacer}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.clock = self.factory.reactor
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def pushPull(self):
+        r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://pace"))
+        s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://pace"))
+        self.clock.run()
+        return s, r
+
+    def pubSub(self):
+        r = ZmqTestSubConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://pace"))
+        s = ZmqPubConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://pace"))
+        r.subscribe('')
+        self.clock.run()
+        return s, r
+
+    def times(self, messages):
+        return [(round(m[0], 6),) + m[1:] for m in messages]
+
+    def test_rate(self):
+        s, r = self.pushPull()
+        pacer = ZmqPacer(s, rate=10, burst=2)
+        pacer.start()
+        for i in xrange(5):
+            s.push(str(i))
+        self.clock.run()
+
+        self.failUnlessEqual(
+            [(0.0, '0'), (0.0, '1'), (0.1, '2'), (0.2, '3'), (0.3, '4')],
+            self.times(r.messages))
+        self.failUnlessEqual(
+            {'sent': 5, 'deferred': 3, 'dropped': 0, 'held': 0},
+            pacer.stats())
+
+    def test_bytes(self):
+        s, r = self.pushPull()
+        ZmqPacer(s, rate=100, burst=100, unit=ZmqPacingUnit.bytes).start()
+        for i in xrange(4):
+            s.push(str(i) * 50)
+        self.clock.run()
+
+        self.failUnlessEqual(
+            [0.0, 0.0, 0.5, 1.0],
+            [t for t, _ in self.times(r.messages)])
+
+    def test_tag(self):
+        s, r = self.pubSub()
+        pacer = ZmqPacer(s)
+        pacer.setTagLimit('slow', 1, 1)
+        pacer.start()
+        for i in xrange(3):
+            s.publish(str(i), 'slow')
+            s.publish(str(i), 'fast')
+        self.clock.run()
+
+        self.failUnlessEqual(
+            [(0.0, 'slow', '0'), (0.0, 'fast', '0'), (0.0, 'fast', '1'),
+             (0.0, 'fast', '2'), (1.0, 'slow', '1'), (2.0, 'slow', '2')],
+            self.times(r.messages))
+        self.failUnlessEqual(2, pacer.deferred)
+
+    def test_tag_and_rate(self):
+        s, r = self.pubSub()
+        pacer = ZmqPacer(s, rate=10, burst=1)
+        pacer.setTagLimit('slow', 2, 1)
+        pacer.start()
+        for i in xrange(3):
+            s.publish(str(i), 'slow')
+        s.publish('x', 'fast')
+        self.clock.run()
+
+        self.failUnlessEqual(
+            [(0.0, 'slow', '0'), (0.1, 'fast', 'x'), (0.5, 'slow', '1'),
+             (1.0, 'slow', '2')],
+            self.times(r.messages))
+
+    def test_maxHeld(self):
+        s, r = self.pubSub()
+        pacer = ZmqPacer(s, maxHeld=1)
+        pacer.setTagLimit('slow', 1, 1)
+        pacer.start()
+        for i in xrange(3):
+            s.publish(str(i), 'slow')
+        self.clock.advance(0)
+        self.failUnlessEqual(1, pacer.stats()['held'])
+        self.clock.run()
+
+        self.failUnlessEqual(
+            [(0.0, 'slow', '0'), (1.0, 'slow', '2')], self.times(r.messages))
+        self.failUnlessEqual(1, pacer.dropped)
+
+    def test_stop(self):
+        s, r = self.pubSub()
+        pacer = ZmqPacer(s, rate=1, burst=1)
+        pacer.setTagLimit('slow', 1, 1)
+        pacer.start()
+        for i in xrange(2):
+            s.publish(str(i), 'slow')
+        for i in xrange(2):
+            s.publish(str(i), 'fast')
+        self.clock.advance(0)
+        pacer.stop()
+        self.failUnlessIdentical(None, s.pacer)
+        self.clock.advance(0)
+
+        self.failUnlessEqual(
+            [(0.0, 'slow', '0'), (0.0, 'slow', '1'), (0.0, 'fast', '0'),
+             (0.0, 'fast', '1')],
+            self.times(r.messages))
@@ -0,0 +1,214 @@
+"""
+Tests for L{txzmq.pipeline}.
+"""
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.router_dealer import ZmqDealerConnection
+from txzmq.pipeline import ZmqAckedPullConnection, ZmqAckedPushConnection
+from txzmq.pipeline import ZmqTaskFailedError
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestAckedPushConnection(ZmqAckedPushConnection):
+    ackTimeout = 1.0
+    peerIdleTimeout = None
+
+
+class ZmqTestAckedPullConnection(ZmqAckedPullConnection):
+    heartbeatInterval = None
+    delay = 0.1
+    fail = False
+    concurrency = 0
+
+    def onPull(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message[0])
+        self.concurrency = max(self.concurrency, len(self.handling))
+        if self.fail:
+            raise ValueError("fail")
+        if self.delay is None:
+            # never finishes
+            return defer.Deferred()
+        return task.deferLater(self.factory.reactor, self.delay, lambda: None)
+
+
+class ZmqTestDealerConnection(ZmqDealerConnection):
+    def gotMessage(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+
+class ZmqPipelineTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.pipeline}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.001)
+        self.clock = self.factory.reactor
+        self.s = ZmqTestAckedPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://tasks"))
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def restart(self):
+        # unbind first, so that workers reconnect as they do with ZeroMQ
+        self.s.removeEndpoints(self.s.endpoints)
+        self.s.shutdown()
+        self.s = ZmqTestAckedPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://tasks"))
+
+    def worker(self, identity, delay=0.1):
+        w = ZmqTestAckedPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://tasks"),
+            identity=identity)
+        w.delay = delay
+        return w
+
+    def test_ack(self):
+        w = self.worker('w1')
+        d = self.s.push(['a', 'b'])
+        self.clock.run()
+
+        self.failUnlessEqual('w1', self.successResultOf(d))
+        self.failUnlessEqual(['a'], w.messages)
+        self.failUnlessEqual(
+            {'pending': 0, 'inFlight': 0, 'workers': 1, 'completed': 1,
+             'redelivered': 0, 'failed': 0},
+            self.s.stats())
+
+    def test_work_stealing(self):
+        fast = self.worker('fast', 0.01)
+        slow = self.worker('slow', 0.5)
+        deferreds = [self.s.push(str(i)) for i in xrange(20)]
+        self.clock.run()
+
+        results = [self.successResultOf(d) for d in deferreds]
+        self.failUnlessEqual(20, len(fast.messages) + len(slow.messages))
+        self.failUnless(len(fast.messages) > 3 * len(slow.messages))
+        self.failUnlessEqual(len(slow.messages), results.count('slow'))
+        self.failUnless(self.clock.seconds() < 1.0)
+
+    def test_redelivery(self):
+        stuck = self.worker('stuck', None)
+        self.clock.advance(0.01)
+        d = self.s.push('a')
+        self.clock.advance(0.01)
+        ok = self.worker('ok')
+        self.clock.run()
+
+        self.failUnlessEqual('ok', self.successResultOf(d))
+        self.failUnlessEqual(['a'], stuck.messages)
+        self.failUnlessEqual(['a'], ok.messages)
+        self.failUnlessEqual(1, self.s.redelivered)
+        # stuck worker hasn't got its credit back
+        self.failUnlessEqual(0, self.s.credits['stuck'])
+
+    def test_late_ack(self):
+        slow = self.worker('slow', 1.5)
+        d = self.s.push('a')
+        self.clock.run()
+
+        # timed out while worker is busy, late acknowledgement completes it
+        self.failUnlessEqual('slow', self.successResultOf(d))
+        self.failUnlessEqual(['a'], slow.messages)
+        self.failUnlessEqual(1, self.s.redelivered)
+        self.failUnlessEqual(1, self.s.completed)
+        self.failUnlessEqual({}, self.s.inFlight)
+        self.failUnlessEqual(0, len(self.s.pending))
+        self.failUnlessEqual(1, self.s.credits['slow'])
+
+    def test_nack(self):
+        bad = self.worker('bad')
+        bad.fail = True
+        self.worker('good')
+        self.clock.advance(0.01)
+        d = self.s.push('a')
+        self.clock.run()
+
+        self.failUnlessEqual('good', self.successResultOf(d))
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(ValueError)))
+        self.failUnlessEqual(['a'], bad.messages)
+
+    def test_maxAttempts(self):
+        self.s.maxAttempts = 2
+        w = self.worker('w1')
+        w.fail = True
+        d = self.s.push('a')
+        self.clock.run()
+
+        self.failureResultOf(d, ZmqTaskFailedError)
+        self.failUnlessEqual(2, len(self.flushLoggedErrors(ValueError)))
+        self.failUnlessEqual(['a', 'a'], w.messages)
+        self.failUnlessEqual(1, self.s.failed)
+        self.failUnlessEqual({}, self.s.inFlight)
+
+    def test_shutdown(self):
+        d = self.s.push('a')
+        self.s.shutdown()
+
+        self.failureResultOf(d, ZmqTaskFailedError)
+
+    def test_idle_worker(self):
+        self.patch(ZmqTestAckedPushConnection, 'peerIdleTimeout', 2)
+        self.patch(ZmqTestAckedPullConnection, 'heartbeatInterval', 0.5)
+        self.restart()
+        w = self.worker('w1')
+        self.clock.run(until=6)
+        d = self.s.push('job')
+        self.clock.run(until=7)
+
+        self.failUnlessEqual('w1', self.successResultOf(d))
+        self.failUnlessEqual(['job'], w.messages)
+        self.failUnlessEqual(0, self.s.expired)
+
+    def test_expired_worker(self):
+        self.patch(ZmqTestAckedPushConnection, 'peerIdleTimeout', 2)
+        self.restart()
+        w = self.worker('w1')
+        self.clock.run(until=6)
+        self.failUnlessEqual(1, self.s.expired)
+        self.failUnlessEqual(0, self.s.stats()['workers'])
+
+        # worker is asked to announce its credit once it's heard again
+        d = self.s.push('job')
+        w.startHeartbeat(0.5)
+        self.clock.run(until=7)
+        self.failUnlessEqual('w1', self.successResultOf(d))
+
+    def test_pusher_restart(self):
+        self.patch(ZmqTestAckedPullConnection, 'heartbeatInterval', 0.5)
+        self.patch(ZmqTestAckedPullConnection, 'prefetch', 2)
+        w = self.worker('w1', 0.3)
+        lost = self.s.push('a')
+        self.clock.run(until=0.1)
+        self.restart()
+        self.failureResultOf(lost, ZmqTaskFailedError)
+        deferreds = [self.s.push(str(i)) for i in xrange(6)]
+        self.clock.run(until=5)
+
+        self.failUnlessEqual(
+            ['w1'] * 6, [self.successResultOf(d) for d in deferreds])
+        self.failUnlessEqual(2, w.concurrency)
+        self.failUnlessEqual(2, self.s.credits['w1'])
+
+    def test_malformed(self):
+        d = ZmqTestDealerConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://tasks"),
+            identity='bad')
+        for message in (['READY', 'x'], ['ACK'], ['NACK', 'a', 'b', 'c'],
+                        ['READY', '\0' * 8, 'x']):
+            d.sendMultipart(message)
+        self.clock.run()
+
+        self.failIf(self.s.credits.get('bad'))
+        # unknown worker is asked to announce its credit, nothing else
+        self.failUnlessEqual([['ANNOUNCE']], d.messages)
+        self.failUnlessEqual({'bad': 0}, self.s.credits)
@@ -0,0 +1,65 @@
+"""
+Tests for L{txzmq.pool}.
+"""
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.factory import ZmqFactory
+from txzmq.pool import ZmqREQPool
+from txzmq.req_rep import ZmqREPConnection
+
+
+class ZmqEchoREPConnection(ZmqREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        self.reply(messageId, *messageParts)
+
+
+class ZmqREQPoolTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.pool.ZmqREQPool}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        for address in ("inproc://#1", "inproc://#2"):
+            ZmqEchoREPConnection(
+                self.factory, ZmqEndpoint(ZmqEndpointType.bind, address))
+        self.pool = ZmqREQPool(
+            self.factory,
+            [ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"),
+             ZmqEndpoint(ZmqEndpointType.connect, "inproc://#2")], size=4)
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_init(self):
+        self.failUnlessEqual(4, len(self.pool.connections))
+        self.failUnlessEqual(
+            ["inproc://#1", "inproc://#2", "inproc://#1", "inproc://#2"],
+            [c.endpoints[0].address for c in self.pool.connections])
+
+    def test_least_loaded(self):
+        for i in xrange(8):
+            self.pool.sendMsg(str(i))
+        self.failUnlessEqual([2, 2, 2, 2], self.pool.inFlight())
+        self.failUnlessEqual([2, 2, 2, 2], self.pool.requests)
+
+    def test_key(self):
+        for key in ('a', 'b', 'c', 'd', 'e'):
+            before = list(self.pool.requests)
+            for _ in xrange(5):
+                self.pool.sendMsg('aaa', key=key)
+            diff = [n - m for n, m in zip(self.pool.requests, before)]
+            self.failUnlessEqual([5], [n for n in diff if n])
+
+    def test_send_recv(self):
+        deferreds = [self.pool.sendMsg(str(i)) for i in xrange(10)]
+
+        def check(responses):
+            self.failUnlessEqual([[str(i)] for i in xrange(10)], responses)
+            self.failUnlessEqual(
+                {'connections': 4, 'requests': 10, 'inFlight': 0},
+                self.pool.stats())
+
+        return defer.gatherResults(deferreds).addCallback(check)
@@ -0,0 +1,93 @@
+"""
+Tests for L{txzmq.profiling}.
+"""
+import time
+
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.profiling import ZmqDispatchProfiler
+from txzmq.pushpull import ZmqPushConnection, ZmqPullConnection
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestPullConnection(ZmqPullConnection):
+    def onPull(self, message):
+        if message == ['fail']:
+            raise RuntimeError("fail")
+        if message == ['slow']:
+            self.slowHandler()
+
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+    def slowHandler(self):
+        time.sleep(0.1)
+
+
+class ZmqDispatchProfilerTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.profiling.ZmqDispatchProfiler}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://test"))
+        self.s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://test"))
+        self.profiler = ZmqDispatchProfiler(threshold=0.02)
+
+    def tearDown(self):
+        self.profiler.disable()
+        self.factory.shutdown()
+
+    def test_stats(self):
+        self.profiler.sampleStacks = False
+        self.profiler.enable(self.factory)
+        for i in xrange(10):
+            self.s.push(str(i))
+        self.factory.reactor.run()
+
+        stats = self.profiler.stats['ZmqTestPullConnection']
+        self.failUnlessEqual(10, stats.calls)
+        self.failUnlessEqual(0, stats.slow)
+        self.failUnless(stats.maxTime <= stats.totalTime)
+        self.failUnlessEqual(10, len(self.r.messages))
+
+    def test_slow(self):
+        self.profiler.enable(self.factory)
+        self.s.push('fast')
+        self.s.push('slow')
+        self.factory.reactor.run()
+
+        stats = self.profiler.stats['ZmqTestPullConnection']
+        self.failUnlessEqual(1, stats.slow)
+        self.failUnlessEqual(1, len(self.profiler.samples))
+        connection, elapsed, stack = self.profiler.samples[0]
+        self.failUnless(elapsed >= 0.1)
+        self.failUnlessIn('slowHandler', stack[-1])
+
+    def test_disable(self):
+        self.profiler.enable(self.factory)
+        self.profiler.disable()
+        self.failUnlessIdentical(None, self.factory.profiler)
+        self.s.push('abcd')
+        self.factory.reactor.run()
+        self.failUnlessEqual({}, self.profiler.stats)
+        self.failUnlessEqual([['abcd']], self.r.messages)
+
+    def test_error(self):
+        self.s.push('fail')
+        self.s.push('abcd')
+        self.factory.reactor.run()
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(RuntimeError)))
+        self.failUnlessEqual([['abcd']], self.r.messages)
+
+    def test_error_profiled(self):
+        self.profiler.enable(self.factory)
+        self.test_error()
+        self.failUnlessEqual(
+            2, self.profiler.stats['ZmqTestPullConnection'].calls)
@@ -9,6 +9,7 @@ from zmq import ZMQError
 from txzmq.connection import ZmqEndpoint, ZmqEndpointType
 from txzmq.factory import ZmqFactory
 from txzmq.pubsub import ZmqPubConnection, ZmqSubConnection
+from txzmq.pubsub import SEQUENCE_HEADER, ZmqSequencing
 from txzmq.test import _wait
 
 
@@ -19,6 +20,18 @@ class ZmqTestSubConnection(ZmqSubConnection):
 
         self.messages.append([tag, message])
 
+    def sequenceGap(self, publisherId, tag, expected, received):
+        if not hasattr(self, 'events'):
+            self.events = []
+
+        self.events.append(['gap', tag, expected, received])
+
+    def sequenceDuplicate(self, publisherId, tag, sequence):
+        if not hasattr(self, 'events'):
+            self.events = []
+
+        self.events.append(['duplicate', tag, sequence])
+
 
 class ZmqConnectionTestCase(unittest.TestCase):
     """
@@ -102,3 +115,145 @@ class ZmqConnectionTestCase(unittest.TestCase):
                 sorted(result), expected, "Message should have been received")
 
         return _wait(0.2).addCallback(check)
+
+
+class ZmqSequencingTestCase(unittest.TestCase):
+    """
+    Test case for sequencing of published messages.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        self.r = ZmqTestSubConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        self.s = ZmqPubConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"))
+        self.r.subscribe('')
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def header(self, mode, sequence):
+        return SEQUENCE_HEADER.pack(mode, 1, sequence)
+
+    def test_send_recv_publisher(self):
+        self.s.sequencing = ZmqSequencing.publisher
+        self.s.publish('abcd', 'tag1')
+        self.s.publish('efgh', 'tag2')
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [['tag1', 'abcd'], ['tag2', 'efgh']], self.r.messages)
+            self.failUnlessEqual(2, self.s.sequence)
+            self.failUnlessEqual(0, self.r.gaps)
+
+        return _wait(0.01).addCallback(check)
+
+    def test_send_recv_topic(self):
+        self.s.sequencing = ZmqSequencing.topic
+        self.s.publish('abcd', 'tag1')
+        self.s.publish('efgh', 'tag2')
+        self.s.publish('ijkl', 'tag1')
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [['tag1', 'abcd'], ['tag2', 'efgh'], ['tag1', 'ijkl']],
+                self.r.messages)
+            self.failUnlessEqual(
+                {(self.s.publisherId, 'tag1'): 2,
+                 (self.s.publisherId, 'tag2'): 1}, self.r._sequences)
+
+        return _wait(0.01).addCallback(check)
+
+    def test_gap(self):
+        for sequence in (1, 2, 5, 6, 10):
+            self.r.messageReceived(['tag', self.header(1, sequence), 'x'])
+
+        self.failUnlessEqual(2, self.r.gaps)
+        self.failUnlessEqual(5, self.r.lostMessages)
+        self.failUnlessEqual(
+            [['gap', 'tag', 3, 5], ['gap', 'tag', 7, 10]], self.r.events)
+        self.failUnlessEqual(5, len(self.r.messages))
+
+    def test_duplicate(self):
+        for sequence in (1, 2, 2, 1, 3):
+            self.r.messageReceived(['tag', self.header(1, sequence), 'x'])
+
+        self.failUnlessEqual(2, self.r.duplicates)
+        self.failUnlessEqual(
+            [['duplicate', 'tag', 2], ['duplicate', 'tag', 1]], self.r.events)
+        self.failUnlessEqual(3, len(self.r.messages))
+
+    def test_topic_gap(self):
+        self.r.messageReceived(['tag1', self.header(2, 1), 'x'])
+        self.r.messageReceived(['tag2', self.header(2, 1), 'x'])
+        self.r.messageReceived(['tag1', self.header(2, 3), 'x'])
+
+        self.failUnlessEqual([['gap', 'tag1', 2, 3]], self.r.events)
+
+    def test_unsequenced(self):
+        self.r.messageReceived(['tag\0abcd', 'efgh', 'ijkl'])
+        self.r.messageReceived(['tag\0x', '\x07' + self.header(1, 1)[1:],
+                                'y'])
+
+        self.failUnlessEqual([['tag', 'abcd'], ['tag', 'x']],
+                             self.r.messages)
+        self.failIf(hasattr(self.r, 'events'))
+        self.failUnlessEqual({}, self.r._sequences)
+
+
+class ZmqConflationTestCase(unittest.TestCase):
+    """
+    Test case for conflating subscriber.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        self.r = ZmqTestSubConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        self.r.conflate = True
+        self.s = ZmqPubConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"))
+        self.r.subscribe('')
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_conflate(self):
+        for i in xrange(10):
+            self.s.publish('a%d' % i, 'tag1')
+            self.s.publish('b%d' % i, 'tag2')
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [['tag1', 'a9'], ['tag2', 'b9']], self.r.messages)
+            self.failUnlessEqual(18, self.r.conflated)
+
+        return _wait(0.01).addCallback(check)
+
+    def test_conflate_sequenced(self):
+        self.s.sequencing = ZmqSequencing.publisher
+        for i in xrange(10):
+            self.s.publish('a%d' % i, 'tag1')
+            self.s.publish('b%d' % i, 'tag2')
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [['tag1', 'a9'], ['tag2', 'b9']], self.r.messages)
+            self.failUnlessEqual(18, self.r.conflated)
+            self.failUnlessEqual(0, self.r.gaps)
+
+        return _wait(0.01).addCallback(check)
+
+    def test_conflationKey(self):
+        self.r.conflationKey = lambda message: message[1][0]
+        self.s.publish('a1', 'tag1')
+        self.s.publish('b1', 'tag1')
+        self.s.publish('a2', 'tag2')
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [['tag1', 'b1'], ['tag2', 'a2']], self.r.messages)
+            self.failUnlessEqual(1, self.r.conflated)
+
+        return _wait(0.01).addCallback(check)
@@ -0,0 +1,118 @@
+"""
+Tests for L{txzmq.pushpull}.
+"""
+import os
+
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.factory import ZmqFactory
+from txzmq.pushpull import ZmqDurablePushConnection, ZmqPullConnection
+from txzmq.pushpull import ZmqPushConnection
+from txzmq.test import _wait
+
+
+class ZmqTestPullConnection(ZmqPullConnection):
+    def onPull(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+
+class ZmqTestDurablePushConnection(ZmqDurablePushConnection):
+    spoolThreshold = 2
+    spoolSegmentSize = 256
+
+
+class ZmqPullConnectionTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.pushpull.ZmqPullConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_conflate(self):
+        r = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1"))
+        r.conflate = True
+        s = ZmqPushConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1"))
+        for i in xrange(5):
+            s.push(['key1', str(i)])
+        s.push(['key2', 'x'])
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [['key1', '4'], ['key2', 'x']], r.messages)
+            self.failUnlessEqual(4, r.conflated)
+
+        return _wait(0.01).addCallback(check)
+
+
+class ZmqDurablePushConnectionTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.pushpull.ZmqDurablePushConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        self.path = self.mktemp()
+        self.bind = ZmqEndpoint(ZmqEndpointType.bind, "tcp://127.0.0.1:5558")
+        self.connect = ZmqEndpoint(ZmqEndpointType.connect,
+                                   "tcp://127.0.0.1:5558")
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_spill(self):
+        s = ZmqTestDurablePushConnection(
+            self.factory, self.bind, spoolPath=self.path)
+        for i in xrange(20):
+            s.push(str(i) * 10)
+
+        self.failUnless(len(s.queue) <= 2)
+        self.failUnless(s.spool.pending >= 18)
+        self.failUnless(len(os.listdir(self.path)) > 1)
+
+        def pull(ignore):
+            self.r = ZmqTestPullConnection(self.factory, self.connect)
+            return _wait(0.2)
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [[str(i) * 10] for i in xrange(20)], self.r.messages)
+            self.failUnlessEqual(0, s.spool.pending)
+            self.failUnlessEqual(1, len(os.listdir(self.path)))
+
+        return _wait(0.01).addCallback(pull).addCallback(check)
+
+    def test_replay(self):
+        s = ZmqTestDurablePushConnection(self.factory, spoolPath=self.path)
+        s.spoolThreshold = 0
+        for i in xrange(5):
+            s.push(['part', str(i)])
+
+        def restart(ignore):
+            s.shutdown()
+            self.r = ZmqTestPullConnection(self.factory, self.connect)
+            ZmqTestDurablePushConnection(
+                self.factory, self.bind, spoolPath=self.path)
+            return _wait(0.2)
+
+        def check(ignore):
+            self.failUnlessEqual(
+                [['part', str(i)] for i in xrange(5)], self.r.messages)
+
+        return _wait(0.01).addCallback(restart).addCallback(check)
+
+    def test_priority(self):
+        s = ZmqTestDurablePushConnection(self.factory, spoolPath=self.path)
+        s.send('a', priority=0)
+        s.send('b', priority=None)
+        self.failUnlessEqual(2, len(s.queue))
+        self.failUnlessRaises(ValueError, s.send, 'c', priority=1)
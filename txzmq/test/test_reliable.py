@@ -0,0 +1,109 @@
+"""
+Tests for L{txzmq.reliable}.
+"""
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.factory import ZmqFactory
+from txzmq.reliable import ZmqReliableREQClient
+from txzmq.req_rep import ZmqREPConnection, ZmqRequestTimeoutError
+from txzmq.test import _wait
+
+
+class ZmqEchoREPConnection(ZmqREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        self.reply(messageId, *messageParts)
+
+
+class ZmqTestReliableREQClient(ZmqReliableREQClient):
+    requestTimeout = 0.05
+    maxRetries = 2
+    retryDelay = 0.01
+
+
+class ZmqReliableREQClientTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.reliable.ZmqReliableREQClient}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        self.dead = ZmqEndpoint(ZmqEndpointType.connect,
+                                "tcp://127.0.0.1:7861")
+        self.alive = ZmqEndpoint(ZmqEndpointType.connect,
+                                 "tcp://127.0.0.1:7862")
+        ZmqEchoREPConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind,
+                                      "tcp://127.0.0.1:7862"))
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_send_recv(self):
+        c = ZmqTestReliableREQClient(self.factory, [self.alive])
+
+        def check(response):
+            self.failUnlessEqual(['aaa', 'bbb'], response)
+            self.failUnlessEqual(0, c.retries)
+            self.failUnlessEqual(0, c.reconnects)
+
+        return c.sendMsg('aaa', 'bbb').addCallback(check)
+
+    def test_failover(self):
+        c = ZmqTestReliableREQClient(self.factory, [self.dead, self.alive])
+
+        def check(response):
+            self.failUnlessEqual(['aaa'], response)
+            self.failUnlessEqual(1, c.retries)
+            self.failUnlessEqual(1, c.timeouts)
+            self.failUnlessEqual(1, c.reconnects)
+            self.failUnlessEqual(self.alive, c.connection.endpoints[0])
+
+        return c.sendMsg('aaa').addCallback(check)
+
+    def test_resend_in_flight(self):
+        c = ZmqTestReliableREQClient(self.factory, [self.dead, self.alive])
+        d1 = c.sendMsg('aaa')
+        d2 = c.sendMsg('bbb')
+
+        def check(responses):
+            self.failUnlessEqual([['aaa'], ['bbb']], responses)
+            self.failUnlessEqual(1, c.reconnects)
+
+        return defer.gatherResults([d1, d2]).addCallback(check)
+
+    def test_give_up(self):
+        c = ZmqTestReliableREQClient(self.factory, [self.dead])
+
+        def check(ignore):
+            self.failUnlessEqual(2, c.retries)
+            self.failUnlessEqual(3, c.timeouts)
+            self.failUnlessEqual(1, c.failures)
+            self.failUnlessEqual(set(), c._pending)
+
+        return self.failUnlessFailure(
+            c.sendMsg('aaa'), ZmqRequestTimeoutError).addCallback(check)
+
+    def test_cancel(self):
+        c = ZmqTestReliableREQClient(self.factory, [self.dead])
+        d = c.sendMsg('aaa')
+        d.cancel()
+
+        def check(ignore):
+            self.failUnlessEqual(set(), c._pending)
+            return _wait(0.1)
+
+        def checkNoRetries(ignore):
+            self.failUnlessEqual(0, c.retries)
+
+        return self.failUnlessFailure(d, defer.CancelledError).addCallback(
+            check).addCallback(checkNoRetries)
+
+    def test_shutdown(self):
+        c = ZmqTestReliableREQClient(self.factory, [self.dead])
+        d = c.sendMsg('aaa')
+        c.shutdown()
+
+        self.failUnlessIdentical(None, c.connection)
+        return self.failUnlessFailure(d, defer.CancelledError)
@@ -6,8 +6,10 @@ from twisted.trial import unittest
 
 from txzmq.connection import ZmqEndpoint, ZmqEndpointType
 from txzmq.factory import ZmqFactory
+from txzmq.heartbeat import ZmqPeerLostError
 from txzmq.test import _wait
 from txzmq.req_rep import ZmqREPConnection, ZmqREQConnection
+from txzmq.req_rep import ZmqRequestTimeoutError
 
 
 class ZmqTestREPConnection(ZmqREPConnection):
@@ -93,6 +95,43 @@ class ZmqREQREPConnectionTestCase(unittest.TestCase):
             deferreds.append(d)
         return defer.DeferredList(deferreds, fireOnOneErrback=True)
 
+    def test_timeout(self):
+        self.r.gotMessage = lambda *args: None
+        d = self.s.sendMsg('aaa', timeout=0.01)
+
+        def check(ignore):
+            self.assertEqual(self.s._requests, {})
+
+        return self.failUnlessFailure(
+            d, ZmqRequestTimeoutError).addCallback(check)
+
+    def test_default_timeout(self):
+        self.r.gotMessage = lambda *args: None
+        self.s.defaultRequestTimeout = 0.01
+
+        return self.failUnlessFailure(
+            self.s.sendMsg('aaa'), ZmqRequestTimeoutError)
+
+    def test_timeout_cancelled(self):
+        d = self.s.sendMsg('aaa', timeout=0.05)
+
+        def check(ignore):
+            # timeout shouldn't fire after reply has been received
+            return _wait(0.1)
+
+        return d.addCallback(check)
+
+    def test_cancel(self):
+        d = self.s.sendMsg('aaa', timeout=0.05)
+        d.cancel()
+
+        def check(ignore):
+            self.assertEqual(self.s._requests, {})
+            return _wait(0.1)
+
+        return self.failUnlessFailure(
+            d, defer.CancelledError).addCallback(check)
+
     def test_cleanup_requests(self):
         """The request dict is cleanedup properly."""
         def check(ignore):
@@ -102,6 +141,72 @@ class ZmqREQREPConnectionTestCase(unittest.TestCase):
         return self.s.sendMsg('aaa').addCallback(check)
 
 
+class ZmqHeartbeatREQConnection(ZmqREQConnection):
+    heartbeatInterval = 0.01
+
+    def peerLost(self):
+        self.events = getattr(self, 'events', []) + ['lost']
+
+    def peerRecovered(self):
+        self.events = getattr(self, 'events', []) + ['recovered']
+
+
+class ZmqREQHeartbeatTestCase(unittest.TestCase):
+    """
+    Test case for heartbeating of L{zmq.req_rep.ZmqREQConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqFactory()
+        c = ZmqEndpoint(ZmqEndpointType.connect, "tcp://127.0.0.1:7860")
+        self.s = ZmqHeartbeatREQConnection(self.factory, c)
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_alive(self):
+        b = ZmqEndpoint(ZmqEndpointType.bind, "inproc://#1")
+        r = ZmqTestREPConnection(self.factory, b)
+        c = ZmqEndpoint(ZmqEndpointType.connect, "inproc://#1")
+        s = ZmqHeartbeatREQConnection(self.factory, c)
+
+        def check(ignore):
+            self.failUnless(s.heartbeat.alive)
+            self.failIf(hasattr(s, 'events'))
+            self.failIf(hasattr(r, 'messages'))
+
+        return _wait(0.1).addCallback(check)
+
+    def test_pending_failed(self):
+        d = self.s.sendMsg('aaa')
+
+        def check(ignore):
+            self.failIf(self.s.heartbeat.alive)
+            self.failUnlessEqual({}, self.s._requests)
+
+        return self.failUnlessFailure(d, ZmqPeerLostError).addCallback(check)
+
+    def test_fail_fast(self):
+        def check(ignore):
+            return self.failUnlessFailure(
+                self.s.sendMsg('aaa'), ZmqPeerLostError)
+
+        return _wait(0.1).addCallback(check)
+
+    def test_recovered(self):
+        def bind(ignore):
+            b = ZmqEndpoint(ZmqEndpointType.bind, "tcp://127.0.0.1:7860")
+            self.r = ZmqTestREPConnection(self.factory, b)
+            return _wait(0.1)
+
+        def check(ignore):
+            self.failUnlessEqual(['lost', 'recovered'], self.s.events)
+            return self.s.sendMsg('aaa')
+
+        return _wait(0.1).addCallback(bind).addCallback(check).addCallback(
+            self.failUnlessEqual, ['aaa'])
+
+
 class ZmqReplyConnection(ZmqREPConnection):
     def messageReceived(self, message):
         if not hasattr(self, 'message_count'):
@@ -0,0 +1,184 @@
+"""
+Tests for L{txzmq.router_dealer}.
+"""
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.memory import ROUTER_MANDATORY
+from txzmq.router_dealer import ZmqDealerConnection, ZmqRouterConnection
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestDealerConnection(ZmqDealerConnection):
+    def gotMessage(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+
+class ZmqTestRouterConnection(ZmqRouterConnection):
+    socketOptions = {ROUTER_MANDATORY: 1}
+    peerIdleTimeout = None
+
+    def gotMessage(self, sender, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append((sender, message))
+
+    def peerExpired(self, peer):
+        if not hasattr(self, 'expiredPeers'):
+            self.expiredPeers = []
+
+        self.expiredPeers.append(peer)
+
+
+class ZmqRouterPeersTestCase(unittest.TestCase):
+    """
+    Test case for peer table of L{txzmq.router_dealer.ZmqRouterConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.clock = self.factory.reactor
+        self.bind = ZmqEndpoint(ZmqEndpointType.bind, "sim://router")
+        self.connect = ZmqEndpoint(ZmqEndpointType.connect, "sim://router")
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def recordSends(self, r):
+        sends = []
+        sendToPeer = r._sendToPeer
+
+        def record(peer):
+            sent = sendToPeer(peer)
+            if sent:
+                sends.append(peer.identity)
+            return sent
+
+        r._sendToPeer = record
+        return sends
+
+    def test_stats(self):
+        r = ZmqTestRouterConnection(self.factory, self.bind)
+        d = ZmqTestDealerConnection(self.factory, self.connect, identity='a')
+
+        d.sendMsg('abcd')
+        d.sendMsg('efgh')
+        self.clock.run()
+        r.sendMultipart('a', ['ijkl', 'mnop'])
+        self.clock.run()
+
+        self.failUnlessEqual(
+            [('a', ['abcd']), ('a', ['efgh'])], r.messages)
+        self.failUnlessEqual([['ijkl', 'mnop']], d.messages)
+        peer = r.peers['a']
+        self.failUnlessEqual(2, peer.received)
+        self.failUnlessEqual(1, peer.sent)
+        self.failUnlessEqual(0, len(peer.queue))
+
+    def test_head_of_line(self):
+        r = ZmqTestRouterConnection(self.factory, self.bind)
+        d = ZmqTestDealerConnection(self.factory, self.connect, identity='a')
+        self.clock.run()
+
+        for i in xrange(3):
+            r.sendMsg('ghost', str(i))
+        r.sendMsg('a', 'abcd')
+        self.clock.advance(0)
+        self.clock.advance(0)
+
+        self.failUnlessEqual([['abcd']], d.messages)
+        ghost = r.peers['ghost']
+        self.failUnlessEqual(3, len(ghost.queue))
+        self.failUnless(ghost.blocked > 0)
+        self.failUnlessEqual(0, ghost.sent)
+
+    def test_invalid(self):
+        self.patch(ZmqTestRouterConnection, 'priorities', 2)
+        r = ZmqTestRouterConnection(self.factory, self.bind)
+        self.failUnlessRaises(ValueError, r.send, ['a'])
+        self.failUnlessRaises(ValueError, r.send, 'a')
+        self.failUnlessRaises(ValueError, r.send, ['a', 'abcd'], 0)
+        r.send(['a', 'abcd'], r.priorities - 1)
+        self.failUnlessEqual([['abcd']], list(r.peers['a'].queue))
+
+    def test_retry(self):
+        r = ZmqTestRouterConnection(self.factory, self.bind)
+        r.sendMsg('b', 'abcd')
+        self.clock.advance(0)
+        self.failUnlessEqual(1, r.peers['b'].blocked)
+
+        d = ZmqTestDealerConnection(self.factory, self.connect, identity='b')
+        self.clock.advance(r.peerRetryInterval)
+        self.clock.advance(0)
+        self.failUnlessEqual([['abcd']], d.messages)
+        self.failUnlessEqual(1, r.peers['b'].sent)
+
+    def test_round_robin(self):
+        r = ZmqTestRouterConnection(self.factory, self.bind)
+        ZmqTestDealerConnection(self.factory, self.connect, identity='a')
+        ZmqTestDealerConnection(self.factory, self.connect, identity='b')
+        self.clock.run()
+        sends = self.recordSends(r)
+
+        for i in xrange(3):
+            r.sendMsg('a', str(i))
+        for i in xrange(3):
+            r.sendMsg('b', str(i))
+        self.clock.run()
+
+        self.failUnlessEqual(['a', 'b', 'a', 'b', 'a', 'b'], sends)
+
+    def test_weights(self):
+        r = ZmqTestRouterConnection(self.factory, self.bind)
+        ZmqTestDealerConnection(self.factory, self.connect, identity='a')
+        ZmqTestDealerConnection(self.factory, self.connect, identity='b')
+        self.clock.run()
+        r.setPeerWeight('a', 3)
+        sends = self.recordSends(r)
+
+        for i in xrange(5):
+            r.sendMsg('a', str(i))
+            r.sendMsg('b', str(i))
+        self.clock.run()
+
+        self.failUnlessEqual(
+            ['a', 'a', 'a', 'b', 'a', 'a', 'b', 'b', 'b', 'b'], sends)
+        self.failUnlessRaises(ValueError, r.setPeerWeight, 'a', 0)
+        self.failUnlessEqual(3, r.peers['a'].weight)
+
+    def test_expiry(self):
+        self.patch(ZmqTestRouterConnection, 'peerIdleTimeout', 10)
+        r = ZmqTestRouterConnection(self.factory, self.bind)
+        d = ZmqTestDealerConnection(self.factory, self.connect, identity='a')
+
+        d.sendMsg('abcd')
+        r.sendMsg('ghost', 'efgh')
+        r.sendMsg('ghost', 'ijkl')
+        self.clock.run(until=8)
+        d.sendMsg('mnop')
+        self.clock.run(until=16)
+
+        self.failUnlessEqual(['ghost'], [p.identity for p in r.expiredPeers])
+        self.failUnlessEqual(['a'], r.peers.keys())
+        self.failUnlessEqual(1, r.expired)
+        self.failUnlessEqual(2, r.dropped)
+
+        self.clock.run(until=30)
+        self.failUnlessEqual({}, r.peers)
+        self.failUnlessEqual(2, r.expired)
+
+    def test_default_expiry(self):
+        r = ZmqRouterConnection(self.factory, self.bind)
+        for i in xrange(3):
+            r.sendMsg(str(i), 'abcd')
+        self.clock.run()
+
+        # expiry isn't scheduled while there are no peers
+        self.failUnlessEqual({}, r.peers)
+        self.failUnlessEqual(3, r.expired)
+        self.failUnless(self.clock.seconds() <= r.peerIdleTimeout * 1.5)
+        self.failIf(self.clock.getDelayedCalls())
@@ -0,0 +1,175 @@
+"""
+Tests for L{txzmq.scatter}.
+"""
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.req_rep import ZmqREQConnection, ZmqREPConnection
+from txzmq.req_rep import ZmqRequestTimeoutError
+from txzmq.router_dealer import ZmqDealerConnection
+from txzmq.scatter import ZmqGatherPolicy, ZmqREQScatter
+from txzmq.scatter import ZmqScatterGatherError, ZmqScatterRouterConnection
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqDelayedREPConnection(ZmqREPConnection):
+    delay = 0
+
+    def gotMessage(self, messageId, *messageParts):
+        if self.delay is not None:
+            self.factory.reactor.callLater(
+                self.delay, self.reply, messageId, self.endpoints[0].address,
+                *messageParts)
+
+
+class ZmqTestREQConnection(ZmqREQConnection):
+    defaultRequestTimeout = 1.0
+
+
+class ZmqTestScatterRouterConnection(ZmqScatterRouterConnection):
+    peerIdleTimeout = None
+
+
+class ZmqDelayedDealerConnection(ZmqDealerConnection):
+    delay = 0
+
+    def gotMessage(self, message):
+        self.factory.reactor.callLater(
+            self.delay, self.sendMultipart, message[:2] + [self.identity])
+
+
+class ZmqGatherPolicyTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.scatter.ZmqGatherPolicy}.
+    """
+
+    def test_needed(self):
+        self.failUnlessEqual(1, ZmqGatherPolicy.needed('first', 5))
+        self.failUnlessEqual(3, ZmqGatherPolicy.needed('quorum', 5))
+        self.failUnlessEqual(3, ZmqGatherPolicy.needed('quorum', 4))
+        self.failUnlessEqual(5, ZmqGatherPolicy.needed('all', 5))
+        self.failUnlessEqual(2, ZmqGatherPolicy.needed(2, 5))
+        self.failUnlessEqual(5, ZmqGatherPolicy.needed(7, 5))
+        self.failUnlessEqual(0, ZmqGatherPolicy.needed('first', 0))
+        self.failUnlessRaises(ValueError, ZmqGatherPolicy.needed, 'most', 5)
+
+
+class ZmqREQScatterTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.scatter.ZmqREQScatter}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.001)
+        self.clock = self.factory.reactor
+        self.backends = []
+        connections = []
+        for i, delay in enumerate((0.3, 0.1, 0.2)):
+            address = "sim://backend%d" % i
+            backend = ZmqDelayedREPConnection(
+                self.factory, ZmqEndpoint(ZmqEndpointType.bind, address))
+            backend.delay = delay
+            self.backends.append(backend)
+            connections.append(ZmqTestREQConnection(
+                self.factory, ZmqEndpoint(ZmqEndpointType.connect, address)))
+        self.scatter = ZmqREQScatter(connections)
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_all(self):
+        d = self.scatter.sendMsg('abcd')
+        self.clock.run()
+        results = self.successResultOf(d)
+        self.failUnlessEqual(
+            [(self.scatter.connections[i], ["sim://backend%d" % i, 'abcd'])
+             for i in (1, 2, 0)], results)
+
+    def test_first(self):
+        d = self.scatter.sendMsg('abcd', need=ZmqGatherPolicy.first)
+        self.clock.run(until=0.15)
+        self.failUnlessEqual(
+            [(self.scatter.connections[1], ["sim://backend1", 'abcd'])],
+            self.successResultOf(d))
+        # stragglers are cancelled
+        self.failUnlessEqual(
+            [0, 0, 0], [len(c._requests) for c in self.scatter.connections])
+        self.clock.run()
+
+    def test_quorum_deadline(self):
+        d = self.scatter.sendMsg(
+            'abcd', need=ZmqGatherPolicy.quorum, timeout=0.15)
+        self.clock.run(until=0.15)
+        error = self.failureResultOf(d, ZmqScatterGatherError).value
+        self.failUnlessEqual(
+            [self.scatter.connections[1]], [c for c, _ in error.results])
+        self.failUnlessEqual(
+            [0, 0, 0], [len(c._requests) for c in self.scatter.connections])
+        self.clock.run()
+
+    def test_failures(self):
+        self.backends[0].delay = None
+        self.backends[2].delay = None
+        d = self.scatter.sendMsg('abcd', need=2)
+        self.clock.run()
+        error = self.failureResultOf(d, ZmqScatterGatherError).value
+        self.failUnlessEqual(1, len(error.results))
+        self.failUnlessEqual(2, len(error.failures))
+        error.failures[0][1].trap(ZmqRequestTimeoutError)
+
+    def test_cancel(self):
+        d = self.scatter.sendMsg('abcd')
+        d.addErrback(lambda _: None)
+        d.cancel()
+        self.failUnlessEqual(
+            [0, 0, 0], [len(c._requests) for c in self.scatter.connections])
+        self.clock.run()
+
+
+class ZmqScatterRouterTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.scatter.ZmqScatterRouterConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.001)
+        self.clock = self.factory.reactor
+        self.r = ZmqTestScatterRouterConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://router"))
+        for identity, delay in (('w1', 0.2), ('w2', 0.1), ('w3', 0.3)):
+            worker = ZmqDelayedDealerConnection(
+                self.factory,
+                ZmqEndpoint(ZmqEndpointType.connect, "sim://router"),
+                identity=identity)
+            worker.delay = delay
+            # let router know about the worker
+            worker.sendMsg('hello')
+        self.clock.run()
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_all(self):
+        d = self.r.scatter(None, 'abcd', timeout=1.0)
+        self.clock.run()
+        self.failUnlessEqual(
+            [('w2', ['w2']), ('w1', ['w1']), ('w3', ['w3'])],
+            self.successResultOf(d))
+        self.failUnlessEqual({}, self.r._gathers)
+
+    def test_first_k(self):
+        d = self.r.scatter(['w1', 'w3'], 'abcd', need=1, timeout=0.5)
+        self.clock.run()
+        self.failUnlessEqual([('w1', ['w1'])], self.successResultOf(d))
+        self.failUnlessEqual({}, self.r._gathers)
+
+    def test_deadline(self):
+        d = self.r.scatter(None, 'abcd', need=3, timeout=0.25)
+        self.clock.run()
+        error = self.failureResultOf(d, ZmqScatterGatherError).value
+        self.failUnlessEqual(['w2', 'w1'], [p for p, _ in error.results])
+        self.failUnlessEqual({}, self.r._gathers)
+
+    def test_all_without_timeout(self):
+        self.failUnlessRaises(ValueError, self.r.scatter, None, 'abcd')
+        self.failUnlessEqual({}, self.r._gathers)
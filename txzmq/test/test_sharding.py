@@ -0,0 +1,99 @@
+"""
+Tests for L{txzmq.sharding}.
+"""
+from zmq.core import constants
+
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.sharding import ZmqShardedPublisher, ZmqShardedSubscriber
+from txzmq.sharding import ZmqTopicSharding
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestSubscriber(ZmqShardedSubscriber):
+    def gotMessage(self, message, tag):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append((tag, message))
+
+
+class ZmqTopicShardingTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.sharding.ZmqTopicSharding}.
+    """
+
+    def test_shardOf(self):
+        sharding = ZmqTopicSharding(8)
+        self.failUnlessEqual(
+            sharding.shardOf('news'), sharding.shardOf('news.world'))
+        self.failUnlessEqual(
+            sharding.shardOf('news.sport'), sharding.shardOf('news.world'))
+        self.failUnlessEqual(
+            set(range(8)),
+            set(sharding.shardOf('topic%d' % i) for i in xrange(100)))
+
+    def test_shardsOf(self):
+        sharding = ZmqTopicSharding(4, separator='/')
+        self.failUnlessEqual(
+            [sharding.shardOf('news')], sharding.shardsOf('news/'))
+        self.failUnlessEqual(range(4), sharding.shardsOf('news'))
+        self.failUnlessEqual(range(4), sharding.shardsOf(''))
+
+
+class ZmqShardedPubSubTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.sharding.ZmqShardedPublisher} and
+    L{txzmq.sharding.ZmqShardedSubscriber}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory()
+        self.factory.ioThreads = 2
+        addresses = ["sim://shard%d" % i for i in xrange(4)]
+        self.publisher = ZmqShardedPublisher(
+            self.factory,
+            [ZmqEndpoint(ZmqEndpointType.bind, a) for a in addresses])
+        self.endpoints = [
+            ZmqEndpoint(ZmqEndpointType.connect, a) for a in addresses]
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def publishAll(self):
+        for i in xrange(8):
+            self.publisher.publish(str(i), 'topic%d.x' % i)
+        self.factory.reactor.run()
+
+    def test_subscribe(self):
+        s = ZmqTestSubscriber(self.factory, self.endpoints)
+        s.subscribe('topic3.')
+        s.subscribe('topic5.x')
+        self.factory.reactor.run()
+        self.publishAll()
+
+        sharding = self.publisher.sharding
+        self.failUnlessEqual(
+            set([sharding.shardOf('topic3'), sharding.shardOf('topic5')]),
+            s.connected)
+        self.failUnlessEqual(
+            [('topic3.x', '3'), ('topic5.x', '5')], sorted(s.messages))
+        self.failUnlessEqual(8, sum(self.publisher.published))
+
+    def test_subscribe_all(self):
+        s = ZmqTestSubscriber(self.factory, self.endpoints)
+        s.subscribe('')
+        self.factory.reactor.run()
+        self.publishAll()
+
+        self.failUnlessEqual(set(range(4)), s.connected)
+        self.failUnlessEqual(
+            [('topic%d.x' % i, str(i)) for i in xrange(8)],
+            sorted(s.messages))
+
+    def test_affinity(self):
+        self.failUnlessEqual(
+            [1, 2, 1, 2],
+            [c.socket.getsockopt(constants.AFFINITY)
+             for c in self.publisher.connections])
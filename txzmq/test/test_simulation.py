@@ -0,0 +1,181 @@
+"""
+Tests for L{txzmq.simulation}.
+"""
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.pubsub import ZmqPubConnection, ZmqSubConnection
+from txzmq.pushpull import ZmqPushConnection, ZmqPullConnection
+from txzmq.req_rep import ZmqREQConnection, ZmqREPConnection
+from txzmq.req_rep import ZmqRequestTimeoutError
+from txzmq.simulation import ZmqSimulatedFactory
+
+
+class ZmqTestPullConnection(ZmqPullConnection):
+    def onPull(self, message):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(message)
+
+
+class ZmqTestSubConnection(ZmqSubConnection):
+    def gotMessage(self, message, tag):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append([tag, message])
+
+
+class ZmqTestREPConnection(ZmqREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        if messageParts[0] != 'ignore':
+            self.reply(messageId, *messageParts)
+
+
+class ZmqSimulationTestCase(unittest.TestCase):
+    """
+    Test case for connections over L{txzmq.simulation} transport.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.01)
+        self.clock = self.factory.reactor
+        self.bind = ZmqEndpoint(ZmqEndpointType.bind, "sim://test")
+        self.connect = ZmqEndpoint(ZmqEndpointType.connect, "sim://test")
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_latency(self):
+        r = ZmqTestPullConnection(self.factory, self.bind)
+        s = ZmqPushConnection(self.factory, self.connect)
+
+        s.push('abcd')
+        s.push('efgh')
+        self.clock.advance(0)
+        self.clock.advance(0.005)
+        self.failIf(hasattr(r, 'messages'))
+        self.clock.advance(0.005)
+        self.failUnlessEqual([['abcd'], ['efgh']], r.messages)
+
+    def test_connect_before_bind(self):
+        s = ZmqPushConnection(self.factory, self.connect)
+        s.push('abcd')
+        self.clock.run()
+        r = ZmqTestPullConnection(self.factory, self.bind)
+        self.clock.run()
+        self.failUnlessEqual([['abcd']], r.messages)
+
+    def test_backpressure(self):
+        r = ZmqTestPullConnection(self.factory, self.bind,
+                                  socketOptions={'HWM': 5})
+        s = ZmqPushConnection(self.factory, self.connect,
+                              socketOptions={'HWM': 5})
+        self.clock.removeReader(r)
+
+        for i in xrange(100):
+            s.push(str(i))
+        self.clock.run(1.0)
+        self.failUnlessEqual(90, len(s.queue))
+
+        self.clock.addReader(r)
+        self.clock.wakeUp(r.fileno())
+        self.clock.run(2.0)
+        self.failUnlessEqual(0, len(s.queue))
+        self.failUnlessEqual([[str(i)] for i in xrange(100)], r.messages)
+
+    def test_load_balancing(self):
+        r1 = ZmqTestPullConnection(self.factory, self.connect)
+        r2 = ZmqTestPullConnection(self.factory, self.connect)
+        s = ZmqPushConnection(self.factory, self.bind)
+
+        for i in xrange(10000):
+            s.push(str(i))
+        self.clock.run()
+        self.failUnlessEqual(5000, len(r1.messages))
+        self.failUnlessEqual(5000, len(r2.messages))
+        self.failUnlessEqual(10000, self.factory.context.messages)
+
+    def test_pubsub(self):
+        r = ZmqTestSubConnection(self.factory, self.connect)
+        r.subscribe('tag')
+        s = ZmqPubConnection(self.factory, self.bind)
+
+        s.publish('xyz', 'different-tag')
+        s.publish('abcd', 'tag1')
+        self.clock.run()
+        self.failUnlessEqual([['tag1', 'abcd']], r.messages)
+
+    def test_request_reply(self):
+        ZmqTestREPConnection(self.factory, self.bind)
+        s = ZmqREQConnection(self.factory, self.connect)
+
+        replies = []
+        s.sendMsg('abcd').addCallback(replies.append)
+        self.clock.run()
+        self.failUnlessEqual([['abcd']], replies)
+        self.failUnlessApproximates(0.02, self.clock.seconds(), 1e-9)
+
+    def test_disconnect(self):
+        r1 = ZmqTestPullConnection(self.factory, self.bind)
+        r2 = ZmqTestPullConnection(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://other"))
+        other = ZmqEndpoint(ZmqEndpointType.connect, "sim://other")
+        s = ZmqPushConnection(self.factory, self.connect)
+        s.addEndpoints([other])
+        socket = s.socket
+
+        s.removeEndpoints([self.connect])
+        for i in xrange(4):
+            s.push(str(i))
+        self.clock.run()
+        self.failUnlessIdentical(socket, s.socket)
+        self.failIf(hasattr(r1, 'messages'))
+        self.failUnlessEqual([[str(i)] for i in xrange(4)], r2.messages)
+
+    def test_unbind(self):
+        r = ZmqTestPullConnection(self.factory, self.bind)
+        s = ZmqPushConnection(self.factory, self.connect)
+        r.removeEndpoints([self.bind])
+        s.push('abcd')
+        self.clock.run()
+        self.failIf(hasattr(r, 'messages'))
+
+        r.addEndpoints([self.bind])
+        self.clock.run()
+        self.failUnlessEqual([['abcd']], r.messages)
+
+    def test_request_timeout(self):
+        ZmqTestREPConnection(self.factory, self.bind)
+        s = ZmqREQConnection(self.factory, self.connect)
+
+        d = s.sendMsg('ignore', timeout=5)
+        self.clock.run()
+        self.failUnlessEqual(5, self.clock.seconds())
+        return self.assertFailure(d, ZmqRequestTimeoutError)
+
+
+class ZmqSimulatedDropTestCase(unittest.TestCase):
+    """
+    Test case for drop model of L{txzmq.simulation}.
+    """
+
+    def run_drops(self):
+        factory = ZmqSimulatedFactory(dropRate=0.25, seed=42)
+        r = ZmqTestPullConnection(
+            factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://test"))
+        s = ZmqPushConnection(
+            factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://test"))
+        for i in xrange(1000):
+            s.push(str(i))
+        factory.reactor.run()
+        dropped = factory.context.dropped
+        factory.shutdown()
+        return dropped, r.messages
+
+    def test_drops(self):
+        dropped, messages = self.run_drops()
+        self.failUnless(200 < dropped < 300)
+        self.failUnlessEqual(1000 - dropped, len(messages))
+        self.failUnlessEqual((dropped, messages), self.run_drops())
@@ -0,0 +1,73 @@
+"""
+Tests for L{txzmq.spool}.
+"""
+import os
+
+from twisted.trial import unittest
+
+from txzmq.spool import ZmqSpool
+
+
+class ZmqSpoolTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.spool.ZmqSpool}.
+    """
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.spool = ZmqSpool(self.path, 128)
+
+    def tearDown(self):
+        self.spool.close()
+
+    def segments(self):
+        return sorted(os.listdir(self.path))
+
+    def test_fifo(self):
+        messages = [['part%d' % i, 'x' * i] for i in xrange(20)]
+        for message in messages:
+            self.spool.append(message)
+        self.failUnlessEqual(20, len(self.spool))
+        self.failUnless(len(self.segments()) > 1)
+
+        result = []
+        while self.spool.pending:
+            message, marker = self.spool.read()
+            result.append(message)
+            self.spool.ack(marker)
+        self.failUnlessEqual(messages, result)
+        self.failUnlessEqual(1, len(self.segments()))
+
+    def test_large_message(self):
+        self.spool.append(['0' * 1000])
+        self.spool.append(['1'])
+        self.failUnlessEqual(['0' * 1000], self.spool.read()[0])
+        self.failUnlessEqual(['1'], self.spool.read()[0])
+
+    def test_reopen(self):
+        for i in xrange(10):
+            self.spool.append([str(i) * 20])
+        for i in xrange(5):
+            message, marker = self.spool.read()
+        self.spool.ack(marker)
+        # read, but not acknowledged
+        self.spool.read()
+        self.spool.close()
+
+        self.spool = ZmqSpool(self.path, 128)
+        self.failUnlessEqual(5, self.spool.pending)
+        self.failUnlessEqual(['5' * 20], self.spool.read()[0])
+
+    def test_compaction(self):
+        for i in xrange(10):
+            self.spool.append([str(i) * 20])
+        markers = [self.spool.read()[1] for _ in xrange(10)]
+        count = len(self.segments())
+
+        self.spool.ack(markers[4])
+        self.failUnless(len(self.segments()) < count)
+        self.spool.ack(markers[9])
+        self.failUnlessEqual(1, len(self.segments()))
+
+        self.spool.append(['abcd'])
+        self.failUnlessEqual(['abcd'], self.spool.read()[0])
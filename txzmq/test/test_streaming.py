@@ -0,0 +1,188 @@
+"""
+Tests for L{txzmq.streaming}.
+"""
+import os
+from StringIO import StringIO
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.simulation import ZmqSimulatedFactory
+from txzmq.streaming import ZmqMappedFileConsumer, ZmqStreamAbortedError
+from txzmq.streaming import ZmqStreamReceiverConnection
+from txzmq.streaming import ZmqStreamSenderConnection
+
+
+class ZmqTestSender(ZmqStreamSenderConnection):
+    chunkSize = 1000
+
+
+class ZmqTestConsumer(object):
+    """
+    Consumer writing chunks only when told to.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.writes = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(data)
+        d = defer.Deferred()
+        self.writes.append(d)
+        return d
+
+    def close(self):
+        self.closed = True
+
+
+class ZmqTestProducer(object):
+    """
+    Source producing chunks asynchronously.
+    """
+
+    def __init__(self, clock, chunks):
+        self.clock = clock
+        self.chunks = list(chunks)
+
+    def read(self, size):
+        if self.chunks and self.chunks[0] == 'fail':
+            raise IOError("fail")
+        chunk = self.chunks.pop(0) if self.chunks else ''
+        return task.deferLater(self.clock, 0.01, lambda: chunk)
+
+
+class ZmqTestReceiver(ZmqStreamReceiverConnection):
+    window = 4
+    peerIdleTimeout = None
+    consumer = None
+
+    def streamReceived(self, sender, size, metadata):
+        self.received = (sender, size, metadata)
+        if metadata == 'reject':
+            return None
+        if self.consumer is None:
+            self.consumer = ZmqMappedFileConsumer(metadata, size)
+        return self.consumer
+
+    def streamCompleted(self, sender, consumer):
+        self.completed = consumer
+
+    def streamAborted(self, sender, consumer, reason):
+        self.aborted = reason
+        ZmqStreamReceiverConnection.streamAborted(
+            self, sender, consumer, reason)
+
+
+class ZmqStreamingTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.streaming}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.001)
+        self.clock = self.factory.reactor
+        self.r = ZmqTestReceiver(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://stream"))
+        self.s = ZmqTestSender(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect,
+                                      "sim://stream"), identity='sender')
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def test_file(self):
+        source = self.mktemp()
+        target = self.mktemp()
+        payload = os.urandom(10500)
+        with open(source, 'wb') as f:
+            f.write(payload)
+
+        d = self.s.sendFile(source, target)
+        self.clock.run()
+
+        self.failUnlessEqual(('sender', 10500, target), self.r.received)
+        self.failUnlessIdentical(self.r.consumer, self.r.completed)
+        self.failUnlessEqual(10500, self.successResultOf(d))
+        with open(target, 'rb') as f:
+            self.failUnlessEqual(payload, f.read())
+        self.failUnlessEqual({}, self.s.streams)
+        self.failUnlessEqual({}, self.r.streams)
+
+    def test_window(self):
+        consumer = self.r.consumer = ZmqTestConsumer()
+        d = self.s.sendStream(StringIO('x' * 9500), metadata='test')
+        self.clock.run()
+
+        # first chunk is being written, the rest of window is pending
+        self.failUnlessEqual(('sender', None, 'test'), self.r.received)
+        self.failUnlessEqual(1, len(consumer.chunks))
+        self.failUnlessEqual(4000, self.s.streams.values()[0].sent)
+
+        while not d.called:
+            consumer.writes[-1].callback(None)
+            self.clock.run()
+            stream = self.s.streams.values()
+            if stream:
+                self.failUnless(
+                    stream[0].sent - len(consumer.chunks) * 1000 <= 4000)
+
+        self.failUnlessEqual(9500, self.successResultOf(d))
+        self.failUnlessEqual('x' * 9500, ''.join(consumer.chunks))
+        self.failUnless(consumer.closed)
+
+    def test_producer(self):
+        consumer = self.r.consumer = ZmqTestConsumer()
+        d = self.s.sendStream(ZmqTestProducer(self.clock, ['ab', 'cd']))
+        while not d.called:
+            self.clock.advance(0.001)
+            for write in consumer.writes:
+                if not write.called:
+                    write.callback(None)
+
+        self.failUnlessEqual(4, self.successResultOf(d))
+        self.failUnlessEqual(['ab', 'cd'], consumer.chunks)
+
+    def test_reject(self):
+        d = self.s.sendStream(StringIO('abcd'), metadata='reject')
+        self.clock.run()
+        self.failureResultOf(d, ZmqStreamAbortedError)
+        self.failUnlessEqual({}, self.s.streams)
+
+    def test_read_failure(self):
+        consumer = self.r.consumer = ZmqTestConsumer()
+        d = self.s.sendStream(ZmqTestProducer(self.clock, ['ab', 'fail']))
+        while not d.called:
+            self.clock.advance(0.001)
+            for write in consumer.writes:
+                if not write.called:
+                    write.callback(None)
+        self.clock.run()
+
+        self.failureResultOf(d, ZmqStreamAbortedError)
+        self.failUnlessEqual(1, len(self.flushLoggedErrors(IOError)))
+        self.failUnlessEqual("Read failed", self.r.aborted)
+        self.failUnless(consumer.closed)
+        self.failUnlessEqual({}, self.r.streams)
+
+    def test_size_mismatch(self):
+        self.r.consumer = StringIO()
+        d = self.s.sendStream(StringIO('x' * 1500), size=2000)
+        self.clock.run()
+
+        self.failureResultOf(d, ZmqStreamAbortedError)
+        self.failUnlessEqual("Expected 2000 bytes, received 1500",
+                             self.r.aborted)
+        self.failIf(hasattr(self.r, 'completed'))
+        self.failUnlessEqual({}, self.r.streams)
+        self.failUnlessEqual({}, self.s.streams)
+
+    def test_single_endpoint(self):
+        other = ZmqEndpoint(ZmqEndpointType.connect, "sim://other")
+        self.failUnlessRaises(ValueError, self.s.addEndpoints, [other])
+        self.failUnlessRaises(ValueError, self.s.setEndpoints,
+                              self.s.endpoints + [other])
+        self.s.setEndpoints([other])
+        self.failUnlessEqual([other], self.s.endpoints)
@@ -0,0 +1,140 @@
+"""
+Tests for L{txzmq.tracing}.
+"""
+from twisted.trial import unittest
+
+from txzmq.connection import ZmqEndpoint, ZmqEndpointType
+from txzmq.req_rep import ZmqREPConnection
+from txzmq.simulation import ZmqSimulatedFactory
+from txzmq.tracing import ZmqLatencyHistogram, ZmqTracingREQConnection
+from txzmq.tracing import ZmqTracingREPConnection
+
+
+class ZmqTestREPConnection(ZmqREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(messageParts)
+        self.reply(messageId, *messageParts)
+
+
+class ZmqTestTracingREPConnection(ZmqTracingREPConnection):
+    def gotMessage(self, messageId, *messageParts):
+        if not hasattr(self, 'messages'):
+            self.messages = []
+
+        self.messages.append(messageParts)
+        self.factory.reactor.callLater(
+            0.1, self.reply, messageId, *messageParts)
+
+
+class ZmqTestTracingREQConnection(ZmqTracingREQConnection):
+    sampleRate = 1.0
+
+
+class ZmqLatencyHistogramTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.tracing.ZmqLatencyHistogram}.
+    """
+
+    def test_percentile(self):
+        histogram = ZmqLatencyHistogram()
+        self.failUnlessEqual(0.0, histogram.percentile(50))
+        for latency in [0.000003] * 98 + [0.01, 0.5]:
+            histogram.add(latency)
+        histogram.add(-1)
+
+        self.failUnlessEqual(101, histogram.count)
+        self.failUnlessEqual(1, histogram.counts[0])
+        self.failUnlessEqual(98, histogram.counts[2])
+        self.failUnlessEqual(0.000004, histogram.percentile(50))
+        self.failUnlessEqual(0.016384, histogram.percentile(99))
+        self.failUnlessEqual(0.5, histogram.percentile(100))
+        self.failUnlessEqual(0.5, histogram.max)
+
+
+class ZmqTracingTestCase(unittest.TestCase):
+    """
+    Test case for L{txzmq.tracing.ZmqTracingREQConnection} and
+    L{txzmq.tracing.ZmqTracingREPConnection}.
+    """
+
+    def setUp(self):
+        self.factory = ZmqSimulatedFactory(latency=0.01)
+        self.clock = self.factory.reactor
+
+    def tearDown(self):
+        self.factory.shutdown()
+
+    def connect(self, repClass, reqClass=ZmqTestTracingREQConnection):
+        self.r = repClass(
+            self.factory, ZmqEndpoint(ZmqEndpointType.bind, "sim://trace"))
+        self.s = reqClass(
+            self.factory, ZmqEndpoint(ZmqEndpointType.connect, "sim://trace"))
+
+    def stage(self, latencies, name):
+        histogram = latencies[name]
+        return histogram.count, round(histogram.mean(), 6)
+
+    def test_stages(self):
+        self.connect(ZmqTestTracingREPConnection)
+        d = self.s.sendMsg('a', 'b')
+        self.clock.advance(0.05)
+        self.s.sendMsg('c')
+        self.clock.run()
+
+        self.failUnlessEqual(['a', 'b'], self.successResultOf(d))
+        self.failUnlessEqual([('a', 'b'), ('c',)], self.r.messages)
+        client = self.s.latencies
+        self.failUnlessEqual(
+            ['backlog', 'handler', 'queue', 'return', 'total', 'wire'],
+            sorted(client.histograms))
+        # first request waits in the queue until connection is established
+        self.failUnlessEqual((2, 0.025), self.stage(client, 'queue'))
+        self.failUnlessEqual(0.05, client['queue'].max)
+        self.failUnlessEqual((2, 0.01), self.stage(client, 'wire'))
+        self.failUnlessEqual((2, 0.0), self.stage(client, 'backlog'))
+        self.failUnlessEqual((2, 0.1), self.stage(client, 'handler'))
+        self.failUnlessEqual((2, 0.01), self.stage(client, 'return'))
+        self.failUnlessEqual((2, 0.145), self.stage(client, 'total'))
+
+        server = self.r.latencies
+        self.failUnlessEqual(
+            ['backlog', 'handler', 'reply'], sorted(server.histograms))
+        self.failUnlessEqual((2, 0.1), self.stage(server, 'handler'))
+        self.failUnlessEqual((2, 0.0), self.stage(server, 'reply'))
+        self.failUnlessEqual({}, self.s._traces)
+        self.failUnlessEqual({}, self.r._traces)
+
+    def test_sampling(self):
+        self.connect(ZmqTestTracingREPConnection)
+        self.s.sampleRate = 0.25
+        deferreds = [self.s.sendMsg(str(i)) for i in xrange(8)]
+        self.clock.run()
+
+        self.failUnlessEqual(
+            [[str(i)] for i in xrange(8)],
+            [self.successResultOf(d) for d in deferreds])
+        self.failUnlessEqual(2, self.s.latencies['total'].count)
+        self.failUnlessEqual(2, self.r.latencies['handler'].count)
+
+    def test_untraced_server(self):
+        self.connect(ZmqTestREPConnection)
+        d = self.s.sendMsg('a')
+        self.clock.run()
+
+        self.failUnlessEqual(['a'], self.successResultOf(d))
+        self.failUnlessEqual([('a',)], self.r.messages)
+        self.failUnlessEqual(
+            ['queue', 'total'], sorted(self.s.latencies.histograms))
+        self.failUnlessEqual((1, 0.02), self.stage(self.s.latencies, 'total'))
+
+    def test_timeout(self):
+        self.connect(ZmqTestTracingREPConnection)
+        d = self.s.sendMsg('a', timeout=0.05)
+        self.clock.run()
+
+        self.failureResultOf(d)
+        self.failUnlessEqual({}, self.s._traces)
+        self.failUnlessEqual({}, self.s.latencies.histograms)
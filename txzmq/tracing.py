@@ -0,0 +1,363 @@
+"""
+Latency tracing of REQ-REP requests with per-stage histograms.
+
+Sampled requests carry trace frame in the envelope, just before message
+ID. Envelope is echoed back by L{ZmqREPConnection} and passed through by
+ROUTER-DEALER proxies, so tracing client works with any server;
+L{ZmqTracingREPConnection} additionally fills in timestamps of server
+stages. Timestamps come from the reactor of the factory, so cross-host
+stage (C{wire}) includes clock skew of the hosts.
+
+Request goes through stages (timestamps are taken at the end of the
+stage):
+
+  - C{queue}: request waits in the send queue of the client;
+  - C{wire}: request travels to the server (through proxies, if any);
+  - C{backlog}: server reads the socket and dispatches messages received
+    before the request;
+  - C{handler}: server handles the request, up to the reply;
+  - C{reply}: reply waits in the send queue of the server;
+  - C{return}: reply is queued by the server and travels back;
+  - C{total}: whole round trip, as seen by the client.
+"""
+import math
+import struct
+from collections import deque
+
+from txzmq.req_rep import ZmqREQConnection, ZmqREPConnection
+
+
+TRACE_MAGIC = 'TXZTRACE'
+TRACE_STAMPS = struct.Struct('!ddd')
+
+
+class ZmqLatencyHistogram(object):
+    """
+    Histogram of latencies with logarithmic buckets: bucket M{n} counts
+    latencies up to M{2^n} microseconds.
+
+    @cvar buckets: number of buckets, longer latencies fall into the last
+    @type buckets: C{int}
+
+    @ivar counts: number of latencies in every bucket
+    @type counts: C{list} of C{int}
+    @ivar count: number of latencies recorded
+    @type count: C{int}
+    @ivar total: sum of latencies, seconds
+    @type total: C{float}
+    @ivar max: longest latency, seconds
+    @type max: C{float}
+    """
+
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "%s(count=%d, mean=%.6f, p50=%.6f, p99=%.6f, max=%.6f)" % (
+            self.__class__.__name__, self.count, self.mean(),
+            self.percentile(50), self.percentile(99), self.max)
+
+    def add(self, latency):
+        """
+        Record latency.
+
+        @param latency: latency, seconds (negative is counted as zero)
+        @type latency: C{float}
+        """
+        latency = max(latency, 0.0)
+        _, bucket = math.frexp(latency * 1e6)
+        self.counts[min(max(bucket, 0), self.buckets - 1)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def mean(self):
+        """
+        Mean latency.
+
+        @rtype: C{float}
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percentile):
+        """
+        Latency percentile, rounded up to the bucket boundary.
+
+        @param percentile: percentile, from 0 to 100
+        @type percentile: C{float}
+        @return: latency, seconds
+        @rtype: C{float}
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(self.count * percentile / 100.0)))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        return min(2 ** bucket / 1e6, self.max)
+
+
+class ZmqLatencyStages(object):
+    """
+    Latency histograms of stages of traced requests on one side.
+
+    Also tracks when traced messages leave the send queue of the
+    connection: as queue is FIFO, message has been sent when all frames
+    queued up to it have been sent.
+
+    @ivar histograms: histograms by stage name
+    @type histograms: C{dict}
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self._queued = 0
+        self._unsent = deque()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, sorted(self.histograms))
+
+    def __getitem__(self, stage):
+        return self.histograms[stage]
+
+    def add(self, stage, latency):
+        """
+        Record latency of the stage.
+
+        @param stage: stage name
+        @type stage: C{str}
+        @param latency: latency, seconds
+        @type latency: C{float}
+        """
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = ZmqLatencyHistogram()
+        histogram.add(latency)
+
+    def queued(self, connection, message, priority, callback=None):
+        """
+        Account for message put into the send queue.
+
+        @param connection: connection sending the message
+        @type connection: L{ZmqConnection}
+        @param message: message data
+        @param priority: priority passed to C{send}
+        @type priority: C{int}
+        @param callback: called with the time message leaves the queue
+        """
+        if priority is not None and \
+                connection.lanes[priority] is not connection.queue:
+            return
+        self._queued += len(message) if hasattr(message, '__iter__') else 1
+        if callback is not None:
+            self._unsent.append((self._queued, callback))
+
+    def sent(self, connection):
+        """
+        Fire callbacks of traced messages which have left the send queue.
+
+        @param connection: connection sending the messages
+        @type connection: L{ZmqConnection}
+        """
+        if not self._unsent:
+            return
+        sent = self._queued - len(connection.queue)
+        now = connection.factory.reactor.seconds()
+        while self._unsent and self._unsent[0][0] <= sent:
+            self._unsent.popleft()[1](now)
+
+
+class _ClientTrace(object):
+    """
+    Trace of single request on the client.
+
+    @ivar enqueued: time request has been queued
+    @type enqueued: C{float}
+    @ivar sent: time request has left the send queue
+    @type sent: C{float}
+    """
+
+    __slots__ = ('enqueued', 'sent')
+
+    def __init__(self, enqueued):
+        self.enqueued = self.sent = enqueued
+
+    def gotSent(self, now):
+        self.sent = now
+
+
+class ZmqTracingREQConnection(ZmqREQConnection):
+    """
+    REQ connection tracing sampled requests.
+
+    Server stages are traced only if server is
+    L{ZmqTracingREPConnection}, otherwise just C{queue} and C{total}
+    stages are recorded.
+
+    @cvar sampleRate: fraction of requests to trace, from 0 to 1;
+        requests are sampled evenly (every 100th for C{0.01})
+    @type sampleRate: C{float}
+
+    @ivar latencies: latency histograms by stage
+    @type latencies: L{ZmqLatencyStages}
+    """
+
+    sampleRate = 0.01
+
+    def __init__(self, *args, **kwargs):
+        self.latencies = ZmqLatencyStages()
+        self._traces = {}
+        self._sampleCredit = 0.0
+        ZmqREQConnection.__init__(self, *args, **kwargs)
+
+    def send(self, message, priority=None):
+        ZmqREQConnection.send(self, message, priority)
+        self.latencies.queued(self, message, priority)
+
+    def _sendQueued(self):
+        ZmqREQConnection._sendQueued(self)
+        self.latencies.sent(self)
+
+    def _sendRequest(self, messageId, messageParts):
+        """
+        Put request on the wire, with trace frame if it's sampled.
+        """
+        self._sampleCredit += self.sampleRate
+        if self._sampleCredit < 1:
+            ZmqREQConnection._sendRequest(self, messageId, messageParts)
+            return
+        self._sampleCredit -= 1
+
+        trace = self._traces[messageId] = _ClientTrace(
+            self.factory.reactor.seconds())
+        message = [TRACE_MAGIC, messageId, ''] + list(messageParts)
+        ZmqREQConnection.send(self, message)
+        self.latencies.queued(self, message, None, trace.gotSent)
+
+    def messageReceived(self, message):
+        """
+        Called on incoming message from ZeroMQ.
+
+        @param message: message data
+        """
+        if message[0].startswith(TRACE_MAGIC):
+            self._gotTrace(message[1], message[0])
+            message = message[1:]
+        ZmqREQConnection.messageReceived(self, message)
+
+    def _gotTrace(self, messageId, frame):
+        """
+        Record stages of replied request.
+
+        @param messageId: message ID
+        @type messageId: C{str}
+        @param frame: trace frame
+        @type frame: C{str}
+        """
+        trace = self._traces.pop(messageId, None)
+        if trace is None or messageId not in self._requests:
+            return
+        now = self.factory.reactor.seconds()
+        latencies = self.latencies
+        latencies.add('queue', trace.sent - trace.enqueued)
+        if len(frame) == len(TRACE_MAGIC) + TRACE_STAMPS.size:
+            received, started, replied = TRACE_STAMPS.unpack_from(
+                frame, len(TRACE_MAGIC))
+            latencies.add('wire', received - trace.sent)
+            latencies.add('backlog', started - received)
+            latencies.add('handler', replied - started)
+            latencies.add('return', now - replied)
+        latencies.add('total', now - trace.enqueued)
+
+    def _cancel(self, msgId):
+        self._traces.pop(msgId, None)
+        ZmqREQConnection._cancel(self, msgId)
+
+    def _timeoutRequest(self, msgId):
+        self._traces.pop(msgId, None)
+        ZmqREQConnection._timeoutRequest(self, msgId)
+
+    def _peerLost(self):
+        self._traces.clear()
+        ZmqREQConnection._peerLost(self)
+
+
+class ZmqTracingREPConnection(ZmqREPConnection):
+    """
+    REP connection recording server stages of traced requests and
+    reporting them back to the client in the trace frame.
+
+    Untraced requests are handled as by L{ZmqREPConnection}.
+
+    @ivar latencies: latency histograms by stage (C{backlog}, C{handler}
+        and C{reply})
+    @type latencies: L{ZmqLatencyStages}
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.latencies = ZmqLatencyStages()
+        self._traces = {}
+        self._readAt = None
+        ZmqREPConnection.__init__(self, *args, **kwargs)
+
+    def doRead(self):
+        self._readAt = self.factory.reactor.seconds()
+        try:
+            ZmqREPConnection.doRead(self)
+        finally:
+            self._readAt = None
+
+    def send(self, message, priority=None):
+        ZmqREPConnection.send(self, message, priority)
+        self.latencies.queued(self, message, priority)
+
+    def _sendQueued(self):
+        ZmqREPConnection._sendQueued(self)
+        self.latencies.sent(self)
+
+    def messageReceived(self, message):
+        """
+        Called on incoming message from ZeroMQ.
+
+        @param message: message data
+        """
+        i = message.index('')
+        if i > 1 and message[i - 2].startswith(TRACE_MAGIC):
+            now = self.factory.reactor.seconds()
+            received = self._readAt if self._readAt is not None else now
+            self._traces[message[i - 1]] = (received, now)
+        ZmqREPConnection.messageReceived(self, message)
+
+    def reply(self, messageId, *messageParts):
+        """
+        Send reply to the request.
+
+        @param messageId: message uuid
+        @type messageId: C{str}
+        @param messageParts: message data
+        """
+        trace = self._traces.pop(messageId, None)
+        if trace is None:
+            ZmqREPConnection.reply(self, messageId, *messageParts)
+            return
+
+        received, started = trace
+        now = self.factory.reactor.seconds()
+        self.latencies.add('backlog', started - received)
+        self.latencies.add('handler', now - started)
+        routingInfo = self._routingInfo.pop(messageId)
+        routingInfo[-1] = TRACE_MAGIC + TRACE_STAMPS.pack(
+            received, started, now)
+        message = routingInfo + [messageId, ''] + list(messageParts)
+        ZmqREPConnection.send(self, message)
+        self.latencies.queued(
+            self, message, None,
+            lambda sent: self.latencies.add('reply', sent - now))